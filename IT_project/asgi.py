@@ -2,6 +2,23 @@
 ASGI config for IT_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The read-heavy pages are served by the async views in
+``wandercritic/async_views.py`` (``ASYNC_VIEWS=0`` keeps the sync ones).
+
+Run it with an ASGI server instead of the WSGI one, e.g.::
+
+    uvicorn IT_project.asgi:application --host 0.0.0.0 --port 8000 --workers 4
+    daphne -b 0.0.0.0 -p 8000 IT_project.asgi:application
+
+The in-process explore and autocomplete indexes are built on lifespan
+startup, before the first request (Django itself ignores lifespan events);
+under WSGI they are built in the background after the first request.
+
+Static files are not served by the application; serve ``STATIC_ROOT`` from
+the web server as with WSGI. Uploaded media can be, but without sendfile, so
+set ``MEDIA_ACCEL`` to have the front proxy send it (see
+``wandercritic/media.py``). ``python manage.py benchmark_load`` compares
+this against the WSGI path under concurrent load.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -9,8 +26,36 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 
+from asgiref.sync import sync_to_async
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "IT_project.settings")
+os.environ.setdefault("ASYNC_VIEWS", "1")
+
+django_application = get_asgi_application()
+
+from django.db import connections  # noqa: E402
+from wandercritic import autocomplete, bitmap_index  # noqa: E402
+
+
+def warm_up():
+    """Build the in-process indexes before the first request rather than after it."""
+    try:
+        bitmap_index.warm_up()
+        autocomplete.warm_up()
+    finally:
+        connections.close_all()
+
 
-application = get_asgi_application()
+async def application(scope, receive, send):
+    # Django only handles HTTP and websockets; answer the lifespan protocol here
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await sync_to_async(warm_up)()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
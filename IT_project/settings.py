@@ -49,6 +49,7 @@ SITE_ID = 1
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "wandercritic.static_assets.StaticFilesMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -56,6 +57,8 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "allauth.account.middleware.AccountMiddleware",
+    "wandercritic.instrumentation.QueryCountMiddleware",
+    "wandercritic.surrogate.SurrogatePurgeMiddleware",
 ]
 
 ROOT_URLCONF = "IT_project.urls"
@@ -86,18 +89,144 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "IT_project.wsgi.application"
 
+# Serve index, explore, place_list, place_detail and my_places with the async
+# views in wandercritic/async_views.py; IT_project/asgi.py turns this on
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', '') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Pragmas of the production profile, run on every new connection:
+# WAL lets readers carry on while one writer commits, NORMAL only syncs at
+# checkpoints (safe with WAL), reads go through a memory map and a larger
+# page cache, and a busy connection waits for the lock instead of failing
+# with "database is locked"
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -32000,  # KiB
+    'busy_timeout': 10000,  # ms
+    'temp_store': 'MEMORY',
+}
+
+# DATABASE_PROFILE selects the bare SQLite setup (default) or the production
+# tuning for a single host serving concurrent writes. BEGIN IMMEDIATE takes
+# the write lock when a transaction starts, so two transactions that read
+# and then write cannot deadlock upgrading their locks. Connections are kept
+# for CONN_MAX_AGE seconds, except under ASGI where each request thread would
+# keep its own (see python manage.py benchmark_writes)
+DATABASE_PROFILES = {
+    'default': {
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': False,
+        'OPTIONS': {},
+    },
+    'production': {
+        'CONN_MAX_AGE': 0 if ASYNC_VIEWS else 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name} = {value}' for name, value in SQLITE_PRAGMAS.items()),
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+}
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'default')
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        **DATABASE_PROFILES[DATABASE_PROFILE],
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# CACHE_BACKEND selects local memory (default), a file-based cache or Redis
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+CACHE_LOCATION = os.environ.get('CACHE_LOCATION', {
+    'locmem': 'wandercritic',
+    'file': os.path.join(BASE_DIR, '.cache'),
+    'redis': 'redis://127.0.0.1:6379/1',
+}[CACHE_BACKEND])
+
+CACHES = {
+    "default": {
+        "BACKEND": CACHE_BACKENDS[CACHE_BACKEND],
+        "LOCATION": CACHE_LOCATION,
+        "KEY_PREFIX": "wandercritic",
+    }
+}
+
+# Lifetime in seconds of cached anonymous pages (see wandercritic/caching.py)
+CACHE_TTL = 300
+# Seconds an expired entry is still served while one worker refreshes it
+CACHE_STALE_TTL = 60
+# Longest a worker may hold the refresh lock (and others wait for it)
+CACHE_LOCK_TIMEOUT = 10
+# XFetch early-expiry factor; 0 disables early refreshes, > 1 refreshes earlier
+CACHE_EARLY_EXPIRY_BETA = 1.0
+# Seconds an HTTP cache in front of the site may serve an anonymous place or
+# listing page before revalidating it (see wandercritic/conditional.py)
+PAGE_SHARED_MAX_AGE = 60
+# Part of every page ETag; change it on deploys that change templates
+PAGE_ETAG_VERSION = os.environ.get('PAGE_ETAG_VERSION', '1')
+
+# Reverse-proxy cache purging by surrogate key (see wandercritic/surrogate.py)
+# wandercritic.surrogate.MemoryPurgeBackend records the latest purges in process;
+# wandercritic.surrogate.HTTPPurgeBackend sends them to SURROGATE_PURGE_URL
+SURROGATE_PURGE_BACKEND = os.environ.get('SURROGATE_PURGE_BACKEND', 'wandercritic.surrogate.MemoryPurgeBackend')
+SURROGATE_PURGE_URL = os.environ.get('SURROGATE_PURGE_URL', 'http://127.0.0.1:6081/')
+# Keys per purge request
+SURROGATE_PURGE_BATCH_SIZE = 256
+# Seconds the proxy keeps a tagged anonymous page between purges; rank
+# changes that move a place onto a listing page it was not tagged on are
+# picked up on expiry
+SURROGATE_MAX_AGE = 600
+
+# In-memory bitmap index for explore filters (see wandercritic/bitmap_index.py)
+BITMAP_INDEX_ENABLED = True
+# Age in seconds after which the index is rebuilt in the background to pick
+# up changes made by other processes, when the cache is the per-process
+# locmem one; with a shared cache (file, redis) rebuilds follow their changes
+BITMAP_INDEX_REBUILD_INTERVAL = 30
+
+# Search-box suggestions (see wandercritic/autocomplete.py)
+AUTOCOMPLETE_LIMIT = 8
+# Shortest query answered, in characters
+AUTOCOMPLETE_MIN_LENGTH = 2
+# Queries this long also match prefixes one typo away
+AUTOCOMPLETE_TYPO_MIN_LENGTH = 4
+# Age in seconds after which the index is rebuilt in the background with the
+# locmem cache; as with BITMAP_INDEX_REBUILD_INTERVAL
+AUTOCOMPLETE_REBUILD_INTERVAL = 60
+
+# Database query instrumentation (see wandercritic/instrumentation.py)
+# Add X-DB-Queries/X-DB-Time/X-DB-Duplicates headers to every response
+QUERY_COUNT_HEADER = DEBUG or os.environ.get('QUERY_COUNT_HEADER', '') == '1'
+# Log query count and time of every request (over-budget requests are always logged)
+QUERY_COUNT_LOG = os.environ.get('QUERY_COUNT_LOG', '') == '1'
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "wandercritic": {"handlers": ["console"], "level": "INFO"},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -142,10 +271,62 @@ USE_TZ = True
 STATIC_DIR = os.path.join(BASE_DIR, 'static')
 STATICFILES_DIRS = [STATIC_DIR, ] 
 STATIC_URL = '/static/'
+# collectstatic builds hashed, minified and precompressed files here, served
+# by wandercritic.static_assets.StaticFilesMiddleware
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 # Media files (User uploaded files)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Seconds after an upload is stored during which its blob is never deleted,
+# since the row pointing at it may not have committed yet; dedupe_media
+# --prune removes it afterwards if nothing references it
+MEDIA_RELEASE_GRACE = 60 * 60
+# Served by wandercritic.media.serve. Content-addressed uploads are cached
+# as immutable; other files (renditions) for this many seconds
+MEDIA_CACHE_MAX_AGE = 24 * 60 * 60
+# Let the front proxy send the file: '' (Django streams it),
+# 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache mod_xsendfile, lighttpd).
+# Recommended under ASGI, where Django cannot use sendfile
+MEDIA_ACCEL = os.environ.get('MEDIA_ACCEL', '')
+# nginx `internal` location aliased to MEDIA_ROOT, for x-accel-redirect
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+# Uploads are stored under the SHA-256 of their content so identical images
+# share one file (see wandercritic/storage.py). Static files get content
+# hashed names plus .gz/.br and .webp/.avif siblings (see
+# wandercritic/static_assets.py)
+STORAGES = {
+    "default": {
+        "BACKEND": "wandercritic.storage.ContentAddressedStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "wandercritic.static_assets.StaticAssetStorage",
+    },
+}
+
+# Resized image renditions, relative to MEDIA_ROOT (see wandercritic/images.py)
+IMAGE_RENDITIONS_DIR = 'renditions'
+
+# Pagination
+# Number of place cards per page on explore and the place list
+PLACES_PAGE_SIZE = 12
+# Number of reviews per page on a place detail page
+REVIEWS_PAGE_SIZE = 10
+# 'signed' (tamper-proof, default) or 'base64' (plain urlsafe JSON)
+PAGINATION_CURSOR_ENCODING = 'signed'
+
+# Report moderation (see wandercritic/moderation.py)
+# Reports per page of the admin report list
+MODERATION_REPORTS_PAGE_SIZE = 10
+# Report groups per page of the moderation queue
+MODERATION_QUEUE_PAGE_SIZE = 20
+# Hours after which the priority boost of a group's latest report halves
+MODERATION_RECENCY_HALF_LIFE = 24
+
+# Admin and export_rows exports (see wandercritic/exports.py)
+# Rows fetched from the database per round trip while streaming
+EXPORT_CHUNK_SIZE = 2000
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -1,5 +1,18 @@
 from django.contrib import admin
-from .models import User, Place, PlaceImage, PlaceCategory, Tag, TravelAgentApplication, Report
+from . import exports, moderation
+from .models import User, Place, PlaceImage, PlaceCategory, Tag, TravelAgentApplication, Report, Review
+
+
+# Exports stream the selected rows, or with "select all" every row matching
+# the current filters and search
+@admin.action(description='Export selected rows as CSV', permissions=['view'])
+def export_csv(modeladmin, request, queryset):
+    return exports.streaming_response(queryset, 'csv', request)
+
+
+@admin.action(description='Export selected rows as JSONL', permissions=['view'])
+def export_jsonl(modeladmin, request, queryset):
+    return exports.streaming_response(queryset, 'jsonl', request)
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -13,6 +26,17 @@ class PlaceAdmin(admin.ModelAdmin):
     list_filter = ('categories', 'created_at')
     search_fields = ('name', 'description', 'location')
     prepopulated_fields = {'slug': ('name',)}
+    actions = [export_csv, export_jsonl]
+
+@admin.register(Review)
+class ReviewAdmin(admin.ModelAdmin):
+    list_display = ('place', 'user', 'rating', 'created_at')
+    list_filter = ('rating', 'created_at')
+    search_fields = ('place__name', 'user__username', 'comment')
+    list_select_related = ('place', 'user')
+    raw_id_fields = ('place', 'user')
+    readonly_fields = ('created_at', 'updated_at')
+    actions = [export_csv, export_jsonl]
 
 @admin.register(PlaceImage)
 class PlaceImageAdmin(admin.ModelAdmin):
@@ -36,10 +60,24 @@ class TravelAgentApplicationAdmin(admin.ModelAdmin):
     list_filter = ('status', 'created_at')
     search_fields = ('full_name', 'user__username', 'company_name')
     readonly_fields = ('created_at', 'updated_at')
+    actions = [export_csv, export_jsonl]
+
+@admin.action(description='Resolve selected pending reports', permissions=['change'])
+def resolve_reports(modeladmin, request, queryset):
+    closed = moderation.close(queryset, 'resolve', request.user)
+    modeladmin.message_user(request, f'{closed} reports resolved.')
+
+
+@admin.action(description='Dismiss selected pending reports', permissions=['change'])
+def dismiss_reports(modeladmin, request, queryset):
+    closed = moderation.close(queryset, 'dismiss', request.user)
+    modeladmin.message_user(request, f'{closed} reports dismissed.')
+
 
 @admin.register(Report)
 class ReportAdmin(admin.ModelAdmin):
     list_display = ('reporter', 'place', 'report_type', 'status', 'created_at')
     list_filter = ('status', 'report_type', 'created_at')
     search_fields = ('reporter__username', 'place__name', 'description')
-    readonly_fields = ('created_at', 'resolved_at')
\ No newline at end of file
+    readonly_fields = ('created_at', 'resolved_at')
+    actions = [resolve_reports, dismiss_reports, export_csv, export_jsonl]
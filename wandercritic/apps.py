@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class WandercriticConfig(AppConfig):
+    name = 'wandercritic'
+
+    def ready(self):
+        # Connect the model signal handlers (search index sync etc.)
+        from . import signals  # noqa: F401
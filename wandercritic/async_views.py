@@ -0,0 +1,164 @@
+"""
+Async implementations of the read-heavy pages, served under ASGI.
+
+``wandercritic/urls.py`` routes ``index``, ``explore``, ``place_list``,
+``place_detail`` and ``my_places`` here when ``ASYNC_VIEWS`` is on (the
+default in ``IT_project/asgi.py``). They read through Django's async ORM and
+start a page's independent queries together with ``asyncio.gather``, so the
+event loop serves other requests while a page waits on the database instead
+of holding a worker thread for the whole request. Django still runs the ORM
+calls of one request in its thread-sensitive executor, one at a time on the
+same connection.
+
+Everything a template shows is loaded before rendering; templates are
+rendered in that executor too, where lazy lookups (``user``, messages) may
+still query.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import aget_object_or_404, render
+
+from . import facets, ratings
+from .caching import cache_anonymous
+from . import surrogate
+from .conditional import catalogue_version, conditional_page, homepage_version, place_version
+from .instrumentation import query_budget
+from .models import EXPLORE_ORDERING, Place, PlaceCategory, Review, Tag, WebsiteReview
+from .pagination import InvalidCursor, KeysetPaginator
+from .views import (PLACE_CARD_FIELDS, PLACE_LIST_ORDERING, _explore_facet_counts,
+                    _explore_page, _page_urls, _place_detail_keys, _place_reviews, _post_review)
+
+_render = sync_to_async(render)
+
+
+async def _list(queryset):
+    return [obj async for obj in queryset]
+
+
+async def _user(request):
+    # auser() and request.user cache separately; share one load with templates
+    # (as cache_anonymous does)
+    request.user = await request.auser()
+    return request.user
+
+
+async def _keyset_page(paginator, cursor):
+    try:
+        return await paginator.apage(cursor)
+    except InvalidCursor:
+        return await paginator.apage()
+
+
+async def _explore_results(params):
+    # The bitmap index and the facet count cache are sync code
+    try:
+        return await sync_to_async(_explore_page)(params, params.get('cursor'))
+    except InvalidCursor:
+        return await sync_to_async(_explore_page)(params)
+
+
+async def _user_review(place, user):
+    if not user.is_authenticated:
+        return None
+    return await Review.objects.filter(place=place, user=user).afirst()
+
+
+@query_budget(9)
+@conditional_page(homepage_version)
+@cache_anonymous('places', 'website_reviews')
+async def index(request):
+    places, website_reviews = await asyncio.gather(
+        _list(Place.objects.select_related('created_by').only(*PLACE_CARD_FIELDS).order_by(*EXPLORE_ORDERING)[:5]),
+        _list(WebsiteReview.objects.filter(is_visible=True).select_related('user').order_by('-created_at')[:3]),
+    )
+    response = await _render(request, 'wandercritic/index.html', {
+        'places': places,
+        'website_reviews': website_reviews,
+    })
+    return surrogate.tag(response, surrogate.HOMEPAGE_TOP, surrogate.WEBSITE_REVIEWS, *surrogate.place_keys(places))
+
+
+@query_budget(9)
+@conditional_page(catalogue_version)
+@cache_anonymous('places', 'terms')
+async def explore(request):
+    selection = facets.FacetSelection.from_params(request.GET)
+    page, counts, categories, tags = await asyncio.gather(
+        _explore_results(request.GET),
+        sync_to_async(_explore_facet_counts)(request.GET, selection),
+        _list(PlaceCategory.objects.all()),
+        _list(Tag.objects.all()),
+    )
+    response = await _render(request, 'wandercritic/explore.html', {
+        'places': page,
+        'facets': facets.facet_options(counts, selection, categories, tags),
+        'selection': selection,
+        'search_query': request.GET.get('search', ''),
+        **_page_urls(request, page, 'wandercritic:explore', 'wandercritic:explore_more'),
+    })
+    return surrogate.tag(response, surrogate.EXPLORE, *surrogate.place_keys(page))
+
+
+@query_budget(5)
+@conditional_page(catalogue_version)
+@cache_anonymous('places')
+async def place_list(request):
+    paginator = KeysetPaginator(Place.objects.select_related('created_by'), PLACE_LIST_ORDERING)
+    page = await _keyset_page(paginator, request.GET.get('cursor'))
+    response = await _render(request, 'wandercritic/place_list.html', {
+        'places': page,
+        **_page_urls(request, page, 'wandercritic:place_list', 'wandercritic:place_list_more'),
+    })
+    return surrogate.tag(response, surrogate.PLACE_LIST, *surrogate.place_keys(page))
+
+
+@query_budget(9)
+@conditional_page(place_version)
+@cache_anonymous('place:{slug}', 'terms')
+async def place_detail(request, slug):
+    place, user = await asyncio.gather(
+        aget_object_or_404(
+            Place.objects.select_related('created_by').prefetch_related('images', 'categories', 'tags'),
+            slug=slug,
+        ),
+        _user(request),
+    )
+
+    if request.method == 'POST' and user.is_authenticated:
+        response = await sync_to_async(_post_review)(request, place)
+        if response is not None:
+            return response
+
+    user_review, reviews = await asyncio.gather(
+        _user_review(place, user),
+        _keyset_page(_place_reviews(user, place), request.GET.get('cursor')),
+    )
+    response = await _render(request, 'wandercritic/place_detail.html', {
+        'place': place,
+        'images': place.images.all(),
+        'user_review': user_review,
+        'reviews': reviews,
+        'rating_histogram': ratings.histogram(place),
+        'rating_choices': Review.RATING_CHOICES,
+        **_page_urls(request, reviews, 'wandercritic:place_detail', 'wandercritic:place_reviews_more', [slug]),
+    })
+    return surrogate.tag(response, *_place_detail_keys(place))
+
+
+@login_required
+async def my_places(request):
+    agent_id = request.GET.get('agent')
+    context = {}
+    if agent_id:
+        # If agent_id is provided, show that agent's places
+        agent = await aget_object_or_404(get_user_model(), id=agent_id)
+        context['viewing_agent'] = agent
+    else:
+        # Otherwise show the current user's places
+        agent = await _user(request)
+    context['places'] = await _list(Place.objects.filter(created_by=agent).order_by('-created_at'))
+    response = await _render(request, 'wandercritic/my_places.html', context)
+    return surrogate.tag(response, surrogate.agent_key(agent.pk), *surrogate.place_keys(context['places']))
@@ -0,0 +1,254 @@
+"""
+Search-box suggestions from an in-memory prefix index.
+
+Every suggestion (a place, a location, a category or a tag) is indexed under
+each word of its label, lowercased and stripped of accents: "Old Castle of
+Oban" can be found with "old", "castle", "castle of o" or "oban". The keys are
+kept in one sorted list, so the suggestions for a prefix are a contiguous run
+found with two bisections. Runs are ranked by popularity (ratings received,
+then average rating); the long runs of one- or two-letter prefixes are ranked
+once and memoised until the next change.
+
+When a prefix of ``AUTOCOMPLETE_TYPO_MIN_LENGTH`` characters or more has too
+few matches, the prefixes one edit away (a letter deleted, inserted, replaced
+or two swapped) are looked up too, ranked after the exact matches.
+
+Like ``bitmap_index``, the index is held by an ``inprocess.IndexHolder``:
+built in the background (or at ASGI startup), never in a request, updated in
+place by model signals and rebuilt once the ``autocomplete`` cache namespace
+is bumped, or every ``AUTOCOMPLETE_REBUILD_INTERVAL`` seconds when the cache
+is not shared. Until the first build is done ``suggest()`` answers from the
+database with place names only. New reviews only re-rank suggestions in the
+process that saved them; elsewhere popularity is refreshed by rebuilds.
+"""
+import bisect
+import heapq
+import string
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db.models import Avg, Sum
+from django.urls import reverse
+
+from . import caching, inprocess
+
+NAMESPACE = 'autocomplete'
+
+# Words of a label indexed as starting points; later words are still matched
+# as part of a longer prefix
+MAX_WORDS = 6
+
+# Prefixes matching more keys than this have their ranking memoised
+MEMO_THRESHOLD = 500
+
+ALPHABET = string.ascii_lowercase + string.digits + ' '
+
+
+def normalize(text):
+    """Lowercase ``text``, strip accents and punctuation and collapse spaces."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return ' '.join(''.join(ch if ch.isalnum() else ' ' for ch in text).split())
+
+
+def edits(word):
+    """Strings one edit away from ``word``."""
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    deletes = [a + b[1:] for a, b in splits if b]
+    swaps = [a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1]
+    replaces = [a + c + b[1:] for a, b in splits if b for c in ALPHABET if c != b[0]]
+    inserts = [a + c + b for a, b in splits for c in ALPHABET]
+    return set(deletes + swaps + replaces + inserts) - {word}
+
+
+@dataclass
+class Suggestion:
+    kind: str
+    value: str  # slug for places, the name otherwise
+    label: str
+    popularity: int = 0
+    rating: float = 0.0
+
+    @property
+    def rank(self):
+        return (self.popularity, self.rating)
+
+    @property
+    def url(self):
+        if self.kind == 'place':
+            return reverse('wandercritic:place_detail', args=[self.value])
+        param = {'location': 'search', 'category': 'category', 'tag': 'tag'}[self.kind]
+        return reverse('wandercritic:explore') + '?' + urlencode({param: self.value})
+
+    def as_json(self, typo=False):
+        return {'kind': self.kind, 'label': self.label, 'url': self.url, 'typo': typo}
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        # Sorted keys and, at the same positions, the (kind, id) they belong to
+        self.keys = []
+        self.refs = []
+        self.entries = {}  # (kind, id) -> Suggestion
+        self.memo = {}  # prefix -> ranked refs
+        self.version = None
+        self.built_at = 0
+        self.build_seconds = 0
+
+    @staticmethod
+    def keys_for(label):
+        words = normalize(label).split()
+        return {' '.join(words[i:]) for i in range(min(len(words), MAX_WORDS))}
+
+    # Building
+
+    @classmethod
+    def build(cls):
+        from .models import Place, PlaceCategory, Tag
+
+        started = time.monotonic()
+        index = cls()
+        version = caching.versions(NAMESPACE)
+        pairs = []
+
+        def collect(ref, suggestion):
+            index.entries[ref] = suggestion
+            pairs.extend((key, ref) for key in cls.keys_for(suggestion.label))
+
+        for pk, name, slug, total, rating in Place.objects.values_list(
+                'pk', 'name', 'slug', 'total_ratings', 'average_rating').iterator(chunk_size=5000):
+            collect(('place', pk), Suggestion('place', slug, name, total, float(rating)))
+        for location, total, rating in (Place.objects.order_by().values('location')
+                                        .annotate(total=Sum('total_ratings'), rating=Avg('average_rating'))
+                                        .values_list('location', 'total', 'rating')):
+            collect(('location', normalize(location)), Suggestion('location', location, location, total or 0,
+                                                                  float(rating or 0)))
+        for kind, model in (('category', PlaceCategory), ('tag', Tag)):
+            terms = model.objects.annotate(
+                total=Sum('places__total_ratings'), rating=Avg('places__average_rating'),
+            ).values_list('pk', 'name', 'total', 'rating')
+            for pk, name, total, rating in terms:
+                collect((kind, pk), Suggestion(kind, name, name, total or 0, float(rating or 0)))
+
+        pairs.sort()
+        index.keys = [key for key, _ in pairs]
+        index.refs = [ref for _, ref in pairs]
+        index.version = version
+        index.built_at = time.monotonic()
+        index.build_seconds = index.built_at - started
+        return index
+
+    # Lookups
+
+    def _range(self, prefix):
+        return bisect.bisect_left(self.keys, prefix), bisect.bisect_left(self.keys, prefix + '\uffff')
+
+    def ranked(self, prefix, limit):
+        """Up to ``limit`` refs whose keys start with ``prefix``, most popular first."""
+        low, high = self._range(prefix)
+        if high - low > MEMO_THRESHOLD:
+            ranked = self.memo.get(prefix)
+            if ranked is None or len(ranked) < limit:
+                ranked = self.memo[prefix] = self._top(set(self.refs[low:high]), limit)
+            return ranked[:limit]
+        return self._top(set(self.refs[low:high]), limit)
+
+    def _top(self, refs, limit):
+        return heapq.nlargest(limit, refs, key=lambda ref: self.entries[ref].rank)
+
+    def suggest(self, query, limit=None):
+        """``[(Suggestion, typo), ...]`` for the search box text ``query``."""
+        limit = limit or settings.AUTOCOMPLETE_LIMIT
+        prefix = normalize(query)
+        if len(prefix) < settings.AUTOCOMPLETE_MIN_LENGTH:
+            return []
+        with self.lock:
+            found = self.ranked(prefix, limit)
+            results = [(self.entries[ref], False) for ref in found]
+            if len(found) < limit and len(prefix) >= settings.AUTOCOMPLETE_TYPO_MIN_LENGTH:
+                close = set()
+                for variant in edits(prefix):
+                    close.update(self.ranked(variant, limit))
+                close.difference_update(found)
+                results += [(self.entries[ref], True) for ref in self._top(close, limit - len(found))]
+            return results
+
+    # Incremental updates
+
+    def _insert(self, ref, suggestion):
+        self.entries[ref] = suggestion
+        for key in self.keys_for(suggestion.label):
+            position = bisect.bisect_right(self.keys, key)
+            self.keys.insert(position, key)
+            self.refs.insert(position, ref)
+
+    def _remove(self, ref):
+        suggestion = self.entries.pop(ref, None)
+        if suggestion is None:
+            return
+        for key in self.keys_for(suggestion.label):
+            low, high = bisect.bisect_left(self.keys, key), bisect.bisect_right(self.keys, key)
+            for position in range(low, high):
+                if self.refs[position] == ref:
+                    del self.keys[position]
+                    del self.refs[position]
+                    break
+
+    def put(self, kind, pk, suggestion):
+        with self.lock:
+            self._remove((kind, pk))
+            self._insert((kind, pk), suggestion)
+            self.memo.clear()
+
+    def put_place(self, pk, name, slug, location, total_ratings, average_rating):
+        with self.lock:
+            self.put('place', pk, Suggestion('place', slug, name, total_ratings, float(average_rating)))
+            # New locations show up at once; their popularity waits for a rebuild
+            location_ref = ('location', normalize(location))
+            if location_ref not in self.entries:
+                self._insert(location_ref, Suggestion('location', location, location,
+                                                      total_ratings, float(average_rating)))
+
+    def rerank(self, kind, pk, popularity, rating):
+        with self.lock:
+            suggestion = self.entries.get((kind, pk))
+            if suggestion is not None:
+                suggestion.popularity, suggestion.rating = popularity, float(rating)
+                self.memo.clear()
+
+    def remove(self, kind, pk):
+        with self.lock:
+            self._remove((kind, pk))
+            self.memo.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+_holder = inprocess.IndexHolder(PrefixIndex.build, NAMESPACE, 'AUTOCOMPLETE_REBUILD_INTERVAL')
+
+get_index = _holder.get
+warm_up = _holder.warm_up
+apply_change = _holder.apply_change
+reset = _holder.reset
+
+
+def suggest(query, limit=None):
+    """``PrefixIndex.suggest()``, or places whose name starts with ``query`` until the index is built."""
+    index = get_index()
+    if index is not None:
+        return index.suggest(query, limit)
+    from .models import Place
+
+    limit = limit or settings.AUTOCOMPLETE_LIMIT
+    if len(normalize(query)) < settings.AUTOCOMPLETE_MIN_LENGTH:
+        return []
+    places = (Place.objects.filter(name__istartswith=query.strip())
+              .order_by('-total_ratings', '-average_rating', 'id')
+              .values_list('slug', 'name', 'total_ratings', 'average_rating')[:limit])
+    return [(Suggestion('place', slug, name, total, float(rating)), False) for slug, name, total, rating in places]
@@ -0,0 +1,470 @@
+"""
+Benchmark harness for the main pages.
+
+Each route is requested a number of times, either in-process through the
+Django test client or over HTTP against a local WSGI server, and the result
+records latency percentiles, queries per request (from the ``X-DB-*`` headers
+of ``QueryCountMiddleware``) and peak Python memory allocated by one request.
+Results are plain JSON so runs can be diffed with ``compare()``.
+
+Run it with ``python manage.py benchmark``; generate data first with
+``python manage.py seed_synthetic``.
+
+``load_test()`` measures throughput instead: it starts the site in a child
+process behind Django's threaded WSGI server or uvicorn (ASGI, with the async
+views) and requests each route from many threads at once. Run it with
+``python manage.py benchmark_load``.
+
+``write_contention()`` has concurrent writers post reviews to a copy of the
+database opened with each ``DATABASE_PROFILES`` entry, counting "database is
+locked" failures. Run it with ``python manage.py benchmark_writes``.
+"""
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from dataclasses import dataclass
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.servers.basehttp import run as run_wsgi
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+
+@dataclass(frozen=True)
+class Route:
+    name: str
+    path: str
+
+
+def default_routes():
+    """The main routes of ``wandercritic/urls.py``, filled in with real data."""
+    from .models import EXPLORE_ORDERING, Place, PlaceCategory
+    from .pagination import KeysetPaginator
+
+    routes = [
+        Route('index', reverse('wandercritic:index')),
+        Route('explore', reverse('wandercritic:explore')),
+        Route('explore_search', reverse('wandercritic:explore') + '?' + urlencode({'search': 'castle'})),
+        Route('place_list', reverse('wandercritic:place_list')),
+        Route('about', reverse('wandercritic:about')),
+    ]
+    category = PlaceCategory.objects.order_by('pk').values_list('name', flat=True).first()
+    if category:
+        routes.append(Route('explore_category', reverse('wandercritic:explore') + '?' + urlencode({'category': category})))
+    page = KeysetPaginator(Place.objects.all(), EXPLORE_ORDERING).page()
+    if page.has_next:
+        routes.append(Route('explore_more', reverse('wandercritic:explore_more') + '?' + urlencode({'cursor': page.next_cursor})))
+
+    busiest = Place.objects.order_by('-total_ratings').values_list('slug', flat=True).first()
+    if busiest:
+        routes.append(Route('place_detail', reverse('wandercritic:place_detail', args=[busiest])))
+    return routes
+
+
+def percentile(samples, pct):
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _http_get(url):
+    """``(status, queries)`` of a GET request over HTTP."""
+    try:
+        with urlopen(url) as response:
+            response.read()
+            return response.status, int(response.headers.get('X-DB-Queries', 0))
+    except HTTPError as e:
+        return e.code, int(e.headers.get('X-DB-Queries', 0))
+
+
+class ClientTransport:
+    """Requests through the test client, in this process."""
+
+    def __init__(self, user=None):
+        self.client = Client()
+        if user is not None:
+            self.client.force_login(user)
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, int(response.get('X-DB-Queries', 0))
+
+    def close(self):
+        pass
+
+
+class WSGITransport:
+    """Requests over HTTP to a WSGI server running in a background thread."""
+
+    def __init__(self):
+        self.server = make_server('127.0.0.1', 0, WSGIHandler(), handler_class=_QuietHandler)
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def get(self, path):
+        return _http_get(self.base_url + path)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def measure(transport, route, requests, warmup=2, cold=False):
+    """Latency, query and memory figures for ``requests`` requests of ``route``."""
+    for _ in range(warmup):
+        transport.get(route.path)
+
+    timings = []
+    queries = []
+    statuses = set()
+    for _ in range(requests):
+        if cold:
+            cache.clear()
+        started = time.perf_counter()
+        status, query_count = transport.get(route.path)
+        timings.append((time.perf_counter() - started) * 1000)
+        queries.append(query_count)
+        statuses.add(status)
+
+    # Memory is measured on one extra request; tracing slows everything down
+    if cold:
+        cache.clear()
+    tracemalloc.start()
+    transport.get(route.path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'path': route.path,
+        'status': sorted(statuses),
+        'requests': requests,
+        'mean_ms': round(statistics.fmean(timings), 2),
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'max_ms': round(max(timings), 2),
+        'queries': round(statistics.fmean(queries), 1),
+        'max_queries': max(queries),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _meta(**extra):
+    from .models import Place, Review, User
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'revision': _git_revision(),
+        **extra,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'cache': settings.CACHES['default']['BACKEND'],
+        'rows': {
+            'places': Place.objects.count(),
+            'reviews': Review.objects.count(),
+            'users': User.objects.count(),
+        },
+    }
+
+
+def run(routes, requests=50, warmup=2, mode='client', user=None, cold=False, progress=None):
+    """Benchmark ``routes`` and return the JSON-serialisable result."""
+    # The query count is read from the instrumentation headers in both modes
+    with override_settings(QUERY_COUNT_HEADER=True, ALLOWED_HOSTS=['*']):
+        transport = WSGITransport() if mode == 'wsgi' else ClientTransport(user)
+        try:
+            results = {}
+            for route in routes:
+                results[route.name] = measure(transport, route, requests, warmup, cold)
+                if progress:
+                    progress(route.name, results[route.name])
+        finally:
+            transport.close()
+
+    return {
+        'meta': _meta(mode=mode, cold_cache=cold, user=getattr(user, 'username', None)),
+        'routes': results,
+    }
+
+
+SERVERS = ('wsgi', 'asgi')
+
+
+def serve(server, port):
+    """
+    Serve the site on ``port`` until killed: Django's threaded WSGI server
+    (what ``runserver`` uses) or uvicorn. Runs in the child process started
+    by ``ServerProcess``, with ``ASYNC_VIEWS`` set to match ``server``.
+    """
+    with override_settings(QUERY_COUNT_HEADER=True, ALLOWED_HOSTS=['*']):
+        if server == 'asgi':
+            import uvicorn
+            uvicorn.run(ASGIHandler(), host='127.0.0.1', port=port, log_level='warning', access_log=False)
+        else:
+            run_wsgi('127.0.0.1', port, WSGIHandler(), threading=True)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ServerProcess:
+    """The site served by ``server`` in a child process, as a context manager yielding its URL."""
+
+    def __init__(self, server, timeout=30):
+        self.server = server
+        self.timeout = timeout
+        self.port = _free_port()
+        self.process = None
+        self.log = None
+
+    def __enter__(self):
+        env = {**os.environ, 'ASYNC_VIEWS': '1' if self.server == 'asgi' else '0'}
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            [sys.executable, 'manage.py', 'benchmark_load', '--serve', self.server, '--port', str(self.port)],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=self.log,
+        )
+        deadline = time.monotonic() + self.timeout
+        while True:
+            if self.process.poll() is not None:
+                self.fail(f'exited with code {self.process.returncode}')
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return f'http://127.0.0.1:{self.port}'
+            except OSError:
+                if time.monotonic() > deadline:
+                    self.fail(f'did not start within {self.timeout}s')
+                time.sleep(0.1)
+
+    def fail(self, problem):
+        self.log.seek(0)
+        output = self.log.read()[-4000:].decode(errors='replace')
+        self.__exit__()
+        raise RuntimeError(f'{self.server} server {problem}:\n{output}')
+
+    def __exit__(self, *exc_info):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.log.close()
+
+
+def measure_load(base_url, route, requests, concurrency, warmup=2):
+    """Throughput and latency of ``requests`` requests of ``route``, ``concurrency`` at a time."""
+    url = base_url + route.path
+    for _ in range(warmup):
+        _http_get(url)
+
+    def timed_get(_):
+        started = time.perf_counter()
+        status, query_count = _http_get(url)
+        return (time.perf_counter() - started) * 1000, status, query_count
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        samples = list(pool.map(timed_get, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    timings = [timing for timing, _, _ in samples]
+    queries = [query_count for _, _, query_count in samples]
+    return {
+        'path': route.path,
+        'status': sorted({status for _, status, _ in samples}),
+        'requests': requests,
+        'concurrency': concurrency,
+        'rps': round(requests / elapsed, 1),
+        'mean_ms': round(statistics.fmean(timings), 2),
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'max_ms': round(max(timings), 2),
+        'queries': round(statistics.fmean(queries), 1),
+    }
+
+
+def load_test(routes, servers=SERVERS, requests=200, concurrency=16, warmup=2, progress=None):
+    """Load-test ``routes`` on each of ``servers`` and return the JSON-serialisable result."""
+    results = {}
+    for server in servers:
+        results[server] = {}
+        with ServerProcess(server) as base_url:
+            for route in routes:
+                results[server][route.name] = measure_load(base_url, route, requests, concurrency, warmup)
+                if progress:
+                    progress(server, route.name, results[server][route.name])
+    return {
+        'meta': _meta(mode='load', concurrency=concurrency),
+        'servers': results,
+    }
+
+
+def save(result, path):
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+COMPARED_METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'queries', 'peak_kb')
+
+
+def compare(baseline, current, threshold=0.10):
+    """
+    ``[(route, metric, before, after, change), ...]`` for every route in both
+    results, ``change`` being the relative difference. Also returns the rows
+    that got worse by more than ``threshold``.
+    """
+    rows = []
+    regressions = []
+    for name, after in current['routes'].items():
+        before = baseline['routes'].get(name)
+        if before is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = before.get(metric), after.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else (0.0 if new == old else float('inf'))
+            row = (name, metric, old, new, change)
+            rows.append(row)
+            if change > threshold:
+                regressions.append(row)
+    return rows, regressions
+
+
+@contextmanager
+def database_copy(profile):
+    """
+    Point connections opened from now on (in new threads) at a copy of the
+    default SQLite database configured with ``DATABASE_PROFILES[profile]``.
+    """
+    db = connections.settings[DEFAULT_DB_ALIAS]
+    if db['ENGINE'] != 'django.db.backends.sqlite3':
+        raise ValueError('The write contention benchmark needs the SQLite backend')
+    original = dict(db)
+    with tempfile.TemporaryDirectory() as directory:
+        name = os.path.join(directory, 'contention.sqlite3')
+        with closing(sqlite3.connect(original['NAME'])) as source, closing(sqlite3.connect(name)) as target:
+            source.backup(target)
+        db.update(settings.DATABASE_PROFILES[profile], NAME=name)
+        try:
+            yield name
+        finally:
+            db.clear()
+            db.update(original)
+
+
+def _post_reviews(user, places, count, start):
+    """Post ``count`` reviews as ``user`` the way ``place_detail`` does; ``(timings, errors)``."""
+    from .models import Review
+
+    timings = []
+    errors = 0
+    start.wait()
+    try:
+        for _ in range(count):
+            started = time.perf_counter()
+            try:
+                Review.objects.update_or_create(
+                    place=random.choice(places), user=user,
+                    defaults={'rating': random.randint(1, 5), 'comment': 'Contention benchmark review'},
+                )
+            except OperationalError:
+                # "database is locked"
+                errors += 1
+            else:
+                timings.append((time.perf_counter() - started) * 1000)
+    finally:
+        connections.close_all()
+    return timings, errors
+
+
+def measure_writes(profile, users, places, reviews):
+    """Throughput and failures of ``len(users)`` writers posting ``reviews`` reviews each."""
+    with database_copy(profile):
+        start = threading.Barrier(len(users) + 1)
+        with ThreadPoolExecutor(len(users)) as pool:
+            futures = [pool.submit(_post_reviews, user, places, reviews, start) for user in users]
+            start.wait()
+            started = time.perf_counter()
+            results = [future.result() for future in futures]
+            elapsed = time.perf_counter() - started
+
+    timings = [timing for writer_timings, _ in results for timing in writer_timings]
+    errors = sum(writer_errors for _, writer_errors in results)
+    return {
+        'writers': len(users),
+        'attempts': len(users) * reviews,
+        'errors': errors,
+        'writes_per_s': round(len(timings) / elapsed, 1),
+        'p50_ms': round(percentile(timings, 50), 2) if timings else None,
+        'p95_ms': round(percentile(timings, 95), 2) if timings else None,
+        'p99_ms': round(percentile(timings, 99), 2) if timings else None,
+        'max_ms': round(max(timings), 2) if timings else None,
+    }
+
+
+def write_contention(profiles=None, writers=8, reviews=50, progress=None):
+    """Compare ``DATABASE_PROFILES`` under ``writers`` concurrent review writers."""
+    from .models import Place, User
+
+    users = list(User.objects.order_by('pk')[:writers])
+    places = list(Place.objects.order_by('pk').only('pk')[:200])
+    if len(users) < writers or not places:
+        raise ValueError(f'Need {writers} users and some places; run python manage.py seed_synthetic first')
+
+    results = {}
+    for profile in profiles or settings.DATABASE_PROFILES:
+        results[profile] = measure_writes(profile, users, places, reviews)
+        if progress:
+            progress(profile, results[profile])
+    return {
+        'meta': _meta(mode='writes', writers=writers, reviews_per_writer=reviews),
+        'profiles': results,
+    }
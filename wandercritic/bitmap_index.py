@@ -0,0 +1,362 @@
+"""
+In-process bitmap index over the explore filters.
+
+For every category, tag and budget bucket the index keeps the set of matching
+place ids as a Python ``int`` used as a bitset (bit ``n`` set = place ``n``
+matches). Filters become bitwise AND/OR of a few integers and facet counts are
+``int.bit_count()`` calls, so neither needs the database. The explore ranking
+(``-average_rating, -created_at, id``) is kept as three sorted ``array``
+columns; a page is found by walking that order (or sorting the few matching
+ids) and only the visible rows are then loaded from the database.
+
+The index is held by an ``inprocess.IndexHolder``: it is built and rebuilt
+in a background thread (or at ASGI startup), never in a request, and explore
+falls back to SQL until the first build is done. The model signals in
+``wandercritic.signals`` update it in place. Changes made by other processes
+are picked up by a rebuild once the ``place_filters`` cache namespace says
+there were any, or, when the cache is not shared between processes (each
+worker has its own local-memory cache, and commands run in yet another
+process), once the index is ``BITMAP_INDEX_REBUILD_INTERVAL`` seconds old.
+
+Searches with a text query still go through SQL, ranked by the search backend.
+"""
+import bisect
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from django.conf import settings
+
+from . import caching, facets, inprocess
+from .pagination import InvalidCursor, KeysetPage, decode_cursor, encode_cursor
+
+NAMESPACE = 'place_filters'
+
+# A filter matching fewer than 1/SPARSE_RATIO of all places is paged by
+# sorting its ids instead of walking the whole ranking
+SPARSE_RATIO = 16
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _rating_key(average_rating):
+    return int(Decimal(str(average_rating)) * 100)
+
+
+def _created_key(created_at):
+    # Exact microseconds; float timestamps could swap two close rows
+    return (created_at - _EPOCH) // timedelta(microseconds=1)
+
+
+def _cursor_values(rating, created):
+    """The (average_rating, created_at) a ranking key stands for."""
+    return Decimal(rating).scaleb(-2), _EPOCH + timedelta(microseconds=created)
+
+
+def _bits_from(ids, size):
+    """Bitset with the bits of ``ids`` set, built through a bytearray (linear time)."""
+    buffer = bytearray((size >> 3) + 1)
+    for place_id in ids:
+        buffer[place_id >> 3] |= 1 << (place_id & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def _ids_in(bits):
+    """Set bits of ``bits`` in ascending order."""
+    data = bits.to_bytes((bits.bit_length() >> 3) + 1, 'little')
+    for offset, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield (offset << 3) + low.bit_length() - 1
+            byte ^= low
+
+
+class BitmapIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.all = 0
+        self.categories = {}  # category id -> bitset
+        self.tags = {}  # tag id -> bitset
+        self.category_ids = {}  # name -> id
+        self.tag_ids = {}  # name -> id
+        self.budgets = {key: 0 for key in facets.BUDGET_RANGES}
+        # Ranking columns, sorted by (-rating, -created, id)
+        self.order_ids = array('q')
+        self.order_rating = array('l')
+        self.order_created = array('q')
+        self.sort_keys = {}  # place id -> (rating, created) as stored in the ranking
+        self.version = None
+        self.built_at = 0
+        self.build_seconds = 0
+
+    # Building
+
+    @classmethod
+    def build(cls):
+        from .models import Place, PlaceCategory, Tag
+
+        started = time.monotonic()
+        index = cls()
+        version = caching.versions(NAMESPACE)
+        rows = list(
+            Place.objects.order_by('-average_rating', '-created_at', 'id')
+            .values_list('id', 'average_rating', 'created_at', 'budget')
+        )
+        size = max((row[0] for row in rows), default=0)
+        budget_ids = {key: [] for key in facets.BUDGET_RANGES}
+        for place_id, rating, created_at, budget in rows:
+            index.order_ids.append(place_id)
+            index.order_rating.append(_rating_key(rating))
+            index.order_created.append(_created_key(created_at))
+            index.sort_keys[place_id] = (index.order_rating[-1], index.order_created[-1])
+            bucket = facets.budget_bucket(budget)
+            if bucket:
+                budget_ids[bucket].append(place_id)
+        index.all = _bits_from(index.sort_keys, size)
+        index.budgets = {key: _bits_from(ids, size) for key, ids in budget_ids.items()}
+
+        index.category_ids = dict(PlaceCategory.objects.values_list('name', 'id'))
+        index.tag_ids = dict(Tag.objects.values_list('name', 'id'))
+        index.categories = index._term_bits(Place.categories.through, 'placecategory_id',
+                                            index.category_ids.values(), size)
+        index.tags = index._term_bits(Place.tags.through, 'tag_id', index.tag_ids.values(), size)
+
+        index.version = version
+        index.built_at = time.monotonic()
+        index.build_seconds = index.built_at - started
+        return index
+
+    @staticmethod
+    def _term_bits(through, term_field, term_ids, size):
+        members = {term_id: [] for term_id in term_ids}
+        for place_id, term_id in through.objects.values_list('place_id', term_field).iterator(chunk_size=10000):
+            members.setdefault(term_id, []).append(place_id)
+        return {term_id: _bits_from(ids, size) for term_id, ids in members.items()}
+
+    # Filtering
+
+    def _any(self, bitmaps, ids):
+        bits = 0
+        for term_id in ids:
+            bits |= bitmaps.get(term_id, 0)
+        return bits
+
+    def _all(self, bitmaps, ids):
+        bits = self.all
+        for term_id in ids:
+            bits &= bitmaps.get(term_id, 0)
+        return bits
+
+    def _term_bits_for(self, bitmaps, names_to_ids, names, mode):
+        ids = [names_to_ids.get(name) for name in names]
+        return self._all(bitmaps, ids) if mode == 'all' else self._any(bitmaps, ids)
+
+    def matching(self, selection):
+        """Bitset of the places matching ``selection`` (a ``FacetSelection``)."""
+        with self.lock:
+            bits = self.all
+            if selection.categories:
+                bits &= self._term_bits_for(self.categories, self.category_ids,
+                                            selection.categories, selection.category_mode)
+            if selection.tags:
+                bits &= self._term_bits_for(self.tags, self.tag_ids, selection.tags, selection.tag_mode)
+            if selection.budgets:
+                bits &= self._any(self.budgets, selection.budgets)
+            return bits
+
+    def facet_counts(self, selection):
+        """Same result as ``facets.facet_counts()``, without touching the database."""
+        with self.lock:
+            def base(facet, mode):
+                return self.matching(selection if mode == 'all' else selection.without(facet))
+
+            categories_base = base('categories', selection.category_mode)
+            tags_base = base('tags', selection.tag_mode)
+            budgets_base = self.matching(selection.without('budgets'))
+            return {
+                'categories': {term_id: (categories_base & bits).bit_count()
+                               for term_id, bits in self.categories.items()},
+                'tags': {term_id: (tags_base & bits).bit_count() for term_id, bits in self.tags.items()},
+                'budgets': {key: (budgets_base & bits).bit_count() for key, bits in self.budgets.items()},
+            }
+
+    # Paging
+
+    def _position_after(self, rating, created, place_id):
+        target = (-rating, -created, place_id)
+        return bisect.bisect_right(
+            range(len(self.order_ids)), target,
+            key=lambda i: (-self.order_rating[i], -self.order_created[i], self.order_ids[i]),
+        )
+
+    def page_ids(self, bits, after=None, limit=12):
+        """
+        Up to ``limit`` ids of ``bits`` in ranking order, starting after the
+        sort key ``after`` = (rating, created, id).
+        """
+        with self.lock:
+            if bits.bit_count() * SPARSE_RATIO < len(self.order_ids):
+                keys = [(-self.sort_keys[pid][0], -self.sort_keys[pid][1], pid)
+                        for pid in _ids_in(bits) if pid in self.sort_keys]
+                keys.sort()
+                if after:
+                    keys = keys[bisect.bisect_right(keys, (-after[0], -after[1], after[2])):]
+                return [pid for _, _, pid in keys[:limit]]
+
+            start = self._position_after(*after) if after else 0
+            mask = bits.to_bytes((bits.bit_length() >> 3) + 1, 'little')
+            size = len(mask) << 3
+            found = []
+            for i in range(start, len(self.order_ids)):
+                pid = self.order_ids[i]
+                if pid < size and mask[pid >> 3] >> (pid & 7) & 1:
+                    found.append(pid)
+                    if len(found) == limit:
+                        break
+            return found
+
+    def page(self, queryset, selection, cursor=None, page_size=None):
+        """
+        A ``KeysetPage`` of ``queryset`` rows for ``selection``, with cursors
+        interchangeable with ``KeysetPaginator`` on the explore ordering.
+        """
+        page_size = page_size or settings.PLACES_PAGE_SIZE
+        after = None
+        if cursor:
+            values = decode_cursor(cursor)
+            if len(values) != 3:
+                raise InvalidCursor('Cursor does not match the ordering')
+            try:
+                rating, created, place_id = values
+                field = queryset.model._meta.get_field('created_at')
+                after = (_rating_key(rating), _created_key(field.to_python(created)), int(place_id))
+            except (ArithmeticError, TypeError, ValueError, AttributeError) as e:
+                raise InvalidCursor(str(e)) from e
+
+        with self.lock:
+            ids = self.page_ids(self.matching(selection), after, page_size + 1)
+            has_next = len(ids) > page_size
+            # The cursor comes from the ranking, not from the loaded rows: a
+            # row edited since the index saw it must not move the cursor
+            last = ids[page_size - 1] if has_next else None
+            next_cursor = encode_cursor([*_cursor_values(*self.sort_keys[last]), last]) if has_next else None
+        rows = queryset.in_bulk(ids[:page_size])
+        return KeysetPage(
+            object_list=[rows[pid] for pid in ids[:page_size] if pid in rows],
+            next_cursor=next_cursor,
+            cursor=cursor,
+            page_size=page_size,
+        )
+
+    # Incremental updates
+
+    def _set(self, bitmaps, key, place_id, present):
+        bit = 1 << place_id
+        bitmaps[key] = bitmaps.get(key, 0) | bit if present else bitmaps.get(key, 0) & ~bit
+
+    def _unrank(self, place_id):
+        if place_id not in self.sort_keys:
+            return
+        rating, created = self.sort_keys.pop(place_id)
+        position = self._position_after(rating, created, place_id) - 1
+        if 0 <= position < len(self.order_ids) and self.order_ids[position] == place_id:
+            del self.order_ids[position]
+            del self.order_rating[position]
+            del self.order_created[position]
+
+    def update_place(self, place_id, average_rating, created_at, budget):
+        with self.lock:
+            self._unrank(place_id)
+            rating, created = _rating_key(average_rating), _created_key(created_at)
+            position = self._position_after(rating, created, place_id)
+            self.order_ids.insert(position, place_id)
+            self.order_rating.insert(position, rating)
+            self.order_created.insert(position, created)
+            self.sort_keys[place_id] = (rating, created)
+            self.all |= 1 << place_id
+            bucket = facets.budget_bucket(budget)
+            for key in self.budgets:
+                self._set(self.budgets, key, place_id, key == bucket)
+
+    def remove_place(self, place_id):
+        with self.lock:
+            self._unrank(place_id)
+            bit = ~(1 << place_id)
+            self.all &= bit
+            for bitmaps in (self.categories, self.tags, self.budgets):
+                for key in bitmaps:
+                    bitmaps[key] &= bit
+
+    def _terms(self, kind):
+        return (self.category_ids, self.categories) if kind == 'categories' else (self.tag_ids, self.tags)
+
+    def link(self, kind, place_ids, term_ids, present=True):
+        """Add (or remove) the categories or tags ``term_ids`` to ``place_ids``."""
+        bitmaps = self._terms(kind)[1]
+        with self.lock:
+            for term_id in term_ids:
+                for place_id in place_ids:
+                    self._set(bitmaps, term_id, place_id, present)
+
+    def clear_place(self, kind, place_id):
+        bit = ~(1 << place_id)
+        bitmaps = self._terms(kind)[1]
+        with self.lock:
+            for term_id in bitmaps:
+                bitmaps[term_id] &= bit
+
+    def clear_term(self, kind, term_id):
+        with self.lock:
+            self._terms(kind)[1][term_id] = 0
+
+    def rename_term(self, kind, term_id, name):
+        names, bitmaps = self._terms(kind)
+        with self.lock:
+            for old_name in [n for n, i in names.items() if i == term_id]:
+                del names[old_name]
+            names[name] = term_id
+            bitmaps.setdefault(term_id, 0)
+
+    def remove_term(self, kind, term_id):
+        names, bitmaps = self._terms(kind)
+        with self.lock:
+            bitmaps.pop(term_id, None)
+            for name in [n for n, i in names.items() if i == term_id]:
+                del names[name]
+
+    # Reporting
+
+    def memory_footprint(self):
+        """Approximate bytes used, by part."""
+        def bitmaps_size(bitmaps):
+            return sys.getsizeof(bitmaps) + sum(sys.getsizeof(bits) for bits in bitmaps.values())
+
+        def names_size(names):
+            return sys.getsizeof(names) + sum(sys.getsizeof(name) for name in names)
+
+        return {
+            'all': sys.getsizeof(self.all),
+            'categories': bitmaps_size(self.categories) + names_size(self.category_ids),
+            'tags': bitmaps_size(self.tags) + names_size(self.tag_ids),
+            'budgets': bitmaps_size(self.budgets),
+            'ranking': sum(sys.getsizeof(column)
+                           for column in (self.order_ids, self.order_rating, self.order_created)),
+            'sort_keys': sys.getsizeof(self.sort_keys) + sum(
+                sys.getsizeof(key) + sys.getsizeof(value) for key, value in self.sort_keys.items()),
+        }
+
+    def __len__(self):
+        return len(self.order_ids)
+
+
+_holder = inprocess.IndexHolder(BitmapIndex.build, NAMESPACE, 'BITMAP_INDEX_REBUILD_INTERVAL',
+                                'BITMAP_INDEX_ENABLED')
+
+get_index = _holder.get
+warm_up = _holder.warm_up
+apply_change = _holder.apply_change
+reset = _holder.reset
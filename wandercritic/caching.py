@@ -0,0 +1,241 @@
+"""
+Versioned caching for pages and template fragments.
+
+Cached entries are keyed on one or more *namespace versions*:
+
+* ``places``          - anything shown in place listings (cards, top places)
+* ``place:<slug>``    - one place detail page (place, images, reviews)
+* ``terms``           - categories and tags
+* ``website_reviews`` - testimonials on the homepage
+
+Model signal handlers (``wandercritic.signals``) call ``bump()`` on the
+namespaces a change affects. Bumping only increments a counter; stale entries
+are never looked up again and simply expire.
+
+``fetch()`` guards expensive entries against stampedes: only one worker
+recomputes a missing entry while the others wait for it, an expired entry is
+served stale for ``CACHE_STALE_TTL`` seconds while one worker refreshes it,
+and entries are refreshed a little early at random (XFetch) so a hot key
+rarely expires at all. Hit/miss/stale/coalesced counters are kept in the cache
+and reported by ``python manage.py cache_stats``.
+"""
+import hashlib
+import math
+import random
+import time
+from functools import wraps
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse
+
+VERSION_PREFIX = 'wc:v:'
+LOCK_PREFIX = 'wc:lock:'
+STATS_PREFIX = 'wc:stats:'
+
+# hit: fresh value, miss: computed here, stale: expired value served while
+# another worker refreshes it, coalesced: waited for another worker's value
+STATS = ('hit', 'miss', 'stale', 'coalesced')
+
+# How often a waiting worker polls for the value being computed elsewhere
+WAIT_INTERVAL = 0.05
+
+
+def versions(*namespaces):
+    """Combined version token for ``namespaces``, usable as a cache key part."""
+    if not namespaces:
+        return ''
+    keys = [VERSION_PREFIX + namespace for namespace in namespaces]
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    for key in missing:
+        cache.add(key, 1, timeout=None)
+    if missing:
+        found.update(cache.get_many(missing))
+    return '.'.join(str(found.get(key, 1)) for key in keys)
+
+
+def shared():
+    """
+    Whether the cache is shared between processes, so a ``bump()`` reaches
+    every worker. Each process has its own local-memory cache.
+    """
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache)
+
+
+def bump(*namespaces):
+    for namespace in namespaces:
+        key = VERSION_PREFIX + namespace
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Not set yet (or evicted): any value differs from what was cached
+            cache.set(key, 2, timeout=None)
+
+
+def place_namespace(slug):
+    return f'place:{slug}'
+
+
+def versioned_key(name, *namespaces):
+    raw = f'{name}|{versions(*namespaces)}'
+    return 'wc:data:' + hashlib.sha1(raw.encode()).hexdigest()
+
+
+def record(stat):
+    key = STATS_PREFIX + stat
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def stats():
+    keys = [STATS_PREFIX + stat for stat in STATS]
+    found = cache.get_many(keys)
+    return {stat: found.get(key, 0) for stat, key in zip(STATS, keys)}
+
+
+def reset_stats():
+    cache.delete_many([STATS_PREFIX + stat for stat in STATS])
+
+
+def _store(key, value, timeout, grace, compute_time):
+    # Kept for the stale window past the soft expiry
+    cache.set(key, (value, time.time() + timeout, compute_time), timeout + grace)
+
+
+def _compute(key, compute, timeout, grace):
+    started = time.monotonic()
+    value = compute()
+    if value is not None:
+        _store(key, value, timeout, grace, time.monotonic() - started)
+    return value
+
+
+def fetch(key, compute, timeout=None, grace=None, beta=None):
+    """
+    ``cache.get(key)``, calling ``compute()`` to fill it on a miss, with
+    stampede protection (see module docstring). ``compute()`` may return
+    None to skip caching; the value is then returned but not stored.
+    """
+    timeout = settings.CACHE_TTL if timeout is None else timeout
+    grace = settings.CACHE_STALE_TTL if grace is None else grace
+    beta = settings.CACHE_EARLY_EXPIRY_BETA if beta is None else beta
+    lock_key = LOCK_PREFIX + key
+    lock_timeout = settings.CACHE_LOCK_TIMEOUT
+
+    entry = cache.get(key)
+    if entry is not None:
+        value, expires, compute_time = entry
+        now = time.time()
+        # XFetch: refresh early with a probability that grows towards expiry
+        # and with the time the value takes to compute
+        if now - compute_time * beta * math.log(1 - random.random()) < expires:
+            record('hit')
+            return value
+        if not cache.add(lock_key, 1, lock_timeout):
+            # Someone else is refreshing it
+            record('stale' if now >= expires else 'hit')
+            return value
+        try:
+            record('miss')
+            return _compute(key, compute, timeout, grace)
+        finally:
+            cache.delete(lock_key)
+
+    if cache.add(lock_key, 1, lock_timeout):
+        try:
+            record('miss')
+            return _compute(key, compute, timeout, grace)
+        finally:
+            cache.delete(lock_key)
+
+    # Single flight: wait for the worker holding the lock instead of recomputing
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            record('coalesced')
+            return entry[0]
+        if cache.add(lock_key, 1, lock_timeout):
+            # The other worker gave up without storing a value
+            try:
+                record('miss')
+                return _compute(key, compute, timeout, grace)
+            finally:
+                cache.delete(lock_key)
+    record('miss')
+    return compute()
+
+
+def page_key(request, namespaces):
+    raw = f'{request.get_full_path()}|{versions(*namespaces)}'
+    return 'wc:page:' + hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _cacheable_request(request):
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    # Pending flash messages make the page unique to this visitor
+    return not list(get_messages(request))
+
+
+def _stored_response(request, response):
+    """What to cache of ``response``, or None if it must not be cached."""
+    if (response.status_code == 200 and not response.streaming
+            and not response.cookies
+            and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')):
+        return response.content, dict(response.headers)
+    return None
+
+
+def cache_anonymous(*namespaces, timeout=None):
+    """
+    Cache the full response of a view for anonymous visitors.
+
+    ``namespaces`` may use the view's URL kwargs, e.g. ``'place:{slug}'``.
+    Responses that set cookies (CSRF token, session) are never cached.
+    Works on sync and async views.
+    """
+    def decorator(view):
+        def cached_response(request, args, kwargs, render_view):
+            key = page_key(request, [namespace.format(**kwargs) for namespace in namespaces])
+            rendered = []
+
+            def render():
+                response = render_view(request, *args, **kwargs)
+                rendered.append(response)
+                return _stored_response(request, response)
+
+            cached = fetch(key, render, timeout=timeout)
+            if rendered:
+                return rendered[0]
+            content, headers = cached
+            return HttpResponse(content, headers=headers)
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # Load the user once for this check, the view (auser()) and
+                # templates (request.user). The session, messages and cache
+                # are read in a worker thread; a miss renders the view back
+                # on the event loop
+                request.user = await request.auser()
+                if not await sync_to_async(_cacheable_request)(request):
+                    return await view(request, *args, **kwargs)
+                return await sync_to_async(cached_response)(request, args, kwargs, async_to_sync(view))
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _cacheable_request(request):
+                return view(request, *args, **kwargs)
+            return cached_response(request, args, kwargs, view)
+        return wrapper
+    return decorator
@@ -0,0 +1,150 @@
+"""
+Conditional GET for place and listing pages.
+
+``conditional_page(version)`` computes a page's validators *before* the view
+runs: ``version(request, *args, **kwargs)`` returns the state the page is
+built from and when it last changed, in one small query. A request whose
+``If-None-Match``/``If-Modified-Since`` still matches gets a 304 without
+touching the page cache or rendering anything.
+
+* ``place_version`` - the place row (``updated_at``, ``total_ratings``, which
+  moves when a review is deleted), its latest ``Review.updated_at`` and the
+  ``place:<slug>``/``terms`` cache namespaces (images, categories, tags)
+* ``catalogue_version`` - the latest ``Place.updated_at`` and
+  ``Review.updated_at`` overall and the ``places``/``terms`` namespaces
+* ``homepage_version`` - the catalogue version and the ``website_reviews``
+  namespace
+
+The ETag is weak (the markup embeds per-render CSRF tokens) and also covers
+the URL and ``PAGE_ETAG_VERSION``, to be bumped on deploys that change
+templates. Only anonymous pages are validated: they are ``public`` with
+``s-maxage`` so an HTTP cache in front of the site can serve them, while
+browsers revalidate every time. Pages for logged-in users also show per-user
+state that is not versioned (navigation, agent status) and are sent
+``private, no-cache``. Both vary on ``Cookie``. Anonymous pages tagged with
+surrogate keys also get ``Surrogate-Control`` (see ``surrogate.py``).
+"""
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.db.models import OuterRef, Subquery
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from . import caching, surrogate
+from .models import Place, Review
+
+
+def _latest_review(**filters):
+    return Subquery(Review.objects.filter(**filters).order_by('-updated_at').values('updated_at')[:1])
+
+
+def _last_modified(*timestamps):
+    return max((timestamp for timestamp in timestamps if timestamp), default=None)
+
+
+def catalogue_changes():
+    return (Place.objects.annotate(latest_review=_latest_review())
+            .order_by('-updated_at').values_list('updated_at', 'latest_review'))
+
+
+def place_changes(slug):
+    return (Place.objects.filter(slug=slug).annotate(latest_review=_latest_review(place=OuterRef('pk')))
+            .values_list('updated_at', 'total_ratings', 'latest_review'))
+
+
+def catalogue_version(request, *args, **kwargs):
+    """Validators of pages listing places (explore, the place list)."""
+    latest = catalogue_changes().first()
+    place_updated, review_updated = latest or (None, None)
+    state = (place_updated, review_updated, caching.versions('places', 'terms'))
+    return state, _last_modified(place_updated, review_updated)
+
+
+def homepage_version(request):
+    """Validators of the homepage: the catalogue and the testimonials."""
+    state, _ = catalogue_version(request)
+    # No Last-Modified: testimonials have no change time
+    return (state, caching.versions('website_reviews')), None
+
+
+def place_version(request, slug):
+    """Validators of a place detail page, or None if there is no such place."""
+    row = place_changes(slug).first()
+    if row is None:
+        return None
+    place_updated, total_ratings, review_updated = row
+    state = (place_updated, total_ratings, review_updated,
+             caching.versions(caching.place_namespace(slug), 'terms'))
+    return state, _last_modified(place_updated, review_updated)
+
+
+def _validators(request, version, args, kwargs):
+    """``(etag, last_modified timestamp)`` of the requested page, or None."""
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return None
+    if len(get_messages(request)):
+        # Pending flash messages make the page unique to this render
+        return None
+    found = version(request, *args, **kwargs)
+    if found is None:
+        return None
+    state, last_modified = found
+    raw = f'{settings.PAGE_ETAG_VERSION}|{request.get_full_path()}|{state}'
+    etag = f'W/"{hashlib.sha1(raw.encode()).hexdigest()}"'
+    return etag, int(last_modified.timestamp()) if last_modified else None
+
+
+def _finish(request, response, validators):
+    if request.method not in ('GET', 'HEAD') or not (response.status_code == 304 or 200 <= response.status_code < 300):
+        return response
+    if validators:
+        etag, last_modified = validators
+        response.headers.setdefault('ETag', etag)
+        if last_modified and not response.has_header('Last-Modified'):
+            response['Last-Modified'] = http_date(last_modified)
+    patch_vary_headers(response, ('Cookie',))
+    if request.user.is_authenticated or response.cookies:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, max_age=0, s_maxage=settings.PAGE_SHARED_MAX_AGE)
+        if response.has_header(surrogate.HEADER):
+            # Purged by key when what it shows changes (surrogate.py)
+            response['Surrogate-Control'] = f'max-age={settings.SURROGATE_MAX_AGE}'
+    return response
+
+
+def conditional_page(version):
+    """
+    Answer conditional GETs of a view from ``version`` without calling it,
+    and set ETag, Last-Modified, Cache-Control and Vary on its responses.
+    Works on sync and async views.
+    """
+    def decorator(view):
+        def check(request, args, kwargs):
+            validators = _validators(request, version, args, kwargs)
+            if validators is None:
+                return None, None
+            return validators, get_conditional_response(request, etag=validators[0], last_modified=validators[1])
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                request.user = await request.auser()
+                validators, response = await sync_to_async(check)(request, args, kwargs)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _finish(request, response, validators)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            validators, response = check(request, args, kwargs)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return _finish(request, response, validators)
+        return wrapper
+    return decorator
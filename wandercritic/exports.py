@@ -0,0 +1,132 @@
+"""
+Streaming CSV/JSONL exports of places, reviews, reports and travel agent
+applications.
+
+Rows are read with ``values_list(...).iterator(chunk_size=EXPORT_CHUNK_SIZE)``
+and written out one at a time, so memory stays flat however large the table
+is. Related columns (a reviewer's username, a place's slug) are joined in the
+same query. Used by the admin export actions and
+``python manage.py export_rows``.
+
+Under ASGI the response is an async iterator pulling each line through
+``sync_to_async``, in the thread holding the database cursor; Django would
+otherwise read a sync streaming response whole before sending it.
+"""
+import csv
+import json
+from dataclasses import dataclass
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Place, Report, Review, TravelAgentApplication
+
+
+@dataclass(frozen=True)
+class Export:
+    name: str
+    model: type
+    # (column, lookup) pairs; lookups may follow foreign keys
+    columns: tuple
+
+    @property
+    def headers(self):
+        return [column for column, _ in self.columns]
+
+    def rows(self, queryset, chunk_size=None):
+        lookups = [lookup for _, lookup in self.columns]
+        return queryset.order_by('pk').values_list(*lookups).iterator(
+            chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE
+        )
+
+
+EXPORTS = {
+    export.name: export for export in [
+        Export('places', Place, (
+            ('id', 'id'), ('slug', 'slug'), ('name', 'name'), ('location', 'location'),
+            ('created_by', 'created_by__username'), ('average_rating', 'average_rating'),
+            ('total_ratings', 'total_ratings'), ('budget', 'budget'),
+            ('created_at', 'created_at'), ('updated_at', 'updated_at'),
+        )),
+        Export('reviews', Review, (
+            ('id', 'id'), ('place', 'place__slug'), ('user', 'user__username'), ('rating', 'rating'),
+            ('comment', 'comment'), ('created_at', 'created_at'), ('updated_at', 'updated_at'),
+        )),
+        Export('reports', Report, (
+            ('id', 'id'), ('reporter', 'reporter__username'), ('content_type', 'content_type'),
+            ('report_type', 'report_type'), ('status', 'status'), ('place', 'place__slug'),
+            ('review_id', 'review_id'), ('url', 'url'), ('description', 'description'),
+            ('created_at', 'created_at'), ('resolved_at', 'resolved_at'),
+            ('resolved_by', 'resolved_by__username'),
+        )),
+        Export('applications', TravelAgentApplication, (
+            ('id', 'id'), ('user', 'user__username'), ('full_name', 'full_name'),
+            ('company_name', 'company_name'), ('website', 'website'), ('phone', 'phone'),
+            ('status', 'status'), ('created_at', 'created_at'), ('updated_at', 'updated_at'),
+        )),
+    ]
+}
+
+
+def for_model(model):
+    return next(export for export in EXPORTS.values() if export.model is model)
+
+
+class _Echo:
+    """File-like object that returns what is written, for ``csv.writer``."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(export, queryset, chunk_size=None):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(export.headers)
+    for row in export.rows(queryset, chunk_size):
+        yield writer.writerow(row)
+
+
+def jsonl_lines(export, queryset, chunk_size=None):
+    headers = export.headers
+    for row in export.rows(queryset, chunk_size):
+        yield json.dumps(dict(zip(headers, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'jsonl': (jsonl_lines, 'application/x-ndjson'),
+}
+
+
+def lines(export, queryset, format, chunk_size=None):
+    """Encoded rows of ``queryset`` in ``format``, one line at a time."""
+    write, _ = FORMATS[format]
+    return write(export, queryset, chunk_size)
+
+
+async def _pulled(iterator):
+    pull = sync_to_async(next)
+    try:
+        while (item := await pull(iterator, None)) is not None:
+            yield item
+    finally:
+        await sync_to_async(iterator.close)()
+
+
+def streaming_response(queryset, format, request=None):
+    """A download of ``queryset`` in ``format`` ('csv' or 'jsonl')."""
+    export = for_model(queryset.model)
+    _, content_type = FORMATS[format]
+    filename = f'{export.name}-{timezone.now():%Y%m%d-%H%M%S}.{format}'
+    content = lines(export, queryset, format)
+    if isinstance(request, ASGIRequest):
+        content = _pulled(content)
+    return StreamingHttpResponse(
+        content,
+        content_type=content_type,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
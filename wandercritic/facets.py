@@ -0,0 +1,185 @@
+"""
+Faceted filtering and counts for the explore page.
+
+A ``FacetSelection`` holds the categories, tags and budget ranges picked on
+explore. Categories and tags are multi-select and match *any* (OR) or *all*
+(AND) of the picked values; budget ranges never overlap, so they always
+match any.
+
+``facet_counts()`` says how many places each option would match, for every
+option, in three grouped queries whatever the number of terms:
+
+* for an OR facet, the counts ignore that facet's own selection, so the
+  alternatives to what is picked stay visible;
+* for an AND facet they include it, so they show how far each extra value
+  narrows the result.
+"""
+from dataclasses import dataclass
+
+from django.db.models import Count, Exists, OuterRef, Q
+
+MODES = ('any', 'all')
+
+# Budget buckets in GBP; the last one is open-ended
+BUDGET_RANGES = {
+    '0-10': (0, 10),
+    '11-20': (11, 20),
+    '21-50': (21, 50),
+    '51-100': (51, 100),
+    '101-200': (101, 200),
+    '201+': (201, None),
+}
+
+BUDGET_RANGE_CHOICES = [
+    ('0-10', '£0 - £10'),
+    ('11-20', '£11 - £20'),
+    ('21-50', '£21 - £50'),
+    ('51-100', '£51 - £100'),
+    ('101-200', '£101 - £200'),
+    ('201+', '£201+'),
+]
+
+
+@dataclass(frozen=True)
+class FacetSelection:
+    categories: tuple = ()
+    tags: tuple = ()
+    budgets: tuple = ()
+    category_mode: str = 'any'
+    tag_mode: str = 'any'
+
+    @classmethod
+    def from_params(cls, params):
+        def values(name):
+            # Sorted so equivalent selections share a cache key
+            return tuple(sorted({value for value in params.getlist(name) if value}))
+
+        def mode(name):
+            value = params.get(name, 'any')
+            return value if value in MODES else 'any'
+
+        return cls(
+            categories=values('category'),
+            tags=values('tag'),
+            budgets=tuple(value for value in values('budget_range') if value in BUDGET_RANGES),
+            category_mode=mode('category_mode'),
+            tag_mode=mode('tag_mode'),
+        )
+
+    def __bool__(self):
+        return bool(self.categories or self.tags or self.budgets)
+
+    @property
+    def key(self):
+        return repr((self.categories, self.tags, self.budgets, self.category_mode, self.tag_mode))
+
+    def without(self, facet):
+        """This selection with ``facet`` ('categories', 'tags' or 'budgets') cleared."""
+        return FacetSelection(**{**self.__dict__, facet: ()})
+
+
+def budget_q(key):
+    low, high = BUDGET_RANGES[key]
+    if high is None:
+        return Q(budget__gte=low)
+    return Q(budget__range=(low, high))
+
+
+def budget_bucket(budget):
+    """The ``BUDGET_RANGES`` key matching ``budget`` the way ``budget_q()`` does, or None."""
+    if budget is None:
+        return None
+    for key, (low, high) in BUDGET_RANGES.items():
+        if budget >= low and (high is None or budget <= high):
+            return key
+    return None
+
+
+def _term_filters(through, term_field, names, mode):
+    """EXISTS filters on the M2M table ``through``; no joins, so no .distinct()."""
+    lookup = f'{term_field}__name'
+    if mode == 'all':
+        return [
+            Exists(through.objects.filter(place_id=OuterRef('pk'), **{lookup: name}))
+            for name in names
+        ]
+    return [Exists(through.objects.filter(place_id=OuterRef('pk'), **{f'{lookup}__in': names}))]
+
+
+def filter_places(places, selection):
+    """Restrict the ``places`` queryset to ``selection``."""
+    from .models import Place
+
+    if selection.categories:
+        places = places.filter(*_term_filters(
+            Place.categories.through, 'placecategory', selection.categories, selection.category_mode))
+    if selection.tags:
+        places = places.filter(*_term_filters(Place.tags.through, 'tag', selection.tags, selection.tag_mode))
+    if selection.budgets:
+        budget = Q()
+        for key in selection.budgets:
+            budget |= budget_q(key)
+        places = places.filter(budget)
+    return places
+
+
+def _base_for(selection, facet, mode):
+    # OR facets are counted as if nothing were picked in them
+    return selection if mode == 'all' else selection.without(facet)
+
+
+def facet_counts(places, selection):
+    """
+    ``{'categories': {id: count}, 'tags': {id: count}, 'budgets': {key: count}}``
+    for the ``places`` queryset (already searched, not yet faceted).
+    """
+    from .models import Place
+
+    places = places.order_by()
+    categories_base = filter_places(places, _base_for(selection, 'categories', selection.category_mode))
+    tags_base = filter_places(places, _base_for(selection, 'tags', selection.tag_mode))
+    budgets_base = filter_places(places, selection.without('budgets'))
+
+    categories = dict(
+        Place.categories.through.objects.filter(place_id__in=categories_base.values('pk'))
+        .values('placecategory_id').annotate(count=Count('place_id')).values_list('placecategory_id', 'count')
+    )
+    tags = dict(
+        Place.tags.through.objects.filter(place_id__in=tags_base.values('pk'))
+        .values('tag_id').annotate(count=Count('place_id')).values_list('tag_id', 'count')
+    )
+    aliases = {f'budget_{i}': key for i, key in enumerate(BUDGET_RANGES)}
+    budgets = budgets_base.aggregate(**{
+        alias: Count('pk', filter=budget_q(key)) for alias, key in aliases.items()
+    })
+    return {
+        'categories': categories,
+        'tags': tags,
+        'budgets': {aliases[alias]: count for alias, count in budgets.items()},
+    }
+
+
+@dataclass
+class FacetOption:
+    value: str
+    label: str
+    count: int
+    selected: bool
+
+
+def facet_options(counts, selection, categories, tags):
+    """Options for the explore template: every term with its count and whether it is picked."""
+    def options(terms, picked, term_counts):
+        return [
+            FacetOption(term.name, term.name, term_counts.get(term.pk, 0), term.name in picked)
+            for term in terms
+        ]
+
+    return {
+        'categories': options(categories, selection.categories, counts['categories']),
+        'tags': options(tags, selection.tags, counts['tags']),
+        'budgets': [
+            FacetOption(key, label, counts['budgets'].get(key, 0), key in selection.budgets)
+            for key, label in BUDGET_RANGE_CHOICES
+        ],
+    }
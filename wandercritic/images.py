@@ -0,0 +1,206 @@
+"""
+Resized renditions of uploaded images.
+
+Every upload gets a fixed set of renditions (card, gallery, hero, avatar) in
+WebP and JPEG, written once under ``MEDIA_ROOT/<IMAGE_RENDITIONS_DIR>/``. The
+file name of a rendition is derived from the source name and the rendition
+spec only, so templates can build ``srcset`` URLs without touching the source
+image. Widths wider (or, when cropped, taller) than the source are skipped
+rather than upscaled.
+
+Which renditions exist is stored next to the image, in a
+``<field>_renditions`` JSON field of the row (``record_renditions()``). The
+``{% responsive_image %}`` tag in ``wandercritic_images`` reads it to emit the
+markup, and falls back to the original upload until the renditions are
+recorded for the image's current name.
+
+Renditions are generated by a background thread after a model with an image
+is saved (``build_later()``, see ``wandercritic.signals``), and can be
+backfilled with ``python manage.py build_renditions``.
+"""
+import hashlib
+import logging
+import os
+import posixpath
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import DatabaseError, connections
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Bump to regenerate every rendition after changing the resize code
+RENDITION_VERSION = 1
+
+FORMATS = {
+    # format: (extension, Pillow save options)
+    'webp': ('webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+@dataclass(frozen=True)
+class Rendition:
+    name: str
+    widths: tuple
+    aspect: tuple = None  # (w, h) to crop to, None keeps the source aspect
+    sizes: str = '100vw'
+
+    def height_for(self, width):
+        if self.aspect is None:
+            return None
+        return round(width * self.aspect[1] / self.aspect[0])
+
+
+RENDITIONS = {
+    'card': Rendition('card', (320, 640), (3, 2), '(max-width: 700px) 100vw, 400px'),
+    'gallery': Rendition('gallery', (480, 960), (4, 3), '(max-width: 700px) 100vw, 33vw'),
+    'hero': Rendition('hero', (960, 1600), None, '(max-width: 960px) 100vw, 50vw'),
+    'avatar': Rendition('avatar', (64, 128), (1, 1), '64px'),
+}
+
+# Renditions generated for uploads, by upload_to directory
+UPLOAD_RENDITIONS = {
+    'places/': ('card', 'gallery', 'hero'),
+    'profile_pics/': ('avatar',),
+}
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+
+
+def rendition_storage():
+    directory = getattr(settings, 'IMAGE_RENDITIONS_DIR', 'renditions')
+    return FileSystemStorage(
+        location=os.path.join(settings.MEDIA_ROOT, directory),
+        base_url=posixpath.join(settings.MEDIA_URL, directory, ''),
+    )
+
+
+def renditions_for(name):
+    """Names of the renditions made for the upload stored as ``name``."""
+    for prefix, renditions in UPLOAD_RENDITIONS.items():
+        if name.startswith(prefix):
+            return renditions
+    return ()
+
+
+def rendition_key(name, rendition):
+    spec = RENDITIONS[rendition]
+    raw = f'{name}|{spec.name}|{spec.widths}|{spec.aspect}|{RENDITION_VERSION}'
+    return hashlib.sha1(raw.encode()).hexdigest()[:24]
+
+
+def rendition_name(name, rendition, width, fmt):
+    key = rendition_key(name, rendition)
+    return f'{key[:2]}/{key}-{width}.{FORMATS[fmt][0]}'
+
+
+def rendition_urls(name, rendition, fmt, widths):
+    """``[(url, width), ...]`` for ``widths`` of ``rendition``."""
+    storage = rendition_storage()
+    return [(storage.url(rendition_name(name, rendition, width, fmt)), width) for width in widths]
+
+
+def _recorded(image):
+    state = getattr(image.instance, f'{image.field.name}_renditions', None) or {}
+    if state.get('name') != image.name or state.get('version') != RENDITION_VERSION:
+        return None
+    return state
+
+
+def has_renditions(image):
+    """Whether the renditions of ``image`` (a FieldFile) are recorded for its current name."""
+    return _recorded(image) is not None
+
+
+def rendition_widths(image, rendition):
+    """Widths of ``rendition`` recorded for ``image`` (a FieldFile), or ``[]``."""
+    state = _recorded(image)
+    return state['widths'].get(rendition, []) if state else []
+
+
+def _fits(image, spec, width):
+    height = spec.height_for(width)
+    return width <= image.width and (height is None or height <= image.height)
+
+
+def _resize(image, spec, width):
+    height = spec.height_for(width)
+    if height is None:
+        height = round(image.height * width / image.width)
+        return image.resize((width, height), Image.LANCZOS)
+    return ImageOps.fit(image, (width, height), Image.LANCZOS)
+
+
+def generate_renditions(name, renditions=None, force=False):
+    """
+    Write the renditions of the upload stored as ``name`` (relative to
+    MEDIA_ROOT) and return their state for ``record_renditions()``. Files
+    already written are kept unless ``force``; safe to call repeatedly.
+    """
+    renditions = renditions_for(name) if renditions is None else renditions
+    storage = rendition_storage()
+    state = {'name': name, 'version': RENDITION_VERSION, 'widths': {}}
+    with Image.open(os.path.join(settings.MEDIA_ROOT, name)) as source:
+        image = ImageOps.exif_transpose(source).convert('RGB')
+    for rendition in renditions:
+        spec = RENDITIONS[rendition]
+        widths = [width for width in spec.widths if _fits(image, spec, width)]
+        for width in widths:
+            names = [rendition_name(name, rendition, width, fmt) for fmt in ('webp', 'jpeg')]
+            if not force and all(storage.exists(n) for n in names):
+                continue
+            resized = _resize(image, spec, width)
+            for fmt, rendition_file in zip(('webp', 'jpeg'), names):
+                path = storage.path(rendition_file)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Unique temp file so concurrent workers never clobber each other
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    resized.save(f, format=fmt.upper(), **FORMATS[fmt][1])
+                os.replace(tmp_path, path)
+        if widths:
+            state['widths'][rendition] = widths
+    return state
+
+
+def record_renditions(name, state):
+    """Store ``state`` on every row whose image is ``name``. Returns the row count."""
+    from .storage import REFERENCING_FIELDS
+
+    count = 0
+    for app_label, model_name, field_name in REFERENCING_FIELDS:
+        model = apps.get_model(app_label, model_name)
+        count += model._default_manager.filter(**{field_name: name}).update(**{f'{field_name}_renditions': state})
+    return count
+
+
+_builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='renditions')
+
+
+def _build(name):
+    try:
+        record_renditions(name, generate_renditions(name))
+    except (OSError, ValueError, DatabaseError):
+        logger.exception('Could not generate renditions for %s', name)
+    finally:
+        # This thread's connection, opened by record_renditions()
+        connections.close_all()
+
+
+def build_later(name):
+    """Generate and record the renditions of ``name`` off the request path."""
+    _builder.submit(_build, name)
+
+
+def delete_renditions(name):
+    storage = rendition_storage()
+    for rendition in renditions_for(name):
+        for width in RENDITIONS[rendition].widths:
+            for fmt in FORMATS:
+                storage.delete(rendition_name(name, rendition, width, fmt))
@@ -0,0 +1,128 @@
+"""
+Indexes kept in each process's memory and rebuilt from the database.
+
+An ``IndexHolder`` keeps the current build of one such index
+(``bitmap_index``, ``autocomplete``). Requests never build it: ``get()``
+returns the index, or None until the first build is done (callers then fall
+back to SQL), and starts a rebuild in a background thread when the index is
+stale:
+
+* its cache namespace was bumped since the build, i.e. another process or a
+  management command changed what it covers;
+* the cache is not shared between processes, so such bumps cannot be seen,
+  and the build is older than the index's rebuild interval.
+
+Changes made in this process are applied to the index in place through
+``apply_change()``. ``warm_up()`` builds the index at once; the ASGI entry
+point calls it on lifespan startup.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from . import caching
+
+logger = logging.getLogger(__name__)
+
+
+class IndexHolder:
+    def __init__(self, build, namespace, interval_setting, enabled_setting=None):
+        """
+        ``build()`` returns a new index with ``lock``, ``version`` (of
+        ``namespace`` when the build started) and ``built_at`` attributes.
+        """
+        self.build = build
+        self.namespace = namespace
+        self.interval_setting = interval_setting
+        self.enabled_setting = enabled_setting
+        self.index = None
+        self.lock = threading.Lock()
+        self.building = False
+        # Bumped by reset() so a build started before it is thrown away
+        self.generation = 0
+
+    @property
+    def enabled(self):
+        return self.enabled_setting is None or getattr(settings, self.enabled_setting, True)
+
+    def stale(self, index):
+        if index.version != caching.versions(self.namespace):
+            return True
+        return (not caching.shared()
+                and time.monotonic() - index.built_at >= getattr(settings, self.interval_setting))
+
+    def get(self):
+        """The current index, or None when disabled or not built yet."""
+        if not self.enabled:
+            return None
+        index = self.index
+        if index is None or self.stale(index):
+            self.rebuild_later()
+        return index
+
+    def rebuild(self):
+        generation = self.generation
+        index = self.build()
+        with self.lock:
+            if generation == self.generation:
+                self.index = index
+        return index
+
+    def rebuild_later(self):
+        """Rebuild in a background thread, unless a rebuild is already running."""
+        with self.lock:
+            if self.building:
+                return
+            self.building = True
+        threading.Thread(target=self._rebuild_in_background, name=f'{self.namespace} index', daemon=True).start()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except DatabaseError:
+            logger.warning('Could not rebuild the %s index', self.namespace, exc_info=True)
+        finally:
+            self.building = False
+            connections.close_all()
+
+    def warm_up(self):
+        """Build the index now rather than after the first request; None if the database is not ready."""
+        if not self.enabled:
+            return None
+        try:
+            return self.rebuild()
+        except DatabaseError:
+            # e.g. not migrated yet; built in the background on first use instead
+            logger.warning('Could not build the %s index', self.namespace, exc_info=True)
+            return None
+
+    def apply_change(self, change, notify=True):
+        """
+        Run ``change(index)`` on this process's index, if it has been built,
+        and unless ``notify`` is false tell the other processes to rebuild theirs.
+        """
+        index = self.index
+        if index is None:
+            if notify:
+                caching.bump(self.namespace)
+            return
+        with index.lock:
+            change(index)
+            if notify:
+                self.applied(index)
+
+    def applied(self, index):
+        """Record a change applied to ``index``, without making other processes' changes look seen."""
+        before = index.version
+        caching.bump(self.namespace)
+        after = caching.versions(self.namespace)
+        if before is not None and after.isdigit() and before.isdigit() and int(after) == int(before) + 1:
+            index.version = after
+
+    def reset(self):
+        with self.lock:
+            self.index = None
+            self.generation += 1
@@ -0,0 +1,178 @@
+"""
+Per-request database instrumentation.
+
+``QueryCountMiddleware`` records every query a request runs (through
+``connection.execute_wrapper``): how many, the total time spent in the
+database and which statements ran more than once with only their parameters
+changing - the signature of an N+1 loop in a template.
+
+Views declare what they may cost with ``@query_budget``::
+
+    @query_budget(6)
+    def index(request): ...
+
+A request over its budget is logged as a warning, and
+``assert_query_budget()`` fails a test for it. Set ``QUERY_COUNT_HEADER`` to
+add ``X-DB-Queries``/``X-DB-Time``/``X-DB-Duplicates`` response headers and
+``QUERY_COUNT_LOG`` to log one line per request.
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.urls import resolve
+
+logger = logging.getLogger(__name__)
+
+# Collapse literals and placeholder lists so "WHERE id IN (%s, %s)" and
+# "WHERE id IN (%s)" count as the same statement
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+
+
+def fingerprint(sql):
+    sql = _LITERALS.sub('?', sql)
+    sql = _PLACEHOLDER_LISTS.sub('(...)', sql)
+    return ' '.join(sql.split())
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    duration: float = 0.0  # seconds
+    fingerprints: Counter = field(default_factory=Counter)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    @property
+    def duplicates(self):
+        """``[(fingerprint, times), ...]`` for statements run more than once, most repeated first."""
+        return [(sql, times) for sql, times in self.fingerprints.most_common() if times > 1]
+
+    @property
+    def duplicate_count(self):
+        return sum(times - 1 for _, times in self.duplicates)
+
+
+@contextmanager
+def record_queries():
+    """Count the queries run on every database connection inside the block."""
+    stats = QueryStats()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+        yield stats
+
+
+@dataclass(frozen=True)
+class QueryBudget:
+    max_queries: int
+    max_duplicates: int = None
+
+    def violations(self, stats):
+        problems = []
+        if stats.count > self.max_queries:
+            problems.append(f'{stats.count} queries (budget {self.max_queries})')
+        if self.max_duplicates is not None and stats.duplicate_count > self.max_duplicates:
+            problems.append(f'{stats.duplicate_count} duplicated queries (budget {self.max_duplicates})')
+        return problems
+
+
+def query_budget(max_queries, max_duplicates=0):
+    """Declare the most queries (and repeated statements) a view may run."""
+    def decorator(view):
+        # Decorators applied on top copy the attribute along with __dict__
+        view.query_budget = QueryBudget(max_queries, max_duplicates)
+        return view
+    return decorator
+
+
+class QueryCountMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.query_budget = None
+        with record_queries() as stats:
+            response = self.get_response(request)
+        return self.report(request, response, stats)
+
+    async def __acall__(self, request):
+        # Connections are per thread: the async ORM runs every query of the
+        # request in one thread-sensitive worker, so wrap its connections
+        request.query_budget = None
+        recorder = record_queries()
+        stats = await sync_to_async(recorder.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(recorder.__exit__)(None, None, None)
+        return self.report(request, response, stats)
+
+    def report(self, request, response, stats):
+        response.query_stats = stats
+
+        if getattr(settings, 'QUERY_COUNT_HEADER', False):
+            response['X-DB-Queries'] = str(stats.count)
+            response['X-DB-Time'] = f'{stats.duration * 1000:.1f}ms'
+            response['X-DB-Duplicates'] = str(stats.duplicate_count)
+
+        budget = request.query_budget
+        problems = budget.violations(stats) if budget else []
+        if problems:
+            logger.warning(
+                '%s %s exceeded its query budget: %s; most repeated: %s',
+                request.method, request.path, ', '.join(problems),
+                '; '.join(f'{times}x {sql[:200]}' for sql, times in stats.duplicates[:3]) or '-',
+            )
+        elif getattr(settings, 'QUERY_COUNT_LOG', False):
+            logger.info(
+                '%s %s: %d queries in %.1fms, %d duplicated',
+                request.method, request.path, stats.count, stats.duration * 1000, stats.duplicate_count,
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = getattr(view_func, 'query_budget', None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def assert_query_budget(client, path, method='get', budget=None, **kwargs):
+    """
+    Request ``path`` with the test ``client`` and raise ``QueryBudgetExceeded``
+    if the view runs more queries than its ``@query_budget`` (or ``budget``)
+    allows. Returns the response.
+    """
+    budget = budget or getattr(resolve(path.split('?', 1)[0]).func, 'query_budget', None)
+    if budget is None:
+        raise ValueError(f'No query budget declared for {path}')
+    with record_queries() as stats:
+        response = getattr(client, method)(path, **kwargs)
+    problems = budget.violations(stats)
+    if problems:
+        repeated = '\n'.join(f'  {times}x {sql}' for sql, times in stats.duplicates)
+        raise QueryBudgetExceeded(f'{path}: {", ".join(problems)}\n{repeated}')
+    return response
@@ -0,0 +1,87 @@
+from django.core.management.base import BaseCommand, CommandError
+from wandercritic import benchmark
+from wandercritic.models import User
+
+class Command(BaseCommand):
+    help = 'Measure latency, queries and memory of the main pages and save the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Timed requests per route')
+        parser.add_argument('--warmup', type=int, default=2,
+                            help='Untimed requests per route before measuring')
+        parser.add_argument('--route', action='append', dest='routes',
+                            help='Only benchmark this route (repeatable), e.g. --route place_detail')
+        parser.add_argument('--mode', choices=['client', 'wsgi'], default='client',
+                            help='Use the test client in-process or a local WSGI server over HTTP')
+        parser.add_argument('--user',
+                            help='Log in as this username (client mode only)')
+        parser.add_argument('--cold', action='store_true',
+                            help='Clear the cache before every request')
+        parser.add_argument('--output',
+                            help='Write the results to this JSON file')
+        parser.add_argument('--compare',
+                            help='Compare with the results in this JSON file')
+        parser.add_argument('--threshold', type=float, default=10,
+                            help='Percentage slowdown reported as a regression')
+        parser.add_argument('--fail', action='store_true',
+                            help='Exit with an error when a regression is found (for CI)')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests must be at least 1')
+        user = None
+        if options['user']:
+            if options['mode'] == 'wsgi':
+                raise CommandError('--user is only supported with --mode client')
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f'No user named {options["user"]}')
+
+        routes = benchmark.default_routes()
+        if options['routes']:
+            routes = [route for route in routes if route.name in options['routes']]
+            unknown = set(options['routes']) - {route.name for route in routes}
+            if unknown:
+                raise CommandError(f'Unknown or unavailable routes: {", ".join(sorted(unknown))}')
+
+        self.stdout.write(f'{"route":<18} {"status":<8} {"p50":>8} {"p95":>8} {"p99":>8} {"queries":>8} {"peak KB":>9}')
+        result = benchmark.run(
+            routes, requests=options['requests'], warmup=options['warmup'], mode=options['mode'],
+            user=user, cold=options['cold'], progress=self.report_route,
+        )
+        rows = result['meta']['rows']
+        self.stdout.write(self.style.SUCCESS(
+            f'Benchmarked {len(routes)} routes against {rows["places"]} places and {rows["reviews"]} reviews'
+        ))
+
+        if options['output']:
+            benchmark.save(result, options['output'])
+            self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
+
+        if options['compare']:
+            self.compare(benchmark.load(options['compare']), result, options)
+
+    def report_route(self, name, stats):
+        status = ','.join(str(code) for code in stats['status'])
+        self.stdout.write(
+            f'{name:<18} {status:<8} {stats["p50_ms"]:>6.1f}ms {stats["p95_ms"]:>6.1f}ms {stats["p99_ms"]:>6.1f}ms '
+            f'{stats["queries"]:>8} {stats["peak_kb"]:>9}'
+        )
+
+    def compare(self, baseline, result, options):
+        rows, regressions = benchmark.compare(baseline, result, options['threshold'] / 100)
+        self.stdout.write(f'Compared with {options["compare"]} (revision {baseline["meta"].get("revision")}):')
+        for name, metric, before, after, change in rows:
+            line = f'{name:<18} {metric:<8} {before:>10} -> {after:<10} {change * 100:+.1f}%'
+            if (name, metric, before, after, change) in regressions:
+                self.stdout.write(self.style.WARNING(line))
+            else:
+                self.stdout.write(line)
+
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS('No regressions'))
+        elif options['fail']:
+            raise CommandError(f'{len(regressions)} metrics regressed by more than {options["threshold"]}%')
+        else:
+            self.stdout.write(self.style.WARNING(f'{len(regressions)} metrics regressed by more than {options["threshold"]}%'))
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+from wandercritic import benchmark
+
+class Command(BaseCommand):
+    help = 'Compare the throughput of the WSGI and ASGI (async views) servers under concurrent load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Timed requests per route and server')
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help='Requests in flight at once')
+        parser.add_argument('--warmup', type=int, default=2,
+                            help='Untimed requests per route before measuring')
+        parser.add_argument('--route', action='append', dest='routes',
+                            help='Only benchmark this route (repeatable), e.g. --route place_detail')
+        parser.add_argument('--server', action='append', dest='servers', choices=benchmark.SERVERS,
+                            help='Only benchmark this server (repeatable)')
+        parser.add_argument('--output',
+                            help='Write the results to this JSON file')
+        # Used by the benchmark itself to start each server in a child process
+        parser.add_argument('--serve', choices=benchmark.SERVERS,
+                            help='Serve the site with this server instead of benchmarking')
+        parser.add_argument('--port', type=int, default=8000,
+                            help='Port for --serve')
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            benchmark.serve(options['serve'], options['port'])
+            return
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be at least 1')
+
+        routes = benchmark.default_routes()
+        if options['routes']:
+            routes = [route for route in routes if route.name in options['routes']]
+            unknown = set(options['routes']) - {route.name for route in routes}
+            if unknown:
+                raise CommandError(f'Unknown or unavailable routes: {", ".join(sorted(unknown))}')
+        servers = options['servers'] or benchmark.SERVERS
+
+        self.stdout.write(f'{"server":<7} {"route":<18} {"status":<8} {"req/s":>8} {"p50":>8} {"p95":>8} {"p99":>8} {"queries":>8}')
+        try:
+            result = benchmark.load_test(
+                routes, servers, requests=options['requests'], concurrency=options['concurrency'],
+                warmup=options['warmup'], progress=self.report_route,
+            )
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        if len(result['servers']) > 1:
+            self.compare(result['servers'])
+        rows = result['meta']['rows']
+        self.stdout.write(self.style.SUCCESS(
+            f'Load-tested {len(routes)} routes at concurrency {options["concurrency"]} '
+            f'against {rows["places"]} places and {rows["reviews"]} reviews'
+        ))
+
+        if options['output']:
+            benchmark.save(result, options['output'])
+            self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
+
+    def report_route(self, server, name, stats):
+        status = ','.join(str(code) for code in stats['status'])
+        self.stdout.write(
+            f'{server:<7} {name:<18} {status:<8} {stats["rps"]:>8} {stats["p50_ms"]:>6.1f}ms '
+            f'{stats["p95_ms"]:>6.1f}ms {stats["p99_ms"]:>6.1f}ms {stats["queries"]:>8}'
+        )
+
+    def compare(self, results):
+        self.stdout.write('Throughput, ASGI against WSGI:')
+        for name, wsgi in results['wsgi'].items():
+            asgi = results['asgi'][name]
+            change = (asgi['rps'] - wsgi['rps']) / wsgi['rps'] if wsgi['rps'] else 0.0
+            self.stdout.write(f'{name:<18} {wsgi["rps"]:>8} -> {asgi["rps"]:<8} req/s {change * 100:+.1f}%')
@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from wandercritic import benchmark
+
+class Command(BaseCommand):
+    help = 'Compare the database profiles with concurrent writers posting reviews to a copy of the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8,
+                            help='Concurrent writers, each logged in as a different user')
+        parser.add_argument('--reviews', type=int, default=50,
+                            help='Reviews posted by each writer')
+        parser.add_argument('--profile', action='append', dest='profiles', choices=list(settings.DATABASE_PROFILES),
+                            help='Only benchmark this profile (repeatable)')
+        parser.add_argument('--output',
+                            help='Write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['writers'] < 1 or options['reviews'] < 1:
+            raise CommandError('--writers and --reviews must be at least 1')
+
+        self.stdout.write(f'{"profile":<12} {"writes/s":>9} {"errors":>8} {"p50":>8} {"p95":>8} {"p99":>8} {"max":>8}')
+        try:
+            result = benchmark.write_contention(
+                options['profiles'], writers=options['writers'], reviews=options['reviews'],
+                progress=self.report_profile,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f'{options["writers"]} writers posted {options["reviews"]} reviews each per profile'
+        ))
+
+        if options['output']:
+            benchmark.save(result, options['output'])
+            self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
+
+    def report_profile(self, profile, stats):
+        def ms(value):
+            return '-' if value is None else f'{value:.1f}ms'
+
+        line = (
+            f'{profile:<12} {stats["writes_per_s"]:>9} {stats["errors"]:>8} {ms(stats["p50_ms"]):>8} '
+            f'{ms(stats["p95_ms"]):>8} {ms(stats["p99_ms"]):>8} {ms(stats["max_ms"]):>8}'
+        )
+        self.stdout.write(self.style.WARNING(line) if stats['errors'] else line)
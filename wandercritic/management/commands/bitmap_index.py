@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from wandercritic import bitmap_index, caching, facets
+
+
+class Command(BaseCommand):
+    help = 'Builds the explore bitmap index and reports its size, memory footprint and filter speed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invalidate', action='store_true',
+                            help='Make running servers rebuild their index on the next request')
+        parser.add_argument('--category', action='append', default=[],
+                            help='Time a filter on this category (repeatable)')
+        parser.add_argument('--tag', action='append', default=[],
+                            help='Time a filter on this tag (repeatable)')
+
+    def handle(self, *args, **options):
+        index = bitmap_index.BitmapIndex.build()
+        self.stdout.write(
+            f'{len(index)} places, {len(index.categories)} categories, {len(index.tags)} tags, '
+            f'{len(index.budgets)} budget ranges; built in {index.build_seconds * 1000:.1f}ms'
+        )
+
+        footprint = index.memory_footprint()
+        for part, size in footprint.items():
+            self.stdout.write(f'{part:<12} {size / 1024:>10.1f} KiB')
+        self.stdout.write(f'{"total":<12} {sum(footprint.values()) / 1024:>10.1f} KiB')
+
+        selection = facets.FacetSelection(categories=tuple(options['category']), tags=tuple(options['tag']))
+        runs = 100
+        started = time.perf_counter()
+        for _ in range(runs):
+            bits = index.matching(selection)
+            ids = index.page_ids(bits)
+        filtered = (time.perf_counter() - started) / runs
+        started = time.perf_counter()
+        for _ in range(runs):
+            index.facet_counts(selection)
+        counted = (time.perf_counter() - started) / runs
+        self.stdout.write(
+            f'{bits.bit_count()} matches, first page of {len(ids)} in {filtered * 1000:.3f}ms, '
+            f'facet counts in {counted * 1000:.3f}ms'
+        )
+
+        if options['invalidate']:
+            caching.bump(bitmap_index.NAMESPACE)
+            self.stdout.write(self.style.WARNING('Running servers will rebuild their index'))
+        self.stdout.write(self.style.SUCCESS('Done'))
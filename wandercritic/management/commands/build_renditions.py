@@ -0,0 +1,54 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from wandercritic import images
+
+
+def _build(name, force):
+    # Runs in a worker process; the rows are updated by the parent
+    try:
+        return name, images.generate_renditions(name, force=force), None
+    except Exception as e:
+        return name, None, str(e)
+
+
+class Command(BaseCommand):
+    help = ('Generates the resized renditions of every uploaded image in MEDIA_ROOT '
+            'and records them on the rows showing it')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Number of worker processes')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate renditions that already exist')
+
+    def find_uploads(self):
+        for prefix in images.UPLOAD_RENDITIONS:
+            directory = os.path.join(settings.MEDIA_ROOT, prefix)
+            for root, _, files in os.walk(directory):
+                for filename in files:
+                    if filename.lower().endswith(images.IMAGE_EXTENSIONS):
+                        path = os.path.join(root, filename)
+                        yield os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+
+    def handle(self, *args, **options):
+        names = sorted(self.find_uploads())
+        self.stdout.write(f'Found {len(names)} images')
+
+        built = rows = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [executor.submit(_build, name, options['force']) for name in names]
+            for future in as_completed(futures):
+                name, state, error = future.result()
+                if error:
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f'Could not process {name}: {error}'))
+                else:
+                    built += 1
+                    rows += images.record_renditions(name, state)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Built renditions of {built} images, recorded on {rows} rows ({failed} images failed)'
+        ))
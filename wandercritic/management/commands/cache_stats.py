@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from wandercritic import caching
+
+class Command(BaseCommand):
+    help = 'Reports cache hit, miss, stale-serve and coalesced-wait counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Reset the counters after reporting them')
+
+    def handle(self, *args, **options):
+        counts = caching.stats()
+        lookups = sum(counts.values())
+        for stat in caching.STATS:
+            share = counts[stat] / lookups * 100 if lookups else 0
+            self.stdout.write(f'{stat:<10} {counts[stat]:>10} ({share:.1f}%)')
+        served = lookups - counts['miss']
+        ratio = served / lookups * 100 if lookups else 0
+        self.stdout.write(self.style.SUCCESS(f'{lookups} lookups, {ratio:.1f}% served from cache'))
+
+        if options['reset']:
+            caching.reset_stats()
+            self.stdout.write(self.style.WARNING('Counters reset'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from wandercritic import bitmap_index, caching, ratings
+from wandercritic.models import Place
+
+class Command(BaseCommand):
+    help = 'Reports places whose stored rating aggregate differs from their reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Recompute the rating counters of drifted places')
+        parser.add_argument('--fail', action='store_true',
+                            help='Exit with an error when drift is found (for cron/CI)')
+
+    def handle(self, *args, **options):
+        drifted = ratings.find_drift()
+        for place, live in drifted:
+            self.stdout.write(self.style.WARNING(
+                f'{place.slug}: stored {place.average_rating} ({place.total_ratings} ratings), '
+                f'live {live["average_rating"]} ({live["total_ratings"]} ratings)'
+            ))
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All place ratings are consistent'))
+            return
+
+        if options['fix']:
+            ratings.recompute_ratings(Place.objects.filter(pk__in=[place.pk for place, _ in drifted]))
+            caching.bump('places', bitmap_index.NAMESPACE, *(caching.place_namespace(place.slug) for place, _ in drifted))
+            self.stdout.write(self.style.SUCCESS(f'Fixed {len(drifted)} places'))
+        elif options['fail']:
+            raise CommandError(f'{len(drifted)} places have drifted ratings')
+        else:
+            self.stdout.write(f'{len(drifted)} places have drifted ratings, run with --fix to repair')
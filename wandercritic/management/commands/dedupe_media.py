@@ -0,0 +1,109 @@
+import os
+import shutil
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from wandercritic import caching, images, storage, surrogate
+from wandercritic.models import Place, User
+
+
+class Command(BaseCommand):
+    help = 'Moves uploaded media to content-addressed names and removes duplicate files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Show what would change without touching files or rows')
+        parser.add_argument('--prune', action='store_true',
+                            help='Also delete upload files that no row references')
+
+    def referenced_names(self):
+        names = set()
+        for app_label, model_name, field_name in storage.REFERENCING_FIELDS:
+            model = apps.get_model(app_label, model_name)
+            names.update(
+                model._default_manager.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+                .values_list(field_name, flat=True).distinct()
+            )
+        return names
+
+    def showing(self, names):
+        """
+        ``({place id: slug}, user ids)``: the places whose pages show one of
+        the files ``names`` (as their image, a gallery image or the picture of
+        their agent or a reviewer) and the users pictured by one.
+        """
+        users = set(User.objects.filter(profile_picture__in=names).values_list('pk', flat=True))
+        places = Place.objects.filter(
+            Q(image__in=names) | Q(images__image__in=names)
+            | Q(created_by__in=users) | Q(review__user__in=users)
+        ).distinct()
+        return dict(places.values_list('pk', 'slug')), users
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        media_root = settings.MEDIA_ROOT
+        renamed = {}
+
+        # Copy every referenced file to its content-addressed name
+        for name in sorted(self.referenced_names()):
+            path = os.path.join(media_root, name)
+            if not os.path.exists(path):
+                self.stdout.write(self.style.WARNING(f'Missing file: {name}'))
+                continue
+            new_name = storage.content_name(name, storage.file_digest(path))
+            if new_name == name:
+                continue
+            renamed[name] = new_name
+            new_path = os.path.join(media_root, new_name)
+            if not dry_run and not os.path.exists(new_path):
+                shutil.copy2(path, new_path)
+            self.stdout.write(f'{name} -> {new_name}')
+
+        self.stdout.write(f'{len(renamed)} files to rename, {len(set(renamed.values()))} distinct blobs')
+        if dry_run:
+            return
+
+        renditions = {new_name: images.generate_renditions(new_name) for new_name in set(renamed.values())}
+
+        # Point the rows at the new names
+        with transaction.atomic():
+            places, users = self.showing(renamed)
+            for app_label, model_name, field_name in storage.REFERENCING_FIELDS:
+                model = apps.get_model(app_label, model_name)
+                for old_name, new_name in renamed.items():
+                    model._default_manager.filter(**{field_name: old_name}).update(**{field_name: new_name})
+            for new_name, state in renditions.items():
+                images.record_renditions(new_name, state)
+            # .update() sends no signals: drop the cached pages showing the files
+            surrogate.purge(*map(surrogate.place_key, places), *map(surrogate.agent_key, users),
+                            *([surrogate.WEBSITE_REVIEWS] if users else []))
+        caching.bump('places', *map(caching.place_namespace, places.values()),
+                     *(['website_reviews'] if users else []))
+
+        # The old files are no longer referenced
+        freed = 0
+        for old_name in renamed:
+            path = os.path.join(media_root, old_name)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if storage.release(old_name):
+                freed += size
+
+        if options['prune']:
+            referenced = self.referenced_names()
+            for prefix in images.UPLOAD_RENDITIONS:
+                for root, _, files in os.walk(os.path.join(media_root, prefix)):
+                    for filename in files:
+                        path = os.path.join(root, filename)
+                        name = os.path.relpath(path, media_root).replace(os.sep, '/')
+                        if name not in referenced:
+                            size = os.path.getsize(path)
+                            if storage.release(name):
+                                freed += size
+                                self.stdout.write(f'Removed unreferenced file: {name}')
+                            else:
+                                self.stdout.write(f'Kept recently saved file: {name}')
+
+        self.stdout.write(self.style.SUCCESS(f'Media deduplicated, {freed / 1024 / 1024:.1f} MB freed'))
@@ -0,0 +1,131 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.http import QueryDict
+from django.utils import timezone
+from wandercritic import conditional, moderation
+from wandercritic.models import EXPLORE_ORDERING, Place, Report, Review, TravelAgentApplication, User, WebsiteReview
+from wandercritic.views import (PLACE_CARD_FIELDS, PLACE_LIST_ORDERING, REVIEW_ORDERING,
+    _explore_places, _place_reviews)
+
+# Plan lines of a full table scan or a sort that no index provides; SQLite
+# prints "USE TEMP B-TREE FOR [RIGHT PART OF] ORDER BY", "... FOR GROUP BY"
+# and "... FOR DISTINCT"
+SQLITE_WARNINGS = ('USE TEMP B-TREE',)
+POSTGRES_WARNINGS = ('Seq Scan', 'Sort ')
+# Plans that cannot avoid a flagged step, and why
+EXPECTED = {
+    'explore.search': 'full-text matches are sorted by rank',
+    'report_queue.groups': 'report groups are sorted by a priority aggregated over their reports',
+}
+
+
+def _is_full_scan(line):
+    # SQLite: "SCAN table" without an index; covering and partial indexes
+    # show up as "SCAN table USING [COVERING] INDEX name"
+    words = line.split()
+    return 'SCAN' in words and 'USING' not in words and 'VIRTUAL' not in words
+
+
+class Command(BaseCommand):
+    help = 'Print the query plan of the hot queries in views.py and flag full scans and unindexed sorts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--query', action='append', dest='queries',
+                            help='Only explain this query (repeatable), e.g. --query place_detail.reviews')
+        parser.add_argument('--sql', action='store_true',
+                            help='Also print the SQL of each query')
+        parser.add_argument('--fail', action='store_true',
+                            help='Exit with an error when a plan is flagged (for CI)')
+
+    def hot_queries(self):
+        """
+        ``[(name, query), ...]`` built the way the views build them, on real
+        rows. A query is a queryset or, for raw SQL, ``(sql, params)``.
+        """
+        place = Place.objects.order_by('-total_ratings').first()
+        user = User.objects.filter(review__isnull=False).first()
+        agent = User.objects.filter(places__isnull=False).first()
+        if place is None or user is None or agent is None:
+            raise CommandError('Needs places, reviews and an agent; run python manage.py seed_synthetic first')
+
+        explore, explore_ordering = _explore_places(QueryDict())
+        search, search_ordering = _explore_places(QueryDict('search=castle'))
+        page = settings.PLACES_PAGE_SIZE + 1
+        return [
+            ('index.places', Place.objects.select_related('created_by').only(*PLACE_CARD_FIELDS)
+                .order_by(*EXPLORE_ORDERING)[:5]),
+            ('index.website_reviews', WebsiteReview.objects.filter(is_visible=True).select_related('user')
+                .order_by('-created_at')[:3]),
+            ('explore.places', explore.order_by(*explore_ordering)[:page]),
+            ('explore.search', search.order_by(*search_ordering)[:page]),
+            ('place_list.places', Place.objects.select_related('created_by').order_by(*PLACE_LIST_ORDERING)[:page]),
+            ('place_detail.place', Place.objects.select_related('created_by').filter(slug=place.slug)),
+            ('place_detail.user_review', Review.objects.filter(place=place, user=user)[:1]),
+            ('place_detail.reviews', _place_reviews(user, place).queryset.order_by(*REVIEW_ORDERING)
+                [:settings.REVIEWS_PAGE_SIZE + 1]),
+            ('my_places.places', Place.objects.filter(created_by=agent).order_by('-created_at')),
+            ('manage_reports.reports', Report.objects.filter(reporter=user)
+                .select_related('place', 'review__place', 'resolved_by').order_by('-created_at')),
+            ('admin_reports.reports', Report.objects.select_related('place', 'reporter', 'resolved_by')
+                .order_by(*moderation.REPORT_ORDERING)[:settings.MODERATION_REPORTS_PAGE_SIZE + 1]),
+            ('admin_reports.pending', Report.objects.filter(status='pending')
+                .select_related('place', 'reporter', 'resolved_by')
+                .order_by(*moderation.REPORT_ORDERING)[:settings.MODERATION_REPORTS_PAGE_SIZE + 1]),
+            ('report_queue.groups', moderation.queue_query(connection, timezone.now())),
+            ('admin_applications.pending', TravelAgentApplication.objects.filter(status='pending')
+                .select_related('user').order_by('created_at')),
+            ('become_agent.pending', TravelAgentApplication.objects.filter(user=user, status='pending')
+                .order_by('pk')[:1]),
+            ('add_website_review.existing', WebsiteReview.objects.filter(user=user)[:1]),
+            ('conditional.catalogue', conditional.catalogue_changes()[:1]),
+            ('conditional.place', conditional.place_changes(place.slug)[:1]),
+        ]
+
+    def handle(self, *args, **options):
+        queries = self.hot_queries()
+        if options['queries']:
+            queries = [(name, queryset) for name, queryset in queries if name in options['queries']]
+            unknown = set(options['queries']) - {name for name, _ in queries}
+            if unknown:
+                raise CommandError(f'Unknown queries: {", ".join(sorted(unknown))}')
+
+        flagged = []
+        for name, queryset in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            if options['sql']:
+                self.stdout.write(f'  {queryset[0] if isinstance(queryset, tuple) else queryset.query}')
+            if name in EXPECTED:
+                self.stdout.write(f'  ({EXPECTED[name]})')
+            for line in self.explain(queryset).splitlines():
+                if self.is_warning(line) and name not in EXPECTED:
+                    flagged.append(name)
+                    self.stdout.write(self.style.WARNING(f'  {line}'))
+                else:
+                    self.stdout.write(f'  {line}')
+
+        flagged = sorted(set(flagged))
+        if not flagged:
+            self.stdout.write(self.style.SUCCESS(f'All {len(queries)} plans use an index'))
+        elif options['fail']:
+            raise CommandError(f'{len(flagged)} plans scan or sort without an index: {", ".join(flagged)}')
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'{len(flagged)} plans scan or sort without an index: {", ".join(flagged)}'
+            ))
+
+    def explain(self, query):
+        if not isinstance(query, tuple):
+            return query.explain()
+        sql, params = query
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            # SQLite rows are (id, parent, notused, detail)
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+
+    def is_warning(self, line):
+        if connection.vendor == 'sqlite':
+            return _is_full_scan(line) or any(marker in line for marker in SQLITE_WARNINGS)
+        if connection.vendor == 'postgresql':
+            return any(marker in line for marker in POSTGRES_WARNINGS)
+        return False
@@ -0,0 +1,172 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from wandercritic import autocomplete, bitmap_index, caching, ratings, surrogate
+from wandercritic.models import Place, Review, User
+
+RATINGS = {value for value, _ in Review.RATING_CHOICES}
+
+
+class RejectedRow(ValueError):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Upsert reviews from a JSONL file in batches, one object per line: '
+            '{"place": slug, "user": username, "rating": 1-5, "comment": text, "created_at": optional ISO time}')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSONL file to load, e.g. the output of export_rows reviews --format jsonl')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--rejects',
+                            help='Write rejected lines here with the reason (default PATH.rejects.jsonl)')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        self.batch_size = options['batch_size']
+        self.place_ids = {}
+        self.user_ids = {}
+        self.seen = {}
+        self.affected = set()
+        self.loaded = 0
+        self.rejected = 0
+        self.started = time.monotonic()
+
+        rejects_path = options['rejects'] or f'{options["path"]}.rejects.jsonl'
+        try:
+            source = open(options['path'], encoding='utf-8')
+        except OSError as e:
+            raise CommandError(f'Cannot read {options["path"]}: {e}')
+
+        # bulk_create skips Review.save() and the model signals: the rating
+        # counters and caches are brought up to date once at the end
+        with source, open(rejects_path, 'w', encoding='utf-8') as self.rejects:
+            batch = []
+            for line_number, line in enumerate(source, 1):
+                if not line.strip():
+                    continue
+                try:
+                    batch.append((line_number, line, self.parse(line)))
+                except RejectedRow as e:
+                    self.reject(line_number, line, e)
+                if len(batch) >= self.batch_size:
+                    self.flush(batch)
+                    batch = []
+            self.flush(batch)
+
+        if self.affected:
+            self.stdout.write(f'Recomputing the rating counters of {len(self.affected)} places...')
+            self.recompute()
+
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            f'Loaded {self.loaded} reviews for {len(self.affected)} places in {elapsed:.1f}s '
+            f'({self.loaded / elapsed if elapsed else 0:.0f} rows/s)'
+        ))
+        if self.rejected:
+            self.stdout.write(self.style.WARNING(f'Rejected {self.rejected} rows, see {rejects_path}'))
+
+    def parse(self, line):
+        """The fields of one line, checked against the Review model."""
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            raise RejectedRow(f'invalid JSON: {e}')
+        if not isinstance(row, dict):
+            raise RejectedRow('not a JSON object')
+
+        place, user = row.get('place'), row.get('user')
+        if not isinstance(place, str) or not place:
+            raise RejectedRow('missing place slug')
+        if not isinstance(user, str) or not user:
+            raise RejectedRow('missing user name')
+
+        rating = row.get('rating')
+        if isinstance(rating, str) and rating.isdigit():
+            rating = int(rating)
+        if isinstance(rating, bool) or rating not in RATINGS:
+            raise RejectedRow(f'rating must be one of {sorted(RATINGS)}')
+
+        comment = row.get('comment')
+        if not isinstance(comment, str) or not comment.strip():
+            raise RejectedRow('missing comment')
+
+        created_at = row.get('created_at')
+        if created_at in (None, ''):
+            created_at = timezone.now()
+        else:
+            try:
+                created_at = parse_datetime(created_at) if isinstance(created_at, str) else None
+            except ValueError:
+                created_at = None
+            if created_at is None:
+                raise RejectedRow('created_at is not an ISO date and time')
+            if timezone.is_naive(created_at):
+                created_at = timezone.make_aware(created_at)
+
+        return {'place': place, 'user': user, 'rating': rating, 'comment': comment, 'created_at': created_at}
+
+    def resolve(self, model, field, cache, names):
+        missing = {name for name in names if name not in cache}
+        if missing:
+            found = dict(model.objects.filter(**{f'{field}__in': missing}).values_list(field, 'pk'))
+            for name in missing:
+                cache[name] = found.get(name)
+
+    def flush(self, batch):
+        if not batch:
+            return
+        self.resolve(Place, 'slug', self.place_ids, {row['place'] for _, _, row in batch})
+        self.resolve(User, 'username', self.user_ids, {row['user'] for _, _, row in batch})
+
+        reviews = []
+        for line_number, line, row in batch:
+            place_id, user_id = self.place_ids[row['place']], self.user_ids[row['user']]
+            if place_id is None:
+                self.reject(line_number, line, f'no place with slug {row["place"]!r}')
+                continue
+            if user_id is None:
+                self.reject(line_number, line, f'no user named {row["user"]!r}')
+                continue
+            # One review per place and user (unique_together); the database
+            # copy is updated, but the file must not repeat a pair
+            first = self.seen.setdefault((place_id, user_id), line_number)
+            if first != line_number:
+                self.reject(line_number, line, f'duplicate review of this place by this user (line {first})')
+                continue
+            reviews.append(Review(
+                place_id=place_id, user_id=user_id, rating=row['rating'], comment=row['comment'],
+                created_at=row['created_at'],
+            ))
+
+        with transaction.atomic():
+            Review.objects.bulk_create(
+                reviews, update_conflicts=True, unique_fields=['place', 'user'],
+                update_fields=['rating', 'comment', 'updated_at'],
+            )
+        self.affected.update(review.place_id for review in reviews)
+        self.loaded += len(reviews)
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(f'Loaded {self.loaded} reviews ({self.loaded / elapsed if elapsed else 0:.0f} rows/s)')
+
+    def reject(self, line_number, line, reason):
+        self.rejected += 1
+        self.rejects.write(json.dumps({'line': line_number, 'error': str(reason), 'row': line.rstrip('\n')}) + '\n')
+
+    def recompute(self):
+        place_ids = sorted(self.affected)
+        slugs = []
+        for i in range(0, len(place_ids), 500):
+            places = Place.objects.filter(pk__in=place_ids[i:i + 500])
+            ratings.recompute_ratings(places)
+            slugs.extend(places.values_list('slug', flat=True))
+        caching.bump('places', bitmap_index.NAMESPACE, autocomplete.NAMESPACE,
+                     *(caching.place_namespace(slug) for slug in slugs))
+        # Explore and the place list are ordered by rating
+        surrogate.purge(surrogate.PLACE_LIST, surrogate.EXPLORE, surrogate.HOMEPAGE_TOP,
+                        *map(surrogate.place_key, place_ids))
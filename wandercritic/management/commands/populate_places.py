@@ -1,28 +1,92 @@
-from django.core.management.base import BaseCommand
-from django.core.files import File
-import requests
 import json
 import os
-from wandercritic.models import Place, PlaceImage, User, Tag, PlaceCategory
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import unquote, urlparse
+from urllib.request import url2pathname
+
 from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from django.utils.text import slugify
+from wandercritic import autocomplete, bitmap_index, caching, images, search, surrogate
+from wandercritic.models import Place, PlaceCategory, PlaceImage, Tag, User
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+except ImportError:  # only needed for http(s) image URLs
+    requests = None
+
+
+class ImageFetcher:
+    """Downloads images with one pooled, retrying HTTP session per thread."""
+
+    def __init__(self, base_dir, retries=3, timeout=30):
+        self.base_dir = base_dir
+        self.retries = retries
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            session = requests.Session()
+            retry = Retry(total=self.retries, backoff_factor=0.5,
+                          status_forcelist=(429, 500, 502, 503, 504))
+            adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=1)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.local.session = session
+        return self.local.session
+
+    def fetch(self, url):
+        parsed = urlparse(url)
+        if parsed.scheme in ('http', 'https'):
+            if requests is None:
+                raise CommandError('The requests package is needed to download images')
+            response = self.session().get(url, timeout=self.timeout)
+            response.raise_for_status()
+            return response.content
+        if parsed.scheme == 'file':
+            path = url2pathname(unquote(parsed.path))
+        else:
+            # Plain paths are relative to the fixture directory
+            path = os.path.join(self.base_dir, url)
+        with open(path, 'rb') as f:
+            return f.read()
+
 
 class Command(BaseCommand):
     help = 'Populate the database with places from JSON file'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=os.path.join(settings.BASE_DIR, 'wandercritic', 'fixtures', 'places.json'),
+                            help='JSON file with a "places" list')
+        parser.add_argument('--image-dir',
+                            help='Directory that relative image paths are resolved against '
+                                 '(defaults to the directory of the JSON file)')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Number of concurrent image downloads')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows per bulk insert')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Show what would be imported without downloading or writing anything')
+
     def handle(self, *args, **options):
+        started = time.monotonic()
+
         # Get the first travel agent user as the creator
-        try:
-            creator = User.objects.filter(is_travel_agent=True).first()
-            if not creator:
-                self.stdout.write(self.style.ERROR('No travel agent user found. Please create a travel agent user first.'))
-                return
-        except User.DoesNotExist:
-            self.stdout.write(self.style.ERROR('No users found. Please create a user first.'))
+        creator = User.objects.filter(is_travel_agent=True).first()
+        if not creator:
+            self.stdout.write(self.style.ERROR('No travel agent user found. Please create a travel agent user first.'))
             return
 
         # Read the JSON file
-        json_path = os.path.join(settings.BASE_DIR, 'wandercritic', 'fixtures', 'places.json')
+        json_path = options['file']
         try:
             with open(json_path, 'r') as f:
                 data = json.load(f)
@@ -30,82 +94,141 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR(f'JSON file not found at {json_path}'))
             return
 
-        # Process each place
+        # Skip places that already exist (by name or slug), in one query
+        existing_names = set()
+        existing_slugs = set()
+        for name, slug in Place.objects.values_list('name', 'slug'):
+            existing_names.add(name)
+            existing_slugs.add(slug)
+
+        new_places = []
         for place_data in data['places']:
-            # Check if place already exists
-            existing_place = Place.objects.filter(name=place_data['name']).first()
-            if existing_place:
+            slug = slugify(place_data['name'])
+            if place_data['name'] in existing_names or slug in existing_slugs:
                 self.stdout.write(self.style.WARNING(f"Skipping existing place: {place_data['name']}"))
                 continue
+            existing_slugs.add(slug)
+            new_places.append((slug, place_data))
 
-            # Create new place
-            # First get or create the category
-            category, _ = PlaceCategory.objects.get_or_create(name=place_data['category'])
-            
-            place = Place(
+        if options['dry_run']:
+            for slug, place_data in new_places:
+                self.stdout.write(f"Would add {place_data['name']} ({slug})")
+            self.stdout.write(self.style.SUCCESS(
+                f'Dry run: {len(new_places)} places to import, {len(data["places"]) - len(new_places)} skipped'
+            ))
+            return
+
+        image_dir = options['image_dir'] or os.path.dirname(os.path.abspath(json_path))
+        stored_images, renditions, downloaded_bytes = self.fetch_images(new_places, image_dir, options['workers'])
+
+        with transaction.atomic():
+            places = self.create_places(new_places, stored_images, renditions, creator, options['batch_size'])
+            self.link_terms(places, new_places, options['batch_size'])
+            PlaceImage.objects.bulk_create([
+                PlaceImage(place=place, image=stored_images[place.slug], caption=place.name, is_primary=True,
+                           image_renditions=renditions.get(stored_images[place.slug], {}))
+                for place in places if place.slug in stored_images
+            ], batch_size=options['batch_size'])
+            # bulk_create bypasses the model signals that keep the index in sync
+            search.index_places(Place.objects.filter(pk__in=[place.pk for place in places]))
+        caching.bump('places', 'terms', bitmap_index.NAMESPACE, autocomplete.NAMESPACE)
+        surrogate.purge(surrogate.PLACE_LIST, surrogate.EXPLORE, surrogate.HOMEPAGE_TOP)
+
+        elapsed = time.monotonic() - started
+        rate = len(places) / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Database population complete! {len(places)} places added '
+            f'({len(places) - len(stored_images)} without image), '
+            f'{downloaded_bytes / 1024 / 1024:.1f} MB of images in {elapsed:.1f}s ({rate:.1f} places/s)'
+        ))
+
+    def fetch_images(self, new_places, image_dir, workers):
+        """
+        Download and store every image concurrently and generate its renditions.
+        Returns ({slug: name}, {name: renditions}, bytes).
+        """
+        fetcher = ImageFetcher(image_dir)
+
+        def fetch_and_store(slug, url):
+            content = fetcher.fetch(url)
+            name = default_storage.save(os.path.join('places', f'{slug}.jpg'), ContentFile(content))
+            return len(content), name, images.generate_renditions(name)
+
+        stored = {}
+        renditions = {}
+        downloaded = 0
+        jobs = [(slug, place_data['image_url']) for slug, place_data in new_places if place_data.get('image_url')]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {executor.submit(fetch_and_store, slug, url): slug for slug, url in jobs}
+            for done, future in enumerate(as_completed(futures), 1):
+                slug = futures[future]
+                try:
+                    size, name, state = future.result()
+                except Exception as e:
+                    self.stdout.write(self.style.WARNING(f'Could not download image for {slug}: {e}'))
+                    continue
+                stored[slug] = name
+                renditions[name] = state
+                downloaded += size
+                if done % 50 == 0 or done == len(jobs):
+                    self.stdout.write(f'Fetched {done}/{len(jobs)} images')
+        return stored, renditions, downloaded
+
+    def create_places(self, new_places, stored_images, renditions, creator, batch_size):
+        places = [
+            Place(
                 name=place_data['name'],
+                slug=slug,
                 description=place_data['description'],
                 short_description=place_data['short_description'],
                 location=place_data['location'],
+                image=stored_images.get(slug, ''),
+                image_renditions=renditions.get(stored_images.get(slug), {}),
                 created_by=creator,
                 history=place_data.get('history', ''),
+                # One entry per line, as read by Place.highlights_list/tips_list
+                highlights='\n'.join(place_data.get('highlights', [])),
                 best_time_to_visit=place_data.get('best_time_to_visit', ''),
                 getting_there=place_data.get('getting_there', ''),
-                tips=place_data.get('tips', []),
+                tips='\n'.join(place_data.get('tips', [])),
                 budget=place_data.get('budget', None)
             )
-            place.save()
-
-            # Set the category
-            place.category = category
-            place.save()
-
-            # Create highlights as a JSON field
-            place.highlights = place_data['highlights']
-            place.save()
-
-            # Create tags
-            for tag_name in place_data['tags']:
-                slug = slugify(tag_name)
-                tag, created = Tag.objects.get_or_create(
-                    slug=slug,
-                    defaults={'name': tag_name}
-                )
-                place.tags.add(tag)
-
-            # Download and save image
-            if place_data['image_url']:
-                try:
-                    # Download image
-                    response = requests.get(place_data['image_url'])
-                    response.raise_for_status()
-
-                    # Create image filename using place name
-                    image_name = f"{place.name.replace(' ', '_').lower()}.jpg"
-                    image_path = os.path.join(settings.MEDIA_ROOT, 'places', image_name)
-
-                    # Save image to media directory
-                    os.makedirs(os.path.dirname(image_path), exist_ok=True)
-                    with open(image_path, 'wb') as f:
-                        f.write(response.content)
-
-                    # Create PlaceImage
-                    with open(image_path, 'rb') as f:
-                        image_file = File(f)
-                        # Set the file name to a relative path (relative to MEDIA_ROOT)
-                        image_file.name = os.path.join('places', image_name)
-                        place_image = PlaceImage(
-                            place=place,
-                            image=image_file,
-                            caption=place.name,
-                            is_primary=True
-                        )
-                        place_image.save()
-
-                    self.stdout.write(self.style.SUCCESS(f"Successfully added {place.name} with image"))
-
-                except requests.RequestException as e:
-                    self.stdout.write(self.style.WARNING(f"Could not download image for {place.name}: {str(e)}"))
-                    self.stdout.write(self.style.SUCCESS(f"Successfully added {place.name} without image"))
-
-        self.stdout.write(self.style.SUCCESS("Database population complete!"))
+            for slug, place_data in new_places
+        ]
+        Place.objects.bulk_create(places, batch_size=batch_size)
+        if places and places[0].pk is None:
+            # Backends that cannot return ids from bulk inserts
+            ids = dict(Place.objects.filter(slug__in=[p.slug for p in places]).values_list('slug', 'pk'))
+            for place in places:
+                place.pk = ids[place.slug]
+        return places
+
+    def link_terms(self, places, new_places, batch_size):
+        """Create missing categories/tags and the M2M rows in bulk."""
+        category_names = {place_data['category'] for _, place_data in new_places if place_data.get('category')}
+        tag_names = {tag for _, place_data in new_places for tag in place_data.get('tags', [])}
+        categories = self.terms_by_slug(PlaceCategory, category_names, batch_size)
+        tags = self.terms_by_slug(Tag, tag_names, batch_size)
+
+        category_links = []
+        tag_links = []
+        for place, (_, place_data) in zip(places, new_places):
+            if place_data.get('category'):
+                category_links.append(Place.categories.through(
+                    place_id=place.pk, placecategory_id=categories[slugify(place_data['category'])]))
+            for tag_id in {tags[slugify(tag)] for tag in place_data.get('tags', [])}:
+                tag_links.append(Place.tags.through(place_id=place.pk, tag_id=tag_id))
+        Place.categories.through.objects.bulk_create(category_links, batch_size=batch_size, ignore_conflicts=True)
+        Place.tags.through.objects.bulk_create(tag_links, batch_size=batch_size, ignore_conflicts=True)
+
+    def terms_by_slug(self, model, names, batch_size):
+        """{slug: id} for ``names``, creating the missing rows."""
+        wanted = {slugify(name): name for name in names}
+        existing = dict(model.objects.filter(slug__in=wanted).values_list('slug', 'pk'))
+        missing = [model(name=name, slug=slug) for slug, name in wanted.items() if slug not in existing]
+        if missing:
+            model.objects.bulk_create(missing, batch_size=batch_size, ignore_conflicts=True)
+            existing = dict(model.objects.filter(slug__in=wanted).values_list('slug', 'pk'))
+            for obj in missing:
+                self.stdout.write(self.style.SUCCESS(f'Created {model._meta.verbose_name}: {obj.name}'))
+        return existing
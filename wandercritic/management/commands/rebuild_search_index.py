@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from wandercritic import search
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index for all places'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of places indexed per batch')
+
+    def handle(self, *args, **options):
+        if search.get_backend() is None:
+            self.stdout.write(self.style.ERROR('Full-text search is not supported on this database.'))
+            return
+
+        count = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} places'))
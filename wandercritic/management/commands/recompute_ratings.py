@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from wandercritic import bitmap_index, caching, ratings
+from wandercritic.models import Place
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-place rating counters from the review table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--place', action='append', dest='slugs', default=[],
+                            help='Only recompute the place with this slug (repeatable)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drifted places without writing the fixes')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        places = Place.objects.all()
+        if options['slugs']:
+            places = places.filter(slug__in=options['slugs'])
+
+        drifted = ratings.recompute_ratings(
+            places, dry_run=options['dry_run'], batch_size=options['batch_size']
+        )
+        slugs = list(Place.objects.filter(pk__in=drifted).values_list('slug', flat=True))
+        for slug in slugs:
+            self.stdout.write(self.style.WARNING(f'Rating counters drifted for: {slug}'))
+        if slugs and not options['dry_run']:
+            caching.bump('places', bitmap_index.NAMESPACE, *(caching.place_namespace(slug) for slug in slugs))
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'{len(drifted)} places would be updated'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Recomputed ratings, {len(drifted)} places updated'))
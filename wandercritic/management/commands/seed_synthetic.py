@@ -0,0 +1,238 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from wandercritic import autocomplete, bitmap_index, caching, ratings, search, surrogate
+from wandercritic.models import Place, PlaceCategory, Report, Review, Tag, User
+
+ADJECTIVES = [
+    'Old', 'Royal', 'Hidden', 'Grand', 'Little', 'Upper', 'Lower', 'North', 'South', 'East', 'West',
+    'Misty', 'Golden', 'Silver', 'Green', 'Stone', 'Ancient', 'Quiet', 'Windy', 'Crystal',
+]
+NOUNS = [
+    'Castle', 'Bridge', 'Harbour', 'Market', 'Gardens', 'Abbey', 'Museum', 'Loch', 'Glen', 'Falls',
+    'Gallery', 'Cathedral', 'Beach', 'Lighthouse', 'Tower', 'Park', 'Island', 'Quarter', 'Square', 'Pier',
+]
+TOWNS = [
+    'Edinburgh', 'Glasgow', 'Aberdeen', 'Dundee', 'Inverness', 'Stirling', 'Perth', 'Oban', 'St Andrews',
+    'Fort William', 'Portree', 'Pitlochry', 'Ullapool', 'Dumfries', 'Kirkwall', 'Lerwick',
+]
+WORDS = (
+    'view walk history local food coffee tour family friendly crowded quiet sunset staff ticket price '
+    'parking rain castle garden guide museum beautiful amazing worth visit again busy clean free '
+    'early morning evening summer winter queue photo trail hill water boat stone old new great'
+).split()
+CATEGORIES = [
+    'Castles', 'Museums', 'Beaches', 'Hiking', 'Islands', 'Lochs', 'Cities', 'Villages', 'Gardens',
+    'Distilleries', 'Galleries', 'Historic Sites', 'Wildlife', 'Churches', 'Markets', 'Viewpoints',
+]
+FIRST_NAMES = ['Ailsa', 'Callum', 'Eilidh', 'Fraser', 'Isla', 'Jamie', 'Kirsty', 'Lewis', 'Morag', 'Rory', 'Skye', 'Ewan']
+LAST_NAMES = ['Campbell', 'MacDonald', 'Stewart', 'Robertson', 'Murray', 'Fraser', 'Reid', 'Ross', 'Scott', 'Grant']
+
+# Share of 1..5 star reviews, skewed positive like real review sites
+RATING_WEIGHTS = [5, 8, 17, 35, 35]
+
+
+class Command(BaseCommand):
+    help = 'Generate large volumes of synthetic users, places, reviews and reports for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--agents', type=int, default=50,
+                            help='How many of the users are travel agents')
+        parser.add_argument('--places', type=int, default=1000)
+        parser.add_argument('--reviews', type=int, default=20,
+                            help='Average number of reviews per place (capped by the number of users)')
+        parser.add_argument('--reports', type=int, default=200)
+        parser.add_argument('--categories', type=int, default=len(CATEGORIES))
+        parser.add_argument('--tags', type=int, default=100)
+        parser.add_argument('--days', type=int, default=730,
+                            help='Spread creation dates over this many days')
+        parser.add_argument('--seed', type=int, default=42,
+                            help='Random seed; the same seed and counts generate the same data')
+        parser.add_argument('--prefix', default='synth',
+                            help='Prefix for generated usernames and slugs')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.now = timezone.now()
+        self.days = options['days']
+        self.batch_size = options['batch_size']
+        prefix = options['prefix']
+        started = time.monotonic()
+
+        with transaction.atomic():
+            categories = self.create_terms(PlaceCategory, CATEGORIES, options['categories'], prefix)
+            tags = self.create_terms(Tag, WORDS + NOUNS, options['tags'], prefix)
+            users, agents = self.create_users(options['users'], options['agents'], prefix)
+            places = self.create_places(options['places'], agents, categories, tags, prefix)
+            reviews = self.create_reviews(places, users, options['reviews'])
+            reports = self.create_reports(options['reports'], places, users)
+
+            # bulk_create skips Review.save() and the model signals, so bring
+            # the rating counters, search index and caches up to date once
+            if places:
+                self.stdout.write('Recomputing rating counters...')
+                ratings.recompute_ratings(Place.objects.filter(pk__range=(places[0], places[-1])),
+                                          batch_size=self.batch_size)
+                self.stdout.write('Indexing places for search...')
+                for i in range(0, len(places), 500):
+                    search.index_places(Place.objects.filter(pk__in=places[i:i + 500]))
+        caching.bump('places', 'terms', 'website_reviews', bitmap_index.NAMESPACE, autocomplete.NAMESPACE)
+        surrogate.purge(surrogate.PLACE_LIST, surrogate.EXPLORE, surrogate.HOMEPAGE_TOP, surrogate.WEBSITE_REVIEWS)
+
+        elapsed = time.monotonic() - started
+        rows = len(categories) + len(tags) + len(users) + len(places) + reviews + reports
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(users)} users, {len(places)} places, {reviews} reviews, {reports} reports, '
+            f'{len(categories)} categories and {len(tags)} tags in {elapsed:.1f}s '
+            f'({rows / elapsed if elapsed else 0:.0f} rows/s)'
+        ))
+
+    def created_at(self):
+        return self.now - timedelta(seconds=self.rng.randrange(self.days * 86400 or 1))
+
+    def text(self, words):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+    def bulk_create_with_ids(self, model, objs, unique_field):
+        model.objects.bulk_create(objs, batch_size=self.batch_size)
+        if objs and objs[0].pk is None:
+            # Backends that cannot return ids from bulk inserts
+            for i in range(0, len(objs), 500):
+                chunk = objs[i:i + 500]
+                ids = dict(model.objects.filter(
+                    **{f'{unique_field}__in': [getattr(obj, unique_field) for obj in chunk]}
+                ).values_list(unique_field, 'pk'))
+                for obj in chunk:
+                    obj.pk = ids[getattr(obj, unique_field)]
+
+    def create_terms(self, model, names, count, prefix):
+        """Ids of ``count`` terms, reusing the ones that already exist."""
+        wanted = {}
+        for n in range(count):
+            name = names[n % len(names)]
+            if n >= len(names):
+                name = f'{name} {n // len(names) + 1}'
+            slug = f'{prefix}-{model._meta.model_name}-{n}'
+            wanted[slug] = name
+        existing = set(model.objects.filter(slug__in=wanted).values_list('slug', flat=True))
+        model.objects.bulk_create(
+            [model(name=name, slug=slug) for slug, name in wanted.items() if slug not in existing],
+            batch_size=self.batch_size,
+        )
+        return list(model.objects.filter(slug__in=wanted).values_list('pk', flat=True))
+
+    def create_users(self, count, agents, prefix):
+        start = User.objects.filter(username__startswith=f'{prefix}-user-').count()
+        # Hashing is slow on purpose; every synthetic user shares one password
+        password = make_password('synthetic')
+        users = []
+        for n in range(start, start + count):
+            first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+            users.append(User(
+                username=f'{prefix}-user-{n}',
+                email=f'{prefix}-user-{n}@example.com',
+                first_name=first,
+                last_name=last,
+                password=password,
+                is_travel_agent=n - start < agents,
+                date_joined=self.created_at(),
+            ))
+        self.bulk_create_with_ids(User, users, 'username')
+        user_ids = [user.pk for user in users]
+        agent_ids = [user.pk for user in users if user.is_travel_agent] or user_ids[:1]
+        self.stdout.write(f'Created {len(user_ids)} users')
+        return user_ids, agent_ids
+
+    def create_places(self, count, agents, categories, tags, prefix):
+        start = Place.objects.filter(slug__startswith=f'{prefix}-place-').count()
+        places = []
+        for n in range(start, start + count):
+            town = self.rng.choice(TOWNS)
+            name = f'{self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS)} of {town} {n}'
+            places.append(Place(
+                name=name,
+                slug=f'{prefix}-place-{n}',
+                description=self.text(self.rng.randint(60, 200)),
+                short_description=self.text(12)[:200],
+                location=f'{town}, Scotland',
+                created_by_id=self.rng.choice(agents),
+                created_at=self.created_at(),
+                history=self.text(40),
+                highlights='\n'.join(self.text(5) for _ in range(3)),
+                best_time_to_visit=self.rng.choice(['Spring', 'Summer', 'Autumn', 'Winter', 'All year']),
+                getting_there=self.text(15),
+                tips='\n'.join(self.text(6) for _ in range(2)),
+                budget=self.rng.choice([None, 0, 5, 12, 25, 60, 150, 300]),
+            ))
+        self.bulk_create_with_ids(Place, places, 'slug')
+        place_ids = sorted(place.pk for place in places)
+
+        category_links = []
+        tag_links = []
+        for place_id in place_ids:
+            for category_id in self.rng.sample(categories, min(len(categories), self.rng.randint(1, 2))):
+                category_links.append(Place.categories.through(place_id=place_id, placecategory_id=category_id))
+            for tag_id in self.rng.sample(tags, min(len(tags), self.rng.randint(2, 5))):
+                tag_links.append(Place.tags.through(place_id=place_id, tag_id=tag_id))
+        Place.categories.through.objects.bulk_create(category_links, batch_size=self.batch_size)
+        Place.tags.through.objects.bulk_create(tag_links, batch_size=self.batch_size)
+        self.stdout.write(f'Created {len(place_ids)} places')
+        return place_ids
+
+    def create_reviews(self, places, users, per_place):
+        """Reviews are written in batches so memory stays flat for millions of rows."""
+        created = 0
+        batch = []
+        for place_id in places:
+            # Long-tailed popularity: most places get a few reviews, some get many
+            count = min(len(users), int(self.rng.expovariate(1 / per_place))) if per_place else 0
+            bias = self.rng.uniform(-1, 1)
+            weights = [max(1, w + bias * (star - 3) * 8) for star, w in zip(ratings.STARS, RATING_WEIGHTS)]
+            for user_id, rating in zip(self.rng.sample(users, count),
+                                       self.rng.choices(ratings.STARS, weights, k=count)):
+                batch.append(Review(
+                    place_id=place_id, user_id=user_id, rating=rating,
+                    comment=self.text(self.rng.randint(8, 60)),
+                    created_at=self.created_at(),
+                ))
+            if len(batch) >= self.batch_size:
+                Review.objects.bulk_create(batch, batch_size=self.batch_size)
+                created += len(batch)
+                batch = []
+                self.stdout.write(f'Created {created} reviews')
+        Review.objects.bulk_create(batch, batch_size=self.batch_size)
+        created += len(batch)
+        self.stdout.write(f'Created {created} reviews')
+        return created
+
+    def create_reports(self, count, places, users):
+        review_ids = list(Review.objects.filter(place_id__in=places[:1000]).values_list('pk', 'place_id')[:5000])
+        reports = []
+        for _ in range(count):
+            status = self.rng.choices(['pending', 'resolved', 'dismissed'], [6, 3, 1])[0]
+            report = Report(
+                reporter_id=self.rng.choice(users),
+                report_type=self.rng.choice([choice for choice, _ in Report.REPORT_TYPES]),
+                description=self.text(20),
+                status=status,
+                created_at=self.created_at(),
+                url='https://example.com/',
+            )
+            if review_ids and self.rng.random() < 0.4:
+                report.review_id, report.place_id = self.rng.choice(review_ids)
+                report.content_type = 'review'
+            else:
+                report.place_id = self.rng.choice(places)
+            if status != 'pending':
+                report.resolved_by_id = self.rng.choice(users)
+                report.resolved_at = report.created_at + timedelta(days=self.rng.randint(0, 14))
+            reports.append(report)
+        Report.objects.bulk_create(reports, batch_size=self.batch_size)
+        return len(reports)
@@ -0,0 +1,205 @@
+"""
+Serving uploaded media in production.
+
+``serve`` replaces Django's development ``static.serve`` view for
+``MEDIA_URL``. Files are streamed with ``FileResponse``, which WSGI servers
+that provide ``wsgi.file_wrapper`` (gunicorn) send with ``os.sendfile``
+rather than copying through Python. ASGI has no such shortcut, and Django
+would read a sync file response whole into memory before sending it, so
+under ASGI the file is read one block at a time in a worker thread instead;
+prefer ``MEDIA_ACCEL`` there. On top of that it answers:
+
+* conditional requests: ``ETag``/``Last-Modified`` against ``If-None-Match``,
+  ``If-Modified-Since`` and friends, with 304/412
+* single byte ranges (``Range: bytes=...``, honouring ``If-Range``) with 206,
+  or 416 when the range is outside the file
+
+Content-addressed uploads (``places/<sha256>.jpg``, see ``storage.py``) can
+never change, so they are cached for a year as immutable and their digest is
+the ETag. Other files (renditions, older uploads) revalidate after
+``MEDIA_CACHE_MAX_AGE``.
+
+With ``MEDIA_ACCEL`` set, the response carries only headers and an
+``X-Accel-Redirect`` (nginx) or ``X-Sendfile`` (Apache, lighttpd) header, and
+the front proxy transfers the file and handles ranges itself.
+"""
+import io
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# <sha256><ext> as written by ContentAddressedStorage
+CONTENT_ADDRESSED = re.compile(r'^[0-9a-f]{64}(\.\w+)?$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class FileRange(io.RawIOBase):
+    """
+    Read-only view of bytes ``start``..``end`` (inclusive) of an open file.
+
+    Positions are those of the underlying file, so ``FileResponse`` computes the
+    Content-Length of the range and ``wsgi.file_wrapper`` implementations that
+    use ``os.sendfile(fileno(), tell(), Content-Length)`` send only the range.
+    """
+
+    def __init__(self, file, start, end):
+        self.file = file
+        self.name = file.name
+        self.start, self.stop = start, end + 1
+        file.seek(start)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_END:
+            position = self.stop + offset
+        elif whence == io.SEEK_CUR:
+            position = self.file.tell() + offset
+        else:
+            position = offset
+        return self.file.seek(min(max(position, self.start), self.stop))
+
+    def read(self, size=-1):
+        remaining = self.stop - self.file.tell()
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        return self.file.read(max(size, 0))
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def byte_range(header, size):
+    """
+    ``(start, end)`` requested by a ``Range`` header, or ``None`` to send the
+    whole file (no header, several ranges or a header that does not parse).
+    """
+    match = RANGE.match(header.replace(' ', '')) if header and size else None
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # The last N bytes
+        if int(last) == 0:
+            raise RangeNotSatisfiable
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = size - 1 if last == '' else min(int(last), size - 1)
+    if last != '' and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    return start, end
+
+
+def validators(name, stat):
+    """``(etag, last_modified)`` of the file ``name``."""
+    basename = posixpath.basename(name)
+    if CONTENT_ADDRESSED.match(basename):
+        etag = f'"{posixpath.splitext(basename)[0]}"'
+    else:
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    return etag, int(stat.st_mtime)
+
+
+def cache_control(name):
+    if CONTENT_ADDRESSED.match(posixpath.basename(name)):
+        return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+
+
+async def _read_blocks(file, block_size):
+    read = sync_to_async(file.read, thread_sensitive=False)
+    while block := await read(block_size):
+        yield block
+
+
+def _accel_response(name, path, content_type):
+    response = HttpResponse(content_type=content_type)
+    if settings.MEDIA_ACCEL == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = quote(settings.MEDIA_ACCEL_PREFIX + name)
+    elif settings.MEDIA_ACCEL == 'x-sendfile':
+        response['X-Sendfile'] = path
+    else:
+        raise ImproperlyConfigured(f'Unknown MEDIA_ACCEL {settings.MEDIA_ACCEL!r}')
+    return response
+
+
+@require_safe
+def serve(request, path):
+    name = posixpath.normpath(path).lstrip('/')
+    # Dot files are partial uploads (.upload-*) and the like
+    if any(part.startswith('.') for part in name.split('/')):
+        raise Http404
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, name)
+    except SuspiciousFileOperation:
+        raise Http404
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    etag, last_modified = validators(name, stat)
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None and settings.MEDIA_ACCEL:
+        response = _accel_response(name, full_path, content_type)
+    elif response is None:
+        requested = request.headers.get('Range')
+        if_range = request.headers.get('If-Range')
+        if if_range and if_range not in (etag, http_date(last_modified)):
+            requested = None
+        try:
+            span = byte_range(requested, stat.st_size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+        f = open(full_path, 'rb')
+        if span is None:
+            response = FileResponse(f, content_type=content_type)
+        else:
+            response = FileResponse(FileRange(f, *span), content_type=content_type, status=206)
+            response['Content-Range'] = f'bytes {span[0]}-{span[1]}/{stat.st_size}'
+        if isinstance(request, ASGIRequest):
+            # Keeps the headers FileResponse set from the file
+            response.streaming_content = _read_blocks(response.file_to_stream, response.block_size)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = cache_control(name)
+    return response
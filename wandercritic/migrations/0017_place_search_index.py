@@ -0,0 +1,76 @@
+from django.db import migrations
+
+# The schema as of this migration; later changes to wandercritic.search must
+# not change what it creates.
+SQLITE_CREATE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS wandercritic_place_search USING fts5(
+    name, short_description, description, location, history, highlights, categories, tags,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+SQLITE_FILL = """
+INSERT INTO wandercritic_place_search
+    (rowid, name, short_description, description, location, history, highlights, categories, tags)
+SELECT p.id, COALESCE(p.name, ''), COALESCE(p.short_description, ''), COALESCE(p.description, ''),
+       COALESCE(p.location, ''), COALESCE(p.history, ''), COALESCE(p.highlights, ''),
+       COALESCE((SELECT group_concat(c.name, ' ') FROM wandercritic_place_categories pc
+                 JOIN wandercritic_placecategory c ON c.id = pc.placecategory_id WHERE pc.place_id = p.id), ''),
+       COALESCE((SELECT group_concat(t.name, ' ') FROM wandercritic_place_tags pt
+                 JOIN wandercritic_tag t ON t.id = pt.tag_id WHERE pt.place_id = p.id), '')
+FROM wandercritic_place p
+"""
+
+POSTGRES_CREATE = [
+    'CREATE TABLE IF NOT EXISTS wandercritic_place_search (place_id bigint PRIMARY KEY, document tsvector NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS wandercritic_place_search_document_gin '
+    'ON wandercritic_place_search USING GIN (document)',
+]
+
+POSTGRES_FILL = """
+INSERT INTO wandercritic_place_search (place_id, document)
+SELECT p.id,
+       setweight(to_tsvector('english', COALESCE(p.name, '')), 'A')
+       || setweight(to_tsvector('english', COALESCE(p.short_description, '')), 'B')
+       || setweight(to_tsvector('english', COALESCE(p.description, '')), 'D')
+       || setweight(to_tsvector('english', COALESCE(p.location, '')), 'B')
+       || setweight(to_tsvector('english', COALESCE(p.history, '')), 'D')
+       || setweight(to_tsvector('english', COALESCE(p.highlights, '')), 'C')
+       || setweight(to_tsvector('english', COALESCE((
+              SELECT string_agg(c.name, ' ') FROM wandercritic_place_categories pc
+              JOIN wandercritic_placecategory c ON c.id = pc.placecategory_id WHERE pc.place_id = p.id), '')), 'B')
+       || setweight(to_tsvector('english', COALESCE((
+              SELECT string_agg(t.name, ' ') FROM wandercritic_place_tags pt
+              JOIN wandercritic_tag t ON t.id = pt.tag_id WHERE pt.place_id = p.id), '')), 'B')
+FROM wandercritic_place p
+ON CONFLICT (place_id) DO UPDATE SET document = EXCLUDED.document
+"""
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        statements = [SQLITE_CREATE, 'DELETE FROM wandercritic_place_search', SQLITE_FILL]
+    elif vendor == 'postgresql':
+        statements = POSTGRES_CREATE + [POSTGRES_FILL]
+    else:
+        # No search backend: views fall back to icontains
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('DROP TABLE IF EXISTS wandercritic_place_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wandercritic', '0016_place_budget'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
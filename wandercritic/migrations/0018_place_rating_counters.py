@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:18
+
+from django.db import migrations, models
+
+
+def backfill_rating_counters(apps, schema_editor):
+    from wandercritic import ratings
+
+    Place = apps.get_model('wandercritic', 'Place')
+    Review = apps.get_model('wandercritic', 'Review')
+    ratings.recompute_ratings(Place.objects.using(schema_editor.connection.alias), Review)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wandercritic', '0017_place_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='place',
+            name='rating_count_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='rating_count_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='rating_count_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='rating_count_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='rating_count_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wandercritic', '0018_place_rating_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(fields=['-average_rating', '-created_at'], name='place_rating_created_idx'),
+        ),
+    ]
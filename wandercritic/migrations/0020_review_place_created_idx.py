@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wandercritic', '0019_place_rating_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['place', '-created_at', '-id'], name='review_place_created_idx'),
+        ),
+    ]
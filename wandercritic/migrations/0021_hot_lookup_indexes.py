@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wandercritic', '0020_review_place_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(fields=['-created_at', '-id'], name='place_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(fields=['created_by', '-created_at'], name='place_creator_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(fields=['reporter', '-created_at'], name='report_reporter_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(fields=['-created_at'], name='report_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='travelagentapplication',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['created_at'], name='application_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='travelagentapplication',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['user'], name='application_pending_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='websitereview',
+            index=models.Index(condition=models.Q(('is_visible', True)), fields=['-created_at'], name='website_review_visible_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='websitereview',
+            index=models.Index(fields=['user', '-created_at'], name='website_review_user_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wandercritic', '0022_page_validator_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(fields=['status', '-created_at'], name='report_status_created_idx'),
+        ),
+    ]
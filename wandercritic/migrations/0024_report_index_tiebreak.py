@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wandercritic', '0023_report_status_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='report',
+            name='report_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='report',
+            name='report_status_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(fields=['-created_at', '-id'], name='report_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='report_status_created_idx'),
+        ),
+    ]
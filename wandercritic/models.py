@@ -4,11 +4,15 @@ from django.utils.text import slugify
 from django.urls import reverse
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
+from django.db import transaction
+from . import ratings
 
 class User(AbstractUser):
     is_travel_agent = models.BooleanField(default=False)
     bio = models.TextField(max_length=500, blank=True)
     profile_picture = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
+    # Renditions generated for profile_picture (images.record_renditions)
+    profile_picture_renditions = models.JSONField(default=dict, blank=True, editable=False)
     contact_number = models.CharField(max_length=20, blank=True)
     company_name = models.CharField(max_length=100, blank=True)
     company_website = models.URLField(blank=True)
@@ -30,6 +34,16 @@ class TravelAgentApplication(models.Model):
     ], default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Only pending applications are looked up: the admin queue, oldest
+            # first, and whether a user is waiting for a decision
+            models.Index(fields=['created_at'], name='application_pending_idx',
+                         condition=models.Q(status='pending')),
+            models.Index(fields=['user'], name='application_pending_user_idx',
+                         condition=models.Q(status='pending')),
+        ]
     
     def __str__(self):
         return f"Application by {self.full_name}"
@@ -72,17 +86,30 @@ class Tag(models.Model):
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
 
+# Keyset ordering of explore and the homepage top places, ending in a unique column
+EXPLORE_ORDERING = ('-average_rating', '-created_at', 'id')
+
+
 class Place(models.Model):
     name = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0)
     total_ratings = models.PositiveIntegerField(default=0)
+    # Rating counters maintained incrementally by wandercritic.ratings
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count_1 = models.PositiveIntegerField(default=0)
+    rating_count_2 = models.PositiveIntegerField(default=0)
+    rating_count_3 = models.PositiveIntegerField(default=0)
+    rating_count_4 = models.PositiveIntegerField(default=0)
+    rating_count_5 = models.PositiveIntegerField(default=0)
     description = models.TextField()
     short_description = models.CharField(max_length=200)
     location = models.CharField(max_length=200)
     image = models.ImageField(upload_to='places/')
+    # Renditions generated for image (images.record_renditions)
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='places')
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
     
     # Optional fields
@@ -103,6 +130,18 @@ class Place(models.Model):
     categories = models.ManyToManyField(PlaceCategory, related_name='places')
     tags = models.ManyToManyField(Tag, related_name='places')
 
+    class Meta:
+        indexes = [
+            # Ranking order used by the homepage and explore
+            models.Index(fields=['-average_rating', '-created_at'], name='place_rating_created_idx'),
+            # The place list, newest first
+            models.Index(fields=['-created_at', '-id'], name='place_created_idx'),
+            # An agent's places, newest first (my_places)
+            models.Index(fields=['created_by', '-created_at'], name='place_creator_created_idx'),
+            # Latest change to any place, for listing ETags (conditional.py)
+            models.Index(fields=['-updated_at'], name='place_updated_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
@@ -112,12 +151,10 @@ class Place(models.Model):
         return reverse('wandercritic:place_detail', kwargs={'slug': self.slug})
 
     def update_rating(self):
-        reviews = self.review_set.all()
-        if reviews:
-            total = sum(review.rating for review in reviews)
-            self.average_rating = total / len(reviews)
-            self.total_ratings = len(reviews)
-            self.save(update_fields=['average_rating', 'total_ratings'])
+        # Rebuild the rating counters from scratch (drift repair only; reviews
+        # keep them up to date incrementally)
+        ratings.recompute_ratings(Place.objects.filter(pk=self.pk))
+        self.refresh_from_db(fields=ratings.COUNTER_FIELDS)
 
     @property
     def highlights_list(self):
@@ -137,6 +174,7 @@ class Place(models.Model):
 class PlaceImage(models.Model):
     place = models.ForeignKey(Place, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='places/')
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     caption = models.CharField(max_length=200, blank=True)
     is_primary = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -157,19 +195,51 @@ class Review(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     rating = models.PositiveSmallIntegerField(choices=RATING_CHOICES)
     comment = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ['place', 'user']
         ordering = ['-created_at']
+        indexes = [
+            # Newest-first review pages of a place
+            models.Index(fields=['place', '-created_at', '-id'], name='review_place_created_idx'),
+            # Latest review change overall and per place, for page ETags
+            # (conditional.py)
+            models.Index(fields=['-updated_at'], name='review_updated_idx'),
+            models.Index(fields=['place', '-updated_at'], name='review_place_updated_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.username}\'s review of {self.place.name}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what is stored so save() can apply the rating delta
+        loaded = dict(zip(field_names, values))
+        instance._loaded_place_id = loaded.get('place_id')
+        instance._loaded_rating = loaded.get('rating')
+        return instance
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.place.update_rating()
+        adding = self._state.adding
+        old_place_id = getattr(self, '_loaded_place_id', None)
+        old_rating = getattr(self, '_loaded_rating', None)
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            if adding:
+                ratings.apply_rating_change(self.place_id, None, self.rating)
+            elif old_place_id is None or old_rating is None:
+                # Loaded with deferred fields, the previous rating is unknown
+                ratings.recompute_ratings(Place.objects.filter(pk=self.place_id))
+            elif old_place_id != self.place_id:
+                ratings.apply_rating_change(old_place_id, old_rating, None)
+                ratings.apply_rating_change(self.place_id, None, self.rating)
+            else:
+                ratings.apply_rating_change(self.place_id, old_rating, self.rating)
+        self._loaded_place_id = self.place_id
+        self._loaded_rating = int(self.rating)
 
 class Report(models.Model):
     REPORT_TYPES = [
@@ -198,11 +268,20 @@ class Report(models.Model):
     content_type = models.CharField(max_length=20, choices=CONTENT_TYPES, default='place')
     description = models.TextField()
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     resolved_at = models.DateTimeField(null=True, blank=True)
     resolved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, 
                                   related_name='resolved_reports')
     url = models.URLField()
+
+    class Meta:
+        indexes = [
+            # A user's reports and the admin list, newest first
+            models.Index(fields=['reporter', '-created_at'], name='report_reporter_created_idx'),
+            models.Index(fields=['-created_at', '-id'], name='report_created_idx'),
+            # The moderation queue and the admin list by status, newest first
+            models.Index(fields=['status', '-created_at', '-id'], name='report_status_created_idx'),
+        ]
     
     def resolve(self, admin_user):
         self.status = 'resolved'
@@ -238,6 +317,13 @@ class WebsiteReview(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Latest visible testimonials on the homepage
+            models.Index(fields=['-created_at'], name='website_review_visible_idx',
+                         condition=models.Q(is_visible=True)),
+            # A user's own review (add_website_review)
+            models.Index(fields=['user', '-created_at'], name='website_review_user_idx'),
+        ]
 
     def __str__(self):
         return f'Website review by {self.user.username}'
@@ -0,0 +1,250 @@
+"""
+Moderation queue for reports.
+
+Pending reports are grouped by what they are about, their ``Target``: a
+review, a place (reports not about one of its reviews) or, for bug reports,
+a URL. ``queue()`` ranks the groups by priority:
+
+* every distinct reporter counts once per group, so one account filing the
+  same report repeatedly does not move it up
+* each reporter is weighted by how their closed reports went,
+  ``(resolved + 1) / (resolved + dismissed + 2)``: a new reporter counts 0.5,
+  one whose reports keep being dismissed approaches 0
+* the sum is boosted up to twice for recent reports, the boost halving every
+  ``MODERATION_RECENCY_HALF_LIFE`` hours since the group's latest report
+
+The groups are scored, ordered and cut to a page by the database in one
+query (``QUEUE_SQL``), so only a page of groups comes back to Python, and
+their latest reports are loaded with a second one. Queue pages are keyset
+pages over ``(priority, latest report id)``, scored as of the first page so
+groups do not shift between pages. The score is an aggregate over all
+pending reports, so each page still reads them all, in the database.
+
+``close()`` resolves or dismisses pending reports, e.g. a whole group, with a
+single ``UPDATE``.
+"""
+import operator
+from dataclasses import dataclass, field
+from functools import reduce
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import F, Q, Case, When, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Report
+from .pagination import InvalidCursor, KeysetPage, decode_cursor, encode_cursor
+
+REPORT_ORDERING = ('-created_at', '-id')
+
+# Action -> status it closes reports with
+ACTIONS = {'resolve': 'resolved', 'dismiss': 'dismissed'}
+
+# Weight of a reporter with no closed reports (and of deleted reporters)
+NEW_REPORTER_TRUST = 0.5
+
+# Latest reports shown with each group
+GROUP_SAMPLE_SIZE = 3
+
+
+@dataclass(frozen=True)
+class Target:
+    kind: str  # 'review', 'place' or 'bug'
+    key: object  # review id, place id or URL
+
+    @classmethod
+    def of(cls, place_id, review_id, url):
+        if review_id is not None:
+            return cls('review', review_id)
+        if place_id is not None:
+            return cls('place', place_id)
+        return cls('bug', url)
+
+    @classmethod
+    def parse(cls, token):
+        """The target named by ``token``; raises ``ValueError``."""
+        kind, _, key = token.partition(':')
+        if kind not in ('review', 'place', 'bug') or not key:
+            raise ValueError(f'Not a report target: {token!r}')
+        return cls(kind, key if kind == 'bug' else int(key))
+
+    @property
+    def token(self):
+        return f'{self.kind}:{self.key}'
+
+    @property
+    def reports(self):
+        """Q matching the reports about this target."""
+        if self.kind == 'review':
+            return Q(review_id=self.key)
+        if self.kind == 'place':
+            return Q(place_id=self.key, review__isnull=True)
+        return Q(place__isnull=True, review__isnull=True, url=self.key)
+
+
+@dataclass
+class Group:
+    target: Target
+    count: int
+    reporter_count: int
+    report_type: str  # the most common one
+    priority: float
+    last_id: int
+    # Loaded for the groups on the page shown
+    reports: list = field(default_factory=list)
+
+    @property
+    def place(self):
+        """The reported place, or the place of the reported review."""
+        return self.reports[0].place if self.reports else None
+
+    @property
+    def review(self):
+        return self.reports[0].review if self.reports else None
+
+    @property
+    def report_type_display(self):
+        return dict(Report.REPORT_TYPES).get(self.report_type, self.report_type)
+
+
+# Target.token of a report row
+TARGET_SQL = """CASE WHEN review_id IS NOT NULL THEN 'review:' || review_id
+                WHEN place_id IS NOT NULL THEN 'place:' || place_id
+                ELSE 'bug:' || url END"""
+
+# Hours from the first parameter to ``latest``, at least 0
+AGE_SQL = {
+    'sqlite': 'MAX((julianday(%s) - julianday(latest)) * 24, 0)',
+    'postgresql': 'GREATEST(EXTRACT(EPOCH FROM %s - latest) / 3600, 0)',
+}
+
+# Pending report groups with their priority, best first. Parameters: the
+# trust of new reporters, now, the half-life, the keyset condition's and the
+# page size.
+QUEUE_SQL = """
+WITH pending AS (
+    SELECT id, reporter_id, report_type, created_at, {target} AS target
+    FROM wandercritic_report WHERE status = 'pending'
+),
+records AS (
+    SELECT reporter_id, (SUM(CASE WHEN status = 'resolved' THEN 1 ELSE 0 END) + 1.0) / (COUNT(*) + 2) AS trust
+    FROM wandercritic_report
+    WHERE status <> 'pending' AND reporter_id IN (SELECT reporter_id FROM pending)
+    GROUP BY reporter_id
+),
+reporters AS (
+    SELECT target, COUNT(*) AS reporter_count, SUM(COALESCE(records.trust, %s)) AS trust
+    FROM (SELECT DISTINCT target, reporter_id FROM pending) AS group_reporters
+    LEFT JOIN records ON records.reporter_id = group_reporters.reporter_id
+    GROUP BY target
+),
+report_types AS (
+    SELECT target, report_type,
+           ROW_NUMBER() OVER (PARTITION BY target ORDER BY COUNT(*) DESC, MAX(id) DESC) AS position
+    FROM pending GROUP BY target, report_type
+),
+groups AS (
+    SELECT target, COUNT(*) AS report_count, MAX(created_at) AS latest, MAX(id) AS last_id
+    FROM pending GROUP BY target
+),
+ranked AS (
+    SELECT groups.target, report_count, reporter_count, report_type, last_id,
+           CAST(trust * (1 + POWER(0.5, {age} / %s)) AS DOUBLE PRECISION) AS priority
+    FROM groups
+    JOIN reporters ON reporters.target = groups.target
+    JOIN report_types ON report_types.target = groups.target AND position = 1
+)
+SELECT target, report_count, reporter_count, report_type, priority, last_id FROM ranked
+{after}
+ORDER BY priority DESC, last_id DESC
+LIMIT %s
+"""
+
+
+def queue_query(connection, now, after=None, limit=None):
+    """``(sql, params)`` of the groups ranked as of ``now``, after the ``(priority, last_id)`` ``after``."""
+    sql = QUEUE_SQL.format(
+        target=TARGET_SQL,
+        age=AGE_SQL[connection.vendor],
+        after='WHERE priority < %s OR (priority = %s AND last_id < %s)' if after else '',
+    )
+    params = [NEW_REPORTER_TRUST, connection.ops.adapt_datetimefield_value(now),
+              settings.MODERATION_RECENCY_HALF_LIFE]
+    if after:
+        params += [after[0], after[0], after[1]]
+    return sql, params + [limit or settings.MODERATION_QUEUE_PAGE_SIZE]
+
+
+def ranked_groups(now, after=None, limit=None):
+    connection = connections[router.db_for_read(Report)]
+    with connection.cursor() as cursor:
+        cursor.execute(*queue_query(connection, now, after, limit))
+        rows = cursor.fetchall()
+    groups = []
+    for token, count, reporter_count, report_type, priority, last_id in rows:
+        kind, _, key = token.partition(':')
+        target = Target(kind, key if kind == 'bug' else int(key))
+        groups.append(Group(target, count, reporter_count, report_type, priority, last_id))
+    return groups
+
+
+def _load_samples(groups):
+    """Attach the latest reports to each group, with their places and reviews, in one query."""
+    if not groups:
+        return
+    by_target = {group.target: group for group in groups}
+    # One partition per target: review reports also carry the review's place
+    latest_first = Window(
+        RowNumber(),
+        partition_by=[F('review_id'), F('place_id'),
+                      Case(When(place__isnull=True, review__isnull=True, then=F('url')))],
+        order_by=[F('created_at').desc(), F('id').desc()],
+    )
+    reports = (Report.objects.filter(reduce(operator.or_, (target.reports for target in by_target)),
+                                      status='pending')
+               .annotate(position=latest_first).filter(position__lte=GROUP_SAMPLE_SIZE)
+               .select_related('place', 'review__user', 'reporter').order_by('-created_at', '-id'))
+    for report in reports:
+        by_target[Target.of(report.place_id, report.review_id, report.url)].reports.append(report)
+
+
+def queue(cursor=None, page_size=None):
+    """A ``KeysetPage`` of pending report groups, highest priority first; raises ``InvalidCursor``."""
+    page_size = page_size or settings.MODERATION_QUEUE_PAGE_SIZE
+    now, after = timezone.now(), None
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 3 or not (isinstance(values[0], str) and isinstance(values[1], (int, float))
+                                    and isinstance(values[2], int)):
+            raise InvalidCursor('Cursor does not match the queue ordering')
+        try:
+            now = parse_datetime(values[0])
+        except ValueError:
+            now = None
+        if now is None:
+            raise InvalidCursor('Bad cursor time')
+        after = (values[1], values[2])
+
+    rows = ranked_groups(now, after, page_size + 1)
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    _load_samples(rows)
+    return KeysetPage(
+        object_list=rows,
+        next_cursor=encode_cursor([now, rows[-1].priority, rows[-1].last_id]) if has_next else None,
+        cursor=cursor,
+        page_size=page_size,
+    )
+
+
+def close(reports, action, user):
+    """Resolve or dismiss the pending ones of ``reports`` in one ``UPDATE``; returns how many."""
+    return reports.filter(status='pending').update(
+        status=ACTIONS[action], resolved_at=timezone.now(), resolved_by=user,
+    )
+
+
+def close_group(target, action, user):
+    return close(Report.objects.filter(target.reports), action, user)
@@ -0,0 +1,135 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of ``OFFSET n`` the next page is selected with a ``WHERE`` clause on the
+ordering columns of the last row already shown, so page 500 costs the same as
+page 1. The ordering must end in a unique column (normally ``id``) so that the
+position of every row is unambiguous.
+
+Cursors are opaque strings; ``settings.PAGINATION_CURSOR_ENCODING`` chooses
+between plain urlsafe base64 JSON (``'base64'``) and a signed token that
+clients cannot tamper with (``'signed'``).
+"""
+import base64
+import datetime
+import json
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+CURSOR_SALT = 'wandercritic.pagination'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # Keep full microsecond precision, DjangoJSONEncoder truncates it
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    payload = json.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+    if getattr(settings, 'PAGINATION_CURSOR_ENCODING', 'signed') == 'signed':
+        return signing.dumps(payload, salt=CURSOR_SALT, compress=True)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        if getattr(settings, 'PAGINATION_CURSOR_ENCODING', 'signed') == 'signed':
+            payload = signing.loads(token, salt=CURSOR_SALT)
+        else:
+            payload = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        values = json.loads(payload)
+    except (signing.BadSignature, ValueError, TypeError) as e:
+        raise InvalidCursor(str(e)) from e
+    if not isinstance(values, list):
+        raise InvalidCursor('Cursor does not hold a list of values')
+    return values
+
+
+@dataclass
+class KeysetPage:
+    object_list: list
+    next_cursor: str = None
+    cursor: str = None
+    page_size: int = 0
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, ordering, page_size=None):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.page_size = page_size or getattr(settings, 'PLACES_PAGE_SIZE', 12)
+
+    def _fields(self):
+        return [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    def _to_python(self, name, value):
+        try:
+            model_field = self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return value  # annotation, e.g. search_rank
+        try:
+            return model_field.to_python(value)
+        except ValidationError as e:
+            raise InvalidCursor(f'Bad value for {name}') from e
+
+    def _after(self, values):
+        """Q matching rows strictly after the row with ``values`` in ``ordering``."""
+        fields = self._fields()
+        if len(values) != len(fields):
+            raise InvalidCursor('Cursor does not match the ordering')
+        values = [self._to_python(name, value) for (name, _), value in zip(fields, values)]
+        condition = Q()
+        for i, (name, descending) in enumerate(fields):
+            term = Q(**{f'{name}__{"lt" if descending else "gt"}': values[i]})
+            for j, (prev_name, _) in enumerate(fields[:i]):
+                term &= Q(**{prev_name: values[j]})
+            condition |= term
+        return condition
+
+    def _cursor_for(self, obj):
+        return encode_cursor([getattr(obj, name) for name, _ in self._fields()])
+
+    def _queryset(self, cursor):
+        queryset = self.queryset.order_by(*self.ordering)
+        if cursor:
+            queryset = queryset.filter(self._after(decode_cursor(cursor)))
+        return queryset[:self.page_size + 1]
+
+    def _page(self, rows, cursor):
+        has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        return KeysetPage(
+            object_list=rows,
+            next_cursor=self._cursor_for(rows[-1]) if has_next else None,
+            cursor=cursor,
+            page_size=self.page_size,
+        )
+
+    def page(self, cursor=None):
+        return self._page(list(self._queryset(cursor)), cursor)
+
+    async def apage(self, cursor=None):
+        """``page()`` for async views, through the async ORM."""
+        return self._page([row async for row in self._queryset(cursor)], cursor)
@@ -0,0 +1,171 @@
+"""
+Incremental rating aggregation for places.
+
+Each place keeps a count of reviews per star (``rating_count_1`` ..
+``rating_count_5``) plus ``rating_sum``. Creating, changing or deleting a review
+adjusts those counters with a single atomic ``UPDATE ... SET x = x + n``, and
+``average_rating``/``total_ratings`` are derived from them in the same
+statement, so concurrent reviews never overwrite each other.
+
+``recompute_ratings`` rebuilds the counters from the review table with one
+GROUP BY query and is used for drift repair.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db.models import Case, Count, DecimalField, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast, Round
+from django.db.models.lookups import GreaterThan
+
+STARS = (1, 2, 3, 4, 5)
+AVERAGE_PLACES = Decimal('0.01')
+
+
+def count_field(star):
+    return f'rating_count_{star}'
+
+
+COUNTER_FIELDS = [count_field(star) for star in STARS] + ['rating_sum', 'total_ratings', 'average_rating']
+
+
+def _average_expression(rating_sum, total):
+    return Case(
+        # Rounded in SQL: SQLite keeps every digit through the CAST, which
+        # breaks orderings and keyset cursors on the stored value
+        When(GreaterThan(total, 0), then=Cast(
+            Round(Cast(rating_sum, FloatField()) / Cast(total, FloatField()), 2),
+            DecimalField(max_digits=3, decimal_places=2),
+        )),
+        default=Value(Decimal('0')),
+        output_field=DecimalField(max_digits=3, decimal_places=2),
+    )
+
+
+def apply_rating_change(place_id, old_rating=None, new_rating=None):
+    """
+    Move one review of ``place_id`` from ``old_rating`` to ``new_rating``.
+    Pass ``old_rating=None`` for a new review and ``new_rating=None`` for a
+    deleted one. Raises ``ValueError`` for a rating outside ``STARS``.
+    """
+    from .models import Place
+
+    old_rating = int(old_rating) if old_rating is not None else None
+    new_rating = int(new_rating) if new_rating is not None else None
+    for rating in (old_rating, new_rating):
+        if rating is not None and rating not in STARS:
+            raise ValueError(f'Rating {rating} is not one of {STARS}')
+    if old_rating == new_rating:
+        return
+
+    sum_delta = (new_rating or 0) - (old_rating or 0)
+    total_delta = (new_rating is not None) - (old_rating is not None)
+    updates = {}
+    if old_rating is not None:
+        updates[count_field(old_rating)] = F(count_field(old_rating)) - 1
+    if new_rating is not None:
+        updates[count_field(new_rating)] = F(count_field(new_rating)) + 1
+    updates['rating_sum'] = F('rating_sum') + sum_delta
+    updates['total_ratings'] = F('total_ratings') + total_delta
+    # SET clauses see the pre-update row, so derive the average from old + delta
+    updates['average_rating'] = _average_expression(
+        F('rating_sum') + sum_delta, F('total_ratings') + total_delta
+    )
+    Place.objects.filter(pk=place_id).update(**updates)
+
+
+def average(rating_sum, total):
+    if not total:
+        return Decimal('0')
+    # Half up, like ROUND() in _average_expression
+    return (Decimal(rating_sum) / Decimal(total)).quantize(AVERAGE_PLACES, rounding=ROUND_HALF_UP)
+
+
+def histogram(place):
+    """
+    ``[{'star', 'count', 'percent'}, ...]`` from 5 down to 1 star, read from the
+    stored counters of ``place`` (no query).
+    """
+    total = place.total_ratings
+    return [
+        {
+            'star': star,
+            'count': getattr(place, count_field(star)),
+            'percent': round(getattr(place, count_field(star)) * 100 / total) if total else 0,
+        }
+        for star in reversed(STARS)
+    ]
+
+
+def aggregate_reviews(reviews):
+    """Per-place counters for ``reviews`` computed with one GROUP BY query."""
+    annotations = {
+        count_field(star): Count('id', filter=Q(rating=star)) for star in STARS
+    }
+    rows = reviews.order_by().values('place_id').annotate(
+        rating_sum=Sum('rating'), total_ratings=Count('id'), **annotations
+    )
+    stats = {}
+    for row in rows:
+        place_id = row.pop('place_id')
+        row['average_rating'] = average(row['rating_sum'], row['total_ratings'])
+        stats[place_id] = row
+    return stats
+
+
+def recompute_ratings(places=None, review_model=None, dry_run=False, batch_size=500):
+    """
+    Rebuild the counters of ``places`` (all places by default) from their
+    reviews. Returns the list of place ids whose stored counters had drifted.
+    """
+    if places is None or review_model is None:
+        from .models import Place, Review
+        places = Place.objects.all() if places is None else places
+        review_model = review_model or Review
+
+    reviews = review_model.objects.using(places.db)
+    if places.query.where:
+        reviews = reviews.filter(place__in=places.values('pk'))
+    stats = aggregate_reviews(reviews)
+
+    empty = {field: 0 for field in COUNTER_FIELDS}
+    empty['average_rating'] = Decimal('0')
+    drifted = []
+    batch = []
+    for place in places.only('pk', *COUNTER_FIELDS).order_by('pk').iterator(chunk_size=batch_size):
+        expected = stats.get(place.pk, empty)
+        if all(Decimal(getattr(place, field)) == Decimal(expected[field]) for field in COUNTER_FIELDS):
+            continue
+        drifted.append(place.pk)
+        for field in COUNTER_FIELDS:
+            setattr(place, field, expected[field])
+        batch.append(place)
+        if len(batch) >= batch_size and not dry_run:
+            type(place).objects.using(places.db).bulk_update(batch, COUNTER_FIELDS)
+            batch = []
+    if batch and not dry_run:
+        type(batch[0]).objects.using(places.db).bulk_update(batch, COUNTER_FIELDS)
+    return drifted
+
+
+def find_drift(places=None):
+    """
+    Compare the stored ``average_rating``/``total_ratings`` of ``places`` with
+    the live aggregate over their reviews. Returns ``(place, live)`` pairs for
+    every place that differs, ``live`` being the expected counter values.
+    """
+    from .models import Place, Review
+
+    places = Place.objects.all() if places is None else places
+    reviews = Review.objects.using(places.db)
+    if places.query.where:
+        reviews = reviews.filter(place__in=places.values('pk'))
+    stats = aggregate_reviews(reviews)
+
+    empty = {'average_rating': Decimal('0'), 'total_ratings': 0}
+    drifted = []
+    fields = ('pk', 'slug', 'name', 'average_rating', 'total_ratings')
+    for place in places.only(*fields).order_by('pk').iterator():
+        live = stats.get(place.pk, empty)
+        if (place.average_rating != live['average_rating']
+                or place.total_ratings != live['total_ratings']):
+            drifted.append((place, live))
+    return drifted
@@ -0,0 +1,308 @@
+"""
+Full-text search over places.
+
+The index lives in its own table next to ``wandercritic_place``:
+
+* SQLite: an FTS5 virtual table (one column per indexed field, rowid = place id)
+  ranked with ``bm25()``.
+* PostgreSQL: a ``tsvector`` column with a GIN index, ranked with
+  ``ts_rank_cd()``.
+
+Both backends expose the same interface so views only ever call
+``search_places(queryset, query)``. The index is kept in sync by the handlers
+in ``wandercritic.signals`` and can be rebuilt with
+``python manage.py rebuild_search_index``.
+"""
+import re
+
+from django.db import connections, router
+from django.db.models import BigIntegerField, FloatField
+from django.db.models.expressions import RawSQL
+
+SEARCH_TABLE = 'wandercritic_place_search'
+
+# Indexed columns and their weight in the ranking. Name hits count the most.
+SEARCH_FIELDS = [
+    ('name', 10.0),
+    ('short_description', 4.0),
+    ('description', 1.0),
+    ('location', 3.0),
+    ('history', 1.0),
+    ('highlights', 2.0),
+    ('categories', 3.0),
+    ('tags', 3.0),
+]
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return TOKEN_RE.findall((query or '').lower())
+
+
+def build_document(place):
+    """Return the text indexed for ``place``, keyed by search field."""
+    return {
+        'name': place.name or '',
+        'short_description': place.short_description or '',
+        'description': place.description or '',
+        'location': place.location or '',
+        'history': place.history or '',
+        'highlights': place.highlights or '',
+        'categories': ' '.join(c.name for c in place.categories.all()),
+        'tags': ' '.join(t.name for t in place.tags.all()),
+    }
+
+
+class SearchBackend:
+    vendor = None
+    # Column of the index table holding the place id
+    key_column = None
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_index(self):
+        raise NotImplementedError
+
+    def drop_index(self):
+        raise NotImplementedError
+
+    def index(self, places):
+        raise NotImplementedError
+
+    def remove(self, place_ids):
+        raise NotImplementedError
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+
+    def compile_query(self, query):
+        raise NotImplementedError
+
+    def search(self, queryset, compiled):
+        """
+        ``queryset`` restricted to the places matching ``compiled`` and
+        annotated with ``search_rank`` (lower is better). The index table is
+        joined once, so the query is matched once rather than per place row.
+        """
+        return queryset.extra(
+            tables=[SEARCH_TABLE], where=[self.match_sql()], params=[compiled],
+        ).filter(
+            pk=RawSQL(f'{SEARCH_TABLE}.{self.key_column}', [], output_field=BigIntegerField()),
+        ).annotate(search_rank=self.rank(compiled))
+
+    def match_sql(self):
+        """WHERE clause on the index table matching the compiled query (one parameter)."""
+        raise NotImplementedError
+
+    def rank(self, compiled):
+        """RawSQL ranking the joined index row. Lower values are better matches."""
+        raise NotImplementedError
+
+
+class SQLiteSearchBackend(SearchBackend):
+    vendor = 'sqlite'
+    key_column = 'rowid'
+
+    def create_index(self):
+        columns = ', '.join(name for name, _ in SEARCH_FIELDS)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5('
+                f"{columns}, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+    def index(self, places):
+        names = [name for name, _ in SEARCH_FIELDS]
+        rows = []
+        for place in places:
+            document = build_document(place)
+            rows.append([place.pk] + [document[name] for name in names])
+        if not rows:
+            return
+        placeholders = ', '.join(['%s'] * (len(names) + 1))
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s',
+                [[row[0]] for row in rows],
+            )
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, {", ".join(names)}) '
+                f'VALUES ({placeholders})',
+                rows,
+            )
+
+    def remove(self, place_ids):
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s',
+                [[pk] for pk in place_ids],
+            )
+
+    def compile_query(self, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+        # Every term must match; the last one as a prefix so partial words work
+        terms = [f'"{token}"' for token in tokens]
+        terms[-1] += '*'
+        return ' '.join(terms)
+
+    def match_sql(self):
+        return f'{SEARCH_TABLE} MATCH %s'
+
+    def rank(self, compiled):
+        weights = ', '.join(str(weight) for _, weight in SEARCH_FIELDS)
+        return RawSQL(f'bm25({SEARCH_TABLE}, {weights})', [], output_field=FloatField())
+
+
+class PostgresSearchBackend(SearchBackend):
+    vendor = 'postgresql'
+    key_column = 'place_id'
+    config = 'english'
+
+    # tsvector weight class per field
+    WEIGHT_CLASSES = {
+        'name': 'A',
+        'short_description': 'B',
+        'location': 'B',
+        'categories': 'B',
+        'tags': 'B',
+        'highlights': 'C',
+        'description': 'D',
+        'history': 'D',
+    }
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ('
+                'place_id bigint PRIMARY KEY, document tsvector NOT NULL)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_gin '
+                f'ON {SEARCH_TABLE} USING GIN (document)'
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+    def index(self, places):
+        vector = ' || '.join(
+            f"setweight(to_tsvector('{self.config}', %s), '{self.WEIGHT_CLASSES[name]}')"
+            for name, _ in SEARCH_FIELDS
+        )
+        rows = []
+        for place in places:
+            document = build_document(place)
+            rows.append([place.pk] + [document[name] for name, _ in SEARCH_FIELDS])
+        if not rows:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE} (place_id, document) VALUES (%s, {vector}) '
+                'ON CONFLICT (place_id) DO UPDATE SET document = EXCLUDED.document',
+                rows,
+            )
+
+    def remove(self, place_ids):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {SEARCH_TABLE} WHERE place_id = ANY(%s)',
+                [list(place_ids)],
+            )
+
+    def compile_query(self, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+        return ' & '.join(f'{token}:*' for token in tokens)
+
+    def match_sql(self):
+        return f"{SEARCH_TABLE}.document @@ to_tsquery('{self.config}', %s)"
+
+    def rank(self, compiled):
+        return RawSQL(
+            f"-ts_rank_cd({SEARCH_TABLE}.document, to_tsquery('{self.config}', %s))",
+            [compiled], output_field=FloatField(),
+        )
+
+
+BACKENDS = {
+    backend.vendor: backend
+    for backend in (SQLiteSearchBackend, PostgresSearchBackend)
+}
+
+
+def get_backend(connection=None):
+    """Return the search backend for ``connection``, or None if unsupported."""
+    if connection is None:
+        from .models import Place
+        connection = connections[router.db_for_write(Place)]
+    backend_class = BACKENDS.get(connection.vendor)
+    return backend_class(connection) if backend_class else None
+
+
+def _with_terms(queryset):
+    return queryset.prefetch_related('categories', 'tags')
+
+
+def index_places(places):
+    backend = get_backend()
+    if backend:
+        backend.index(_with_terms(places) if hasattr(places, 'prefetch_related') else places)
+
+
+def remove_places(place_ids):
+    backend = get_backend()
+    if backend and place_ids:
+        backend.remove(place_ids)
+
+
+def rebuild_index(place_model=None, connection=None, batch_size=500):
+    """Drop every indexed row and re-index all places. Returns the place count."""
+    if place_model is None:
+        from .models import Place as place_model
+    backend = get_backend(connection)
+    if backend is None:
+        return 0
+    backend.create_index()
+    backend.clear()
+    queryset = place_model.objects.order_by('pk')
+    if connection is not None:
+        queryset = queryset.using(connection.alias)
+    count = 0
+    batch = []
+    for place in _with_terms(queryset).iterator(chunk_size=batch_size):
+        batch.append(place)
+        if len(batch) >= batch_size:
+            backend.index(batch)
+            count += len(batch)
+            batch = []
+    backend.index(batch)
+    return count + len(batch)
+
+
+def search_places(queryset, query):
+    """
+    Restrict ``queryset`` to places matching ``query`` and annotate each row with
+    ``search_rank`` (lower is better). Falls back to ``icontains`` on databases
+    without a search backend.
+    """
+    backend = get_backend(connections[queryset.db])
+    if backend is None:
+        from django.db.models import Q
+        return queryset.filter(
+            Q(name__icontains=query) | Q(description__icontains=query) | Q(location__icontains=query)
+        )
+    compiled = backend.compile_query(query)
+    if compiled is None:
+        return queryset.none()
+    return backend.search(queryset, compiled)
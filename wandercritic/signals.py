@@ -0,0 +1,445 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import autocomplete, bitmap_index, caching, images, ratings, search, storage, surrogate
+from .models import EXPLORE_ORDERING, Place, PlaceCategory, PlaceImage, Review, Tag, User, WebsiteReview
+
+
+# Search index
+
+@receiver(post_save, sender=Place)
+def index_saved_place(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_places(Place.objects.filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Place)
+def unindex_deleted_place(sender, instance, **kwargs):
+    search.remove_places([instance.pk])
+
+
+@receiver(m2m_changed, sender=Place.categories.through)
+@receiver(m2m_changed, sender=Place.tags.through)
+def reindex_place_terms(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # Changed from the category/tag side; pk_set holds place ids (None on clear)
+        places = instance.places.all() if pk_set is None else Place.objects.filter(pk__in=pk_set)
+    else:
+        places = Place.objects.filter(pk=instance.pk)
+    search.index_places(places)
+
+
+@receiver(post_save, sender=PlaceCategory)
+@receiver(post_save, sender=Tag)
+def reindex_term_places(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+    search.index_places(instance.places.all())
+
+
+@receiver(pre_delete, sender=PlaceCategory)
+@receiver(pre_delete, sender=Tag)
+def remember_term_places(sender, instance, **kwargs):
+    instance._search_place_ids = list(instance.places.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=PlaceCategory)
+@receiver(post_delete, sender=Tag)
+def reindex_after_term_delete(sender, instance, **kwargs):
+    place_ids = getattr(instance, '_search_place_ids', None)
+    if place_ids:
+        search.index_places(Place.objects.filter(pk__in=place_ids))
+
+
+# Rating counters
+
+@receiver(pre_delete, sender=Review)
+def remember_stored_rating(sender, instance, origin=None, **kwargs):
+    if origin is instance:
+        # review.delete() may be called on a stale instance; use the stored rating
+        stored = sender.objects.filter(pk=instance.pk).values_list('place_id', 'rating').first()
+        if stored:
+            instance._loaded_place_id, instance._loaded_rating = stored
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, origin=None, **kwargs):
+    place_id = getattr(instance, '_loaded_place_id', None) or instance.place_id
+    if isinstance(origin, Place) and origin.pk == place_id:
+        # The place itself is being deleted, nothing left to update
+        return
+    rating = getattr(instance, '_loaded_rating', None) or instance.rating
+    ratings.apply_rating_change(place_id, rating, None)
+
+
+# Stored values
+#
+# One SELECT before an update loads what the handlers below compare the saved
+# row against: the image it replaces, and for places the fields listed pages
+# are tagged by.
+
+IMAGE_FIELDS = {Place: 'image', PlaceImage: 'image', User: 'profile_picture'}
+LISTED_FIELDS = {Place: ('budget', 'created_by_id')}
+
+
+@receiver(pre_save, sender=Place)
+@receiver(pre_save, sender=PlaceImage)
+@receiver(pre_save, sender=User)
+def remember_stored_fields(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    image_field = IMAGE_FIELDS[sender]
+    fields = list(LISTED_FIELDS.get(sender, ()))
+    if update_fields is None or image_field in update_fields:
+        fields.append(image_field)
+    if not fields:
+        return
+    stored = sender.objects.filter(pk=instance.pk).values(*fields).first()
+    if stored is None:
+        return
+    old_name = stored.pop(image_field, None)
+    if old_name and old_name != getattr(instance, image_field).name:
+        instance._replaced_image = old_name
+    if sender in LISTED_FIELDS:
+        instance._listed_fields = tuple(stored[field] for field in LISTED_FIELDS[sender])
+
+
+# Image renditions
+
+
+@receiver(post_save, sender=Place)
+@receiver(post_save, sender=PlaceImage)
+@receiver(post_save, sender=User)
+def build_image_renditions(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    image = getattr(instance, IMAGE_FIELDS[sender])
+    if image and image.name and not images.has_renditions(image):
+        # Until they are recorded the templates show the original
+        name = image.name
+        transaction.on_commit(lambda: images.build_later(name))
+
+
+# Shared media blobs
+
+@receiver(post_save, sender=Place)
+@receiver(post_save, sender=PlaceImage)
+@receiver(post_save, sender=User)
+def release_replaced_image(sender, instance, **kwargs):
+    old_name = instance.__dict__.pop('_replaced_image', None)
+    if old_name:
+        transaction.on_commit(lambda: storage.release(old_name))
+
+
+@receiver(post_delete, sender=Place)
+@receiver(post_delete, sender=PlaceImage)
+@receiver(post_delete, sender=User)
+def release_deleted_image(sender, instance, **kwargs):
+    name = getattr(instance, IMAGE_FIELDS[sender]).name
+    if name:
+        transaction.on_commit(lambda: storage.release(name))
+
+
+# Cache invalidation
+#
+# Namespaces are bumped once the transaction commits: a request rendering in
+# between would otherwise cache the old rows under the new version. Review
+# saves also update the rating counters after post_save, in the same
+# transaction.
+
+def _bump(*namespaces):
+    transaction.on_commit(lambda: caching.bump(*namespaces))
+
+
+def _bump_places(*place_ids):
+    def bump():
+        slugs = Place.objects.filter(pk__in=place_ids).values_list('slug', flat=True)
+        caching.bump('places', *(caching.place_namespace(slug) for slug in slugs))
+
+    transaction.on_commit(bump)
+
+
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Place)
+def invalidate_place(sender, instance, **kwargs):
+    _bump('places', caching.place_namespace(instance.slug))
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=PlaceImage)
+@receiver(post_delete, sender=PlaceImage)
+def invalidate_place_content(sender, instance, **kwargs):
+    _bump_places(instance.place_id)
+
+
+@receiver(m2m_changed, sender=Place.categories.through)
+@receiver(m2m_changed, sender=Place.tags.through)
+def invalidate_place_terms(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        _bump('places', 'terms')
+    else:
+        _bump('places', caching.place_namespace(instance.slug))
+
+
+@receiver(post_save, sender=PlaceCategory)
+@receiver(post_delete, sender=PlaceCategory)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_terms(sender, **kwargs):
+    _bump('terms', 'places')
+
+
+@receiver(post_save, sender=WebsiteReview)
+@receiver(post_delete, sender=WebsiteReview)
+def invalidate_website_reviews(sender, **kwargs):
+    _bump('website_reviews')
+
+
+def _shows_user(update_fields, created):
+    # Names and pictures appear on cards, place pages and testimonials;
+    # logins only touch last_login
+    return not (created or (update_fields is not None and set(update_fields) <= {'last_login'}))
+
+
+def _user_place_ids(user):
+    """Places showing ``user``: the ones they created or reviewed."""
+    reviewed = Review.objects.filter(user=user).values_list('place_id', flat=True)
+    return {*user.places.values_list('pk', flat=True), *reviewed}
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_content(sender, instance, update_fields=None, created=False, **kwargs):
+    if not _shows_user(update_fields, created):
+        return
+    _bump('website_reviews')
+    _bump_places(*_user_place_ids(instance))
+
+
+# Bitmap index
+#
+# Changes are applied to this process's index once committed, after the cache
+# bumps above; other processes pick them up through a rebuild.
+
+def _term_kind(sender):
+    return 'categories' if sender in (PlaceCategory, Place.categories.through) else 'tags'
+
+
+@receiver(post_save, sender=Place)
+def update_bitmap_place(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    place_id, rating, created_at, budget = instance.pk, instance.average_rating, instance.created_at, instance.budget
+    transaction.on_commit(lambda: bitmap_index.apply_change(
+        lambda index: index.update_place(place_id, rating, created_at, budget)))
+
+
+@receiver(post_delete, sender=Place)
+def remove_bitmap_place(sender, instance, **kwargs):
+    place_id = instance.pk
+    transaction.on_commit(lambda: bitmap_index.apply_change(lambda index: index.remove_place(place_id)))
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def rerank_bitmap_place(sender, instance, **kwargs):
+    # Review.save() updates the rating counters with a queryset update,
+    # so the new average is read back from the database
+    place_id = instance.place_id
+
+    def rerank(index):
+        row = Place.objects.filter(pk=place_id).values_list('average_rating', 'created_at', 'budget').first()
+        if row:
+            index.update_place(place_id, *row)
+
+    transaction.on_commit(lambda: bitmap_index.apply_change(rerank))
+
+
+@receiver(m2m_changed, sender=Place.categories.through)
+@receiver(m2m_changed, sender=Place.tags.through)
+def update_bitmap_terms(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    kind, pk = _term_kind(sender), instance.pk
+    if action == 'post_clear':
+        # pk_set is None on clear: empty the term's (or the place's) bits
+        clear = 'clear_term' if reverse else 'clear_place'
+        change = lambda index: getattr(index, clear)(kind, pk)
+    else:
+        place_ids, term_ids = (set(pk_set), [pk]) if reverse else ([pk], set(pk_set))
+        present = action == 'post_add'
+        change = lambda index: index.link(kind, place_ids, term_ids, present)
+    transaction.on_commit(lambda: bitmap_index.apply_change(change))
+
+
+@receiver(post_save, sender=PlaceCategory)
+@receiver(post_save, sender=Tag)
+def rename_bitmap_term(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    kind, term_id, name = _term_kind(sender), instance.pk, instance.name
+    transaction.on_commit(lambda: bitmap_index.apply_change(lambda index: index.rename_term(kind, term_id, name)))
+
+
+@receiver(post_delete, sender=PlaceCategory)
+@receiver(post_delete, sender=Tag)
+def remove_bitmap_term(sender, instance, **kwargs):
+    kind, term_id = _term_kind(sender), instance.pk
+    transaction.on_commit(lambda: bitmap_index.apply_change(lambda index: index.remove_term(kind, term_id)))
+
+
+# Autocomplete
+
+@receiver(post_save, sender=Place)
+def update_suggested_place(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    row = (instance.pk, instance.name, instance.slug, instance.location, instance.total_ratings,
+           instance.average_rating)
+    transaction.on_commit(lambda: autocomplete.apply_change(lambda index: index.put_place(*row)))
+
+
+@receiver(post_delete, sender=Place)
+def remove_suggested_place(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: autocomplete.apply_change(lambda index: index.remove('place', pk)))
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def rerank_suggested_place(sender, instance, **kwargs):
+    place_id = instance.place_id
+
+    def rerank(index):
+        row = Place.objects.filter(pk=place_id).values_list('total_ratings', 'average_rating').first()
+        if row:
+            index.rerank('place', place_id, *row)
+
+    transaction.on_commit(lambda: autocomplete.apply_change(rerank, notify=False))
+
+
+@receiver(post_save, sender=PlaceCategory)
+@receiver(post_save, sender=Tag)
+def update_suggested_term(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    kind, pk, name = ('category' if sender is PlaceCategory else 'tag'), instance.pk, instance.name
+
+    def put(index):
+        # Keep the popularity counted at the last build
+        previous = index.entries.get((kind, pk))
+        index.put(kind, pk, autocomplete.Suggestion(
+            kind, name, name, *(previous.rank if previous else ())))
+
+    transaction.on_commit(lambda: autocomplete.apply_change(put))
+
+
+@receiver(post_delete, sender=PlaceCategory)
+@receiver(post_delete, sender=Tag)
+def remove_suggested_term(sender, instance, **kwargs):
+    kind, pk = ('category' if sender is PlaceCategory else 'tag'), instance.pk
+    transaction.on_commit(lambda: autocomplete.apply_change(lambda index: index.remove(kind, pk)))
+
+
+# Reverse-proxy purges (see surrogate.py)
+
+def _purge_if_homepage_top(place_id):
+    # Pages already showing the place are tagged with its key; this catches
+    # it moving into the top 5
+    top = Place.objects.order_by(*EXPLORE_ORDERING).values_list('pk', flat=True)[:5]
+    if place_id in top:
+        surrogate.purge(surrogate.HOMEPAGE_TOP)
+
+
+def _purge_rated_place(place_id):
+    surrogate.purge(surrogate.place_key(place_id))
+    # The rating counters are updated after post_save, in the same transaction
+    transaction.on_commit(lambda: _purge_if_homepage_top(place_id))
+
+
+@receiver(post_save, sender=Place)
+def purge_saved_place(sender, instance, created=False, raw=False, **kwargs):
+    listed = instance.__dict__.pop('_listed_fields', None)
+    if raw:
+        return
+    if created:
+        surrogate.purge(surrogate.PLACE_LIST, surrogate.EXPLORE, surrogate.agent_key(instance.created_by_id))
+        _purge_rated_place(instance.pk)
+        return
+    keys = [surrogate.place_key(instance.pk)]
+    if listed:
+        budget, created_by_id = listed
+        if budget != instance.budget:
+            # Budget facet counts on every explore page
+            keys.append(surrogate.EXPLORE)
+        if created_by_id != instance.created_by_id:
+            keys += [surrogate.agent_key(created_by_id), surrogate.agent_key(instance.created_by_id)]
+    surrogate.purge(*keys)
+
+
+@receiver(post_delete, sender=Place)
+def purge_deleted_place(sender, instance, **kwargs):
+    surrogate.purge(surrogate.place_key(instance.pk), surrogate.PLACE_LIST, surrogate.EXPLORE,
+                    surrogate.agent_key(instance.created_by_id))
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def purge_reviewed_place(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Place):
+        # Deleted with its place
+        return
+    _purge_rated_place(instance.place_id)
+
+
+@receiver(post_save, sender=PlaceImage)
+@receiver(post_delete, sender=PlaceImage)
+def purge_place_images(sender, instance, **kwargs):
+    surrogate.purge(surrogate.place_key(instance.place_id))
+
+
+def _term_key(term):
+    return surrogate.category_key(term.pk) if isinstance(term, PlaceCategory) else surrogate.tag_key(term.pk)
+
+
+@receiver(m2m_changed, sender=Place.categories.through)
+@receiver(m2m_changed, sender=Place.tags.through)
+def purge_place_terms(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # Term counts change on every explore page
+    if reverse:
+        # Pages of places that had the term are tagged with it
+        surrogate.purge(surrogate.EXPLORE, _term_key(instance), *map(surrogate.place_key, pk_set or ()))
+    else:
+        surrogate.purge(surrogate.EXPLORE, surrogate.place_key(instance.pk))
+
+
+@receiver(post_save, sender=PlaceCategory)
+@receiver(post_delete, sender=PlaceCategory)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def purge_term(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    surrogate.purge(surrogate.EXPLORE, _term_key(instance))
+
+
+@receiver(post_save, sender=WebsiteReview)
+@receiver(post_delete, sender=WebsiteReview)
+def purge_website_reviews(sender, **kwargs):
+    surrogate.purge(surrogate.WEBSITE_REVIEWS)
+
+
+@receiver(post_save, sender=User)
+def purge_user_content(sender, instance, update_fields=None, created=False, **kwargs):
+    if not _shows_user(update_fields, created):
+        return
+    surrogate.purge(surrogate.WEBSITE_REVIEWS, surrogate.agent_key(instance.pk),
+                    *map(surrogate.place_key, _user_place_ids(instance)))
@@ -0,0 +1,253 @@
+"""
+Static asset build and serving.
+
+``python manage.py collectstatic`` is the build stage. ``StaticAssetStorage``
+stores every file under a content-hashed name (``main.3f9a1c2b7e4d.css``,
+recorded in ``staticfiles.json``). CSS is minified as it is written and
+hashed in its minified form, so the name always describes the bytes
+served. Precompressed siblings are written next to each hashed file:
+
+* ``.gz`` and, when the ``brotli`` package is installed, ``.br`` for text
+  files (CSS, JS, SVG, ...)
+* ``.webp`` and, when Pillow supports it, ``.avif`` for JPEG/PNG images
+
+A sibling is only kept when it is smaller than the file itself.
+
+``StaticFilesMiddleware`` serves ``STATIC_ROOT`` in production without a
+separate web server: it picks the smallest variant the client accepts
+(``Accept-Encoding`` for the compressed siblings, ``Accept`` for the image
+formats) and marks hashed files ``Cache-Control: immutable`` for a year,
+since a changed file gets a new name. Until collectstatic has been run the
+``{% static %}`` tag keeps returning plain names.
+"""
+import gzip
+import io
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+from PIL import Image, features
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip siblings are written
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.mjs', '.svg', '.txt', '.json', '.map', '.xml', '.html', '.ico'}
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+
+# Sibling suffix -> Pillow save options
+IMAGE_VARIANTS = {
+    '.avif': ('AVIF', {'quality': 60}),
+    '.webp': ('WEBP', {'quality': 80, 'method': 6}),
+}
+
+# Sibling suffix -> Content-Encoding / Content-Type, in order of preference
+ENCODINGS = {'.br': 'br', '.gz': 'gzip'}
+IMAGE_TYPES = {'.avif': 'image/avif', '.webp': 'image/webp'}
+
+# A sibling must save at least this share of the original to be kept
+MIN_SAVING = 0.05
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+
+
+# Build
+
+_CSS_STRINGS = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''')
+# Strings come first so a comment is only matched outside of them
+_CSS_STRINGS_OR_COMMENTS = re.compile(_CSS_STRINGS.pattern + r'|/\*(?!!).*?\*/', re.S)
+_CSS_SPACE = re.compile(r'\s+')
+_CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_css(css):
+    """Strip comments (except ``/*! ... */``) and redundant whitespace, leaving strings alone."""
+    css = _CSS_STRINGS_OR_COMMENTS.sub(lambda match: match.group(1) or '', css)
+    parts = _CSS_STRINGS.split(css)
+    for i in range(0, len(parts), 2):  # odd parts are string literals
+        code = _CSS_SPACE.sub(' ', parts[i])
+        code = _CSS_PUNCTUATION.sub(r'\1', code)
+        parts[i] = code.replace(';}', '}').replace(': ', ':')
+    return ''.join(parts).strip()
+
+
+def _smaller(data, original_size):
+    return len(data) <= original_size * (1 - MIN_SAVING)
+
+
+def compressed_variants(data):
+    """``{suffix: bytes}`` of the precompressed siblings worth keeping for ``data``."""
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return {suffix: body for suffix, body in variants.items() if _smaller(body, len(data))}
+
+
+def image_variants(data):
+    """``{suffix: bytes}`` of the WebP/AVIF siblings worth keeping for an image."""
+    variants = {}
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        for suffix, (image_format, options) in IMAGE_VARIANTS.items():
+            if not features.check(image_format.lower()):
+                continue
+            out = io.BytesIO()
+            image.save(out, image_format, **options)
+            if _smaller(out.getvalue(), len(data)):
+                variants[suffix] = out.getvalue()
+    return variants
+
+
+def _minified(name, content):
+    """``content`` (a File) of ``name`` as written to STATIC_ROOT: CSS minified, else None."""
+    if not name or os.path.splitext(name)[1].lower() != '.css':
+        return None
+    content.seek(0)
+    data = content.read()
+    content.seek(0)
+    try:
+        minified = minify_css(data.decode('utf-8') if isinstance(data, bytes) else data).encode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    return ContentFile(minified)
+
+
+class StaticAssetStorage(ManifestStaticFilesStorage):
+    manifest_strict = False
+
+    def file_hash(self, name, content=None):
+        # Hash what _save() writes
+        if content is not None:
+            content = _minified(name, content) or content
+        return super().file_hash(name, content)
+
+    def _save(self, name, content):
+        return super()._save(name, _minified(name, content) or content)
+
+    def hashed_name(self, name, content=None, filename=None):
+        try:
+            return super().hashed_name(name, content, filename)
+        except ValueError:
+            # A reference to a file that does not exist (main.css and some
+            # templates point at missing images) keeps its plain name and
+            # 404s, rather than failing the build or the page
+            if content is not None:
+                raise
+            return name
+
+    def stored_name(self, name):
+        # Plain names until collectstatic has written the manifest
+        # (development, tests)
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for hashed_name in sorted(set(self.hashed_files.values())):
+            try:
+                self.build_variants(hashed_name)
+            except Exception as e:
+                yield hashed_name, None, e
+                return
+
+    def build_variants(self, name):
+        extension = os.path.splitext(name)[1].lower()
+        if extension not in COMPRESSIBLE_EXTENSIONS and extension not in IMAGE_EXTENSIONS:
+            return
+        with self.open(name) as f:
+            data = f.read()
+
+        variants = image_variants(data) if extension in IMAGE_EXTENSIONS else compressed_variants(data)
+        for suffix, body in variants.items():
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(body))
+
+
+# Serving
+
+def _accepted(header):
+    """Tokens of an ``Accept``/``Accept-Encoding`` header not refused with ``q=0``."""
+    accepted = set()
+    for item in header.split(','):
+        token, *params = [part.strip() for part in item.split(';')]
+        if token and not any(param.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000') for param in params):
+            accepted.add(token.lower())
+    return accepted
+
+
+class StaticFilesMiddleware:
+    """Serve files collected into ``STATIC_ROOT``, precompressed and with long-lived caching."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL if settings.STATIC_URL.startswith('/') else None
+        self.root = settings.STATIC_ROOT
+        # Names that embed their content hash never change
+        self.immutable = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+        self.siblings = {}
+
+    def __call__(self, request):
+        if self.prefix and self.root and request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix):
+            response = self.serve(request, request.path[len(self.prefix):])
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    def variants(self, path):
+        """Sibling suffixes that exist for ``path``; files only change on deploy."""
+        if path not in self.siblings:
+            self.siblings[path] = [
+                suffix for suffix in (*ENCODINGS, *IMAGE_TYPES) if os.path.isfile(path + suffix)
+            ]
+        return self.siblings[path]
+
+    def serve(self, request, name):
+        name = posixpath.normpath(unquote(name)).lstrip('/')
+        try:
+            path = safe_join(self.root, name)
+        except SuspiciousFileOperation:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        variants = self.variants(path)
+        chosen, headers = path, {}
+        if variants:
+            encodings = _accepted(request.headers.get('Accept-Encoding', ''))
+            types = _accepted(request.headers.get('Accept', ''))
+            for suffix in variants:
+                if ENCODINGS.get(suffix) in encodings:
+                    chosen, headers = path + suffix, {'Content-Encoding': ENCODINGS[suffix]}
+                    break
+                if IMAGE_TYPES.get(suffix) in types:
+                    chosen, content_type = path + suffix, IMAGE_TYPES[suffix]
+                    break
+            headers['Vary'] = 'Accept-Encoding' if variants[0] in ENCODINGS else 'Accept'
+
+        stat = os.stat(chosen)
+        if not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(open(chosen, 'rb'), content_type=content_type)
+            response['Last-Modified'] = http_date(stat.st_mtime)
+        for header, value in headers.items():
+            response[header] = value
+        response['Cache-Control'] = IMMUTABLE if name in self.immutable else REVALIDATE
+        return response
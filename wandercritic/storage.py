@@ -0,0 +1,128 @@
+"""
+Content-addressed media storage.
+
+Uploads are stored as ``<upload_to>/<sha256 of content><ext>``. The digest is
+computed while the upload is streamed to a temporary file, which is then
+renamed into place, so identical images share a single blob on disk no matter
+how many times they are uploaded.
+
+A blob can be referenced by several rows (``Place.image``,
+``PlaceImage.image``, ``User.profile_picture``). ``release()`` counts those
+references and only deletes the blob once nothing points at it any more.
+Saving touches a reused blob, and ``release()`` leaves blobs touched within
+``MEDIA_RELEASE_GRACE`` seconds alone: the row of an upload that has just
+reused the blob may not have committed yet. ``dedupe_media --prune``
+removes them later if they stay unreferenced.
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+
+from . import images
+
+# Model fields that may point at a stored blob
+REFERENCING_FIELDS = [
+    ('wandercritic', 'Place', 'image'),
+    ('wandercritic', 'PlaceImage', 'image'),
+    ('wandercritic', 'User', 'profile_picture'),
+]
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def content_name(name, digest):
+    """
+    Content-addressed name for an upload originally called ``name``. Blobs live
+    in the top-level upload directory (``places/``, ``profile_pics/``) so the
+    same content uploaded from anywhere maps to the same name.
+    """
+    directory = name.split('/', 1)[0] if '/' in name else ''
+    extension = posixpath.splitext(name)[1].lower()
+    return posixpath.join(directory, f'{digest}{extension}')
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # Names are derived from the content in _save(), so they never collide
+        return name
+
+    def _save(self, name, content):
+        directory = os.path.dirname(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+        if self.directory_permissions_mode is not None:
+            os.chmod(directory, self.directory_permissions_mode)
+
+        # Hash while streaming the upload to a temporary file in the target directory
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    f.write(chunk)
+            name = content_name(name, digest.hexdigest())
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                # Identical content is already stored; share the existing
+                # blob, and keep release() off it until our row commits
+                os.unlink(tmp_path)
+                os.utime(full_path)
+            else:
+                if self.file_permissions_mode is not None:
+                    os.chmod(tmp_path, self.file_permissions_mode)
+                os.replace(tmp_path, full_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return name
+
+
+def references(name):
+    """Number of rows pointing at the blob ``name``."""
+    count = 0
+    for app_label, model_name, field_name in REFERENCING_FIELDS:
+        model = apps.get_model(app_label, model_name)
+        count += model._default_manager.filter(**{field_name: name}).count()
+    return count
+
+
+def recently_saved(name, storage=None):
+    """Whether the blob ``name`` was written or reused within ``MEDIA_RELEASE_GRACE``."""
+    try:
+        modified = os.path.getmtime((storage or default_storage).path(name))
+    except (FileNotFoundError, NotImplementedError):
+        return False
+    return time.time() - modified < settings.MEDIA_RELEASE_GRACE
+
+
+def release(name, storage=None):
+    """
+    Delete the blob ``name`` and its renditions if no row references it and
+    it was not saved within the grace period.
+    """
+    if not name or references(name) or recently_saved(name, storage):
+        return False
+    storage = storage or default_storage
+    storage.delete(name)
+    images.delete_renditions(name)
+    return True
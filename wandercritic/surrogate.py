@@ -0,0 +1,248 @@
+"""
+Surrogate keys for a reverse-proxy cache, and purging by key.
+
+Cacheable pages carry a ``Surrogate-Key`` header (Fastly, Varnish xkey)
+naming what they show, so one change purges exactly the pages showing it:
+
+* ``place-<id>``      - the detail page and every listing page (homepage,
+  explore, place list, an agent's places) showing the place
+* ``category-<id>``, ``tag-<id>`` - place pages showing the term
+* ``agent-<id>``      - the agent's list of places (my_places)
+* ``homepage-top``    - the homepage, purged when a place enters its top 5
+* ``explore``         - every explore page; the facets show every term and
+  its count
+* ``place-list``      - every place list page, newest first
+* ``website-reviews`` - the homepage testimonials
+
+Tagged pages served as ``public`` also get ``Surrogate-Control: max-age``
+(``SURROGATE_MAX_AGE``), so the proxy keeps them until a purge while browsers
+keep revalidating (see ``conditional.py``).
+
+Signal handlers (``wandercritic.signals``) call ``purge()``. Keys are sent
+after the transaction commits, so the proxy never refetches the old rows,
+and keys purged during a request (``SurrogatePurgeMiddleware``) or a
+``batch()`` block go out together, ``SURROGATE_PURGE_BATCH_SIZE`` per call to
+the backend named by ``SURROGATE_PURGE_BACKEND``:
+
+* ``MemoryPurgeBackend`` (default) records the latest batches in process, for
+  development and tests
+* ``HTTPPurgeBackend`` sends them to a proxy, e.g. Varnish with xkey, as
+  ``PURGE SURROGATE_PURGE_URL`` with the keys in a ``Surrogate-Key`` header,
+  from a background thread so no request waits on the proxy
+"""
+import atexit
+import logging
+import queue
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.request import Request, urlopen
+
+from asgiref.local import Local
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Surrogate-Key'
+
+HOMEPAGE_TOP = 'homepage-top'
+EXPLORE = 'explore'
+PLACE_LIST = 'place-list'
+WEBSITE_REVIEWS = 'website-reviews'
+
+
+def place_key(place_id):
+    return f'place-{place_id}'
+
+
+def category_key(category_id):
+    return f'category-{category_id}'
+
+
+def tag_key(tag_id):
+    return f'tag-{tag_id}'
+
+
+def agent_key(user_id):
+    return f'agent-{user_id}'
+
+
+def place_keys(places):
+    return [place_key(place.pk) for place in places]
+
+
+def tag(response, *keys):
+    """Add ``keys`` to the ``Surrogate-Key`` header of ``response``."""
+    existing = response.get(HEADER, '').split()
+    response[HEADER] = ' '.join(dict.fromkeys([*existing, *keys]))
+    return response
+
+
+# Purging
+
+_state = Local()
+
+
+def _dispatch(keys):
+    backend = get_backend()
+    keys = sorted(keys)
+    size = settings.SURROGATE_PURGE_BATCH_SIZE
+    for i in range(0, len(keys), size):
+        try:
+            backend.purge(keys[i:i + size])
+        except Exception:
+            # The proxy keeps serving the old pages until they expire
+            logger.exception('Could not purge surrogate keys %s', ' '.join(keys[i:i + size]))
+
+
+def purge(*keys):
+    """Purge the pages tagged with ``keys`` once the current transaction commits."""
+    if not keys:
+        return
+    pending = getattr(_state, 'keys', None)
+    if pending is not None:
+        pending.update(keys)
+    else:
+        transaction.on_commit(lambda: _dispatch(keys))
+
+
+def _begin():
+    if getattr(_state, 'keys', None) is not None:
+        # Nested: the outer batch sends them
+        return False
+    _state.keys = set()
+    return True
+
+
+def _end():
+    keys, _state.keys = _state.keys, None
+    if keys:
+        transaction.on_commit(lambda: _dispatch(keys))
+
+
+@contextmanager
+def batch():
+    """Send the keys purged inside the block together, when it ends."""
+    started = _begin()
+    try:
+        yield
+    finally:
+        if started:
+            _end()
+
+
+class SurrogatePurgeMiddleware:
+    """Batch the purges caused by one request."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with batch():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        started = _begin()
+        try:
+            return await self.get_response(request)
+        finally:
+            if started:
+                # on_commit() needs the connection, which lives in the
+                # thread-sensitive worker
+                await sync_to_async(_end)()
+
+
+# Backends
+
+def get_backend():
+    # Looked up on every call, so override_settings() switches backends
+    return _backend(settings.SURROGATE_PURGE_BACKEND)
+
+
+@lru_cache(maxsize=None)
+def _backend(path):
+    return import_string(path)()
+
+
+class MemoryPurgeBackend:
+    """Records the last ``maxlen`` purged batches in ``purged``, newest last."""
+
+    def __init__(self, maxlen=1000):
+        self.purged = deque(maxlen=maxlen)
+
+    def purge(self, keys):
+        self.purged.append(list(keys))
+
+    def keys(self):
+        return {key for batch in self.purged for key in batch}
+
+    def clear(self):
+        self.purged.clear()
+
+
+class HTTPPurgeBackend:
+    """
+    Sends each batch as one request with the keys in a header. ``purge()``
+    only queues the batch; a worker thread sends it, and batches still queued
+    when the process exits are sent first. Up to ``maxsize`` batches wait,
+    later ones are dropped and logged.
+    """
+
+    def __init__(self, url=None, method='PURGE', header=HEADER, timeout=5, maxsize=1000):
+        self._url = url
+        self.method = method
+        self.header = header
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=maxsize)
+        self._worker = None
+        self._lock = threading.Lock()
+        atexit.register(self.join)
+
+    @property
+    def url(self):
+        return self._url or settings.SURROGATE_PURGE_URL
+
+    def purge(self, keys):
+        self._start()
+        try:
+            self.queue.put_nowait(list(keys))
+        except queue.Full:
+            logger.error('Purge queue full, dropped surrogate keys %s', ' '.join(keys))
+
+    def join(self):
+        """Wait until every queued batch has been sent."""
+        if self._worker is not None:
+            self.queue.join()
+
+    def send(self, keys):
+        request = Request(self.url, method=self.method, headers={self.header: ' '.join(keys)})
+        with urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def _start(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='surrogate-purge', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            keys = self.queue.get()
+            try:
+                self.send(keys)
+            except Exception:
+                # The proxy keeps serving the old pages until they expire
+                logger.exception('Could not purge surrogate keys %s', ' '.join(keys))
+            finally:
+                self.queue.task_done()
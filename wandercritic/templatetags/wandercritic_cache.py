@@ -0,0 +1,53 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+from django.utils.safestring import mark_safe
+
+from wandercritic import caching
+
+register = template.Library()
+
+
+@register.simple_tag
+def cache_version(*namespaces):
+    """
+    Version token for cache ``namespaces``, to vary a cached fragment on:
+
+        {% cache_version 'places' as places_version %}
+        {% cache_fragment 3600 top_places places_version %}...{% endcache_fragment %}
+    """
+    return caching.versions(*namespaces)
+
+
+class CacheFragmentNode(template.Node):
+    def __init__(self, nodelist, timeout, fragment_name, vary_on):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.fragment_name = fragment_name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        timeout = self.timeout.resolve(context)
+        try:
+            timeout = int(timeout)
+        except (ValueError, TypeError):
+            raise template.TemplateSyntaxError(f'"cache_fragment" tag got a non-integer timeout value: {timeout!r}')
+        key = make_template_fragment_key(self.fragment_name, [var.resolve(context) for var in self.vary_on])
+        return mark_safe(caching.fetch(key, lambda: self.nodelist.render(context), timeout=timeout))
+
+
+@register.tag
+def cache_fragment(parser, token):
+    """
+    Like ``{% cache %}``, but rendered through ``caching.fetch()`` so a popular
+    fragment is only rebuilt by one request at a time:
+
+        {% cache_fragment 3600 top_places places_version %}...{% endcache_fragment %}
+    """
+    nodelist = parser.parse(('endcache_fragment',))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires at least 2 arguments.")
+    return CacheFragmentNode(
+        nodelist, parser.compile_filter(bits[1]), bits[2], [parser.compile_filter(bit) for bit in bits[3:]]
+    )
@@ -0,0 +1,42 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from wandercritic import images
+
+register = template.Library()
+
+
+def _srcset(urls):
+    return ', '.join(f'{url} {width}w' for url, width in urls)
+
+
+@register.simple_tag
+def responsive_image(image, rendition, alt='', css_class='', sizes=None, loading='lazy'):
+    """
+    Render ``image`` (an ImageField value) as a <picture> with WebP and JPEG
+    srcsets for ``rendition``. Uses the original upload until the renditions
+    have been recorded on its row.
+    """
+    if not image:
+        return ''
+    spec = images.RENDITIONS[rendition]
+    widths = images.rendition_widths(image, rendition)
+    if not widths:
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" loading="{}">', image.url, alt, css_class, loading
+        )
+
+    sizes = sizes or spec.sizes
+    jpeg_urls = images.rendition_urls(image.name, rendition, 'jpeg', widths)
+    attrs = format_html_join(' ', '{}="{}"', [
+        ('width', widths[0]),
+        ('height', spec.height_for(widths[0])),
+    ]) if spec.aspect else ''
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="{}" {}>'
+        '</picture>',
+        _srcset(images.rendition_urls(image.name, rendition, 'webp', widths)), sizes,
+        jpeg_urls[0][0], _srcset(jpeg_urls), sizes, alt, css_class, loading, attrs,
+    )
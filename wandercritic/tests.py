@@ -0,0 +1,1124 @@
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from importlib import import_module
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.http import HttpResponse, QueryDict
+from django.template import Context, Template
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from wandercritic import (
+    async_views, autocomplete, bitmap_index, caching, exports, facets, images, inprocess, moderation, ratings,
+    search, static_assets, storage, surrogate,
+)
+from wandercritic.instrumentation import assert_query_budget
+from wandercritic.models import (
+    EXPLORE_ORDERING, Place, PlaceCategory, Report, Review, Tag, TravelAgentApplication, User,
+)
+from wandercritic.pagination import InvalidCursor, KeysetPaginator, encode_cursor
+
+
+def make_place(name, created_by, **fields):
+    fields = {'description': f'About {name}', 'short_description': name, 'location': 'Scotland', **fields}
+    return Place.objects.create(name=name, created_by=created_by, **fields)
+
+
+class FixtureMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.agent = User.objects.create_user('agent', password='pw', is_travel_agent=True)
+        cls.reviewer = User.objects.create_user('reviewer', password='pw')
+        cls.admin = User.objects.create_superuser('admin', password='pw')
+        cls.category = PlaceCategory.objects.create(name='Castles', slug='castles')
+        cls.tag = Tag.objects.create(name='Coast', slug='coast')
+        cls.places = []
+        for i in range(3):
+            place = make_place(f'Place {i}', cls.agent, budget=Decimal(100 * (i + 1)))
+            place.categories.add(cls.category)
+            place.tags.add(cls.tag)
+            Review.objects.create(place=place, user=cls.reviewer, rating=i + 3, comment='Lovely')
+            cls.places.append(place)
+        cls.place = cls.places[0]
+        Report.objects.create(reporter=cls.reviewer, place=cls.place, content_type='place',
+                              report_type='misinformation', description='Wrong opening hours')
+        TravelAgentApplication.objects.create(user=cls.reviewer, full_name='Reviewer', experience='Years',
+                                              phone='0123456789')
+
+    def setUp(self):
+        # In-process indexes are built in the test's thread, by warm_up()
+        patcher = mock.patch.object(inprocess.IndexHolder, 'rebuild_later')
+        self.rebuild_later = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cold_start()
+
+    def cold_start(self):
+        cache.clear()
+        bitmap_index.reset()
+        autocomplete.reset()
+
+
+class QueryBudgetTests(FixtureMixin, TestCase):
+    """Every budgeted route, on a cold start (empty cache, indexes unbuilt) and warm."""
+
+    def assert_budget(self, path, user=None):
+        if user:
+            self.client.force_login(user)
+        for state in ('cold', 'warm'):
+            with self.subTest(path=path, state=state):
+                response = assert_query_budget(self.client, path)
+                self.assertEqual(response.status_code, 200)
+            bitmap_index.warm_up()
+            autocomplete.warm_up()
+        return response
+
+    def test_anonymous_pages(self):
+        slug = self.place.slug
+        for path in [
+            reverse('wandercritic:index'),
+            reverse('wandercritic:explore'),
+            reverse('wandercritic:search_suggestions') + '?q=pla',
+            reverse('wandercritic:place_list'),
+            reverse('wandercritic:place_list_more'),
+            reverse('wandercritic:place_detail', args=[slug]),
+            reverse('wandercritic:place_reviews_more', args=[slug]),
+        ]:
+            self.cold_start()
+            self.assert_budget(path)
+
+    def test_filtered_explore(self):
+        # Facets filter by term name
+        make_place('Elsewhere', self.agent)
+        for path in [
+            reverse('wandercritic:explore') + f'?category={self.category.name}',
+            reverse('wandercritic:explore_more') + f'?tag={self.tag.name}',
+        ]:
+            self.cold_start()
+            response = self.assert_budget(path)
+            for place in self.places:
+                self.assertContains(response, place.name)
+            self.assertNotContains(response, 'Elsewhere')
+
+    def test_manage_reports(self):
+        self.assert_budget(reverse('wandercritic:manage_reports'), self.reviewer)
+
+    def test_admin_pages(self):
+        self.client.force_login(self.admin)
+        for name in ['admin_applications', 'admin_reports', 'admin_report_queue']:
+            self.assert_budget(reverse(f'wandercritic:{name}'))
+
+
+class RatingCounterTests(FixtureMixin, TestCase):
+    def assert_counters(self, place, **expected):
+        place.refresh_from_db()
+        counters = {field: getattr(place, field) for field in ratings.COUNTER_FIELDS}
+        for field, value in expected.items():
+            self.assertEqual(counters[field], value, field)
+        self.assertEqual(ratings.find_drift(Place.objects.filter(pk=place.pk)), [])
+
+    def test_create(self):
+        Review.objects.create(place=self.place, user=self.agent, rating=4, comment='Good')
+        self.assert_counters(self.place, total_ratings=2, rating_sum=7, rating_count_3=1, rating_count_4=1,
+                             average_rating=Decimal('3.50'))
+
+    def test_update(self):
+        review = Review.objects.get(place=self.place)
+        review.rating = 1
+        review.save()
+        self.assert_counters(self.place, total_ratings=1, rating_sum=1, rating_count_1=1, rating_count_3=0,
+                             average_rating=Decimal('1.00'))
+
+    def test_move_to_another_place(self):
+        review = Review.objects.get(place=self.place)
+        review.place = self.places[2]
+        review.user = self.agent
+        review.save()
+        self.assert_counters(self.place, total_ratings=0, rating_sum=0, average_rating=Decimal('0.00'))
+        self.assert_counters(self.places[2], total_ratings=2, rating_sum=8, rating_count_3=1, rating_count_5=1)
+
+    def test_delete(self):
+        Review.objects.create(place=self.place, user=self.agent, rating=5, comment='Great')
+        Review.objects.get(place=self.place, user=self.reviewer).delete()
+        self.assert_counters(self.place, total_ratings=1, rating_sum=5, rating_count_3=0, rating_count_5=1,
+                             average_rating=Decimal('5.00'))
+
+    def test_bulk_delete(self):
+        Review.objects.filter(place__in=self.places).delete()
+        for place in self.places:
+            self.assert_counters(place, total_ratings=0, rating_sum=0)
+
+    def test_rating_out_of_range(self):
+        with self.assertRaises(ValueError):
+            ratings.apply_rating_change(self.place.pk, new_rating=7)
+        self.assert_counters(self.place, total_ratings=1, rating_sum=3)
+
+    def test_posted_rating_out_of_range(self):
+        self.client.force_login(self.agent)
+        response = self.client.post(reverse('wandercritic:place_detail', args=[self.place.slug]),
+                                    {'rating': '7', 'comment': 'Too good'})
+        self.assertRedirects(response, reverse('wandercritic:place_detail', args=[self.place.slug]))
+        self.assertFalse(Review.objects.filter(place=self.place, user=self.agent).exists())
+
+
+class SurrogatePurgeTests(FixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.backend = surrogate.get_backend()
+        self.backend.clear()
+
+    def purged(self, change):
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        return self.backend.keys()
+
+    def test_backend_is_bounded(self):
+        backend = surrogate.MemoryPurgeBackend(maxlen=2)
+        for key in 'abc':
+            backend.purge([key])
+        self.assertEqual(backend.keys(), {'b', 'c'})
+
+    def test_place_created(self):
+        keys = self.purged(lambda: make_place('New Place', self.agent))
+        new = Place.objects.get(slug='new-place')
+        self.assertLessEqual(
+            {surrogate.PLACE_LIST, surrogate.EXPLORE, surrogate.agent_key(self.agent.pk),
+             surrogate.place_key(new.pk)},
+            keys,
+        )
+
+    def test_place_edited(self):
+        self.place.description = 'Changed'
+        keys = self.purged(self.place.save)
+        self.assertEqual(keys, {surrogate.place_key(self.place.pk)})
+
+    def test_place_budget_edited(self):
+        self.place.budget = Decimal(1)
+        keys = self.purged(self.place.save)
+        self.assertEqual(keys, {surrogate.place_key(self.place.pk), surrogate.EXPLORE})
+
+    def test_place_deleted(self):
+        place_key = surrogate.place_key(self.place.pk)
+        keys = self.purged(self.place.delete)
+        self.assertLessEqual(
+            {place_key, surrogate.PLACE_LIST, surrogate.EXPLORE, surrogate.agent_key(self.agent.pk)}, keys,
+        )
+
+    def test_review_created(self):
+        place = self.places[1]
+        keys = self.purged(lambda: Review.objects.create(place=place, user=self.agent, rating=5, comment='Yes'))
+        self.assertIn(surrogate.place_key(place.pk), keys)
+        self.assertNotIn(surrogate.place_key(self.place.pk), keys)
+
+    def test_review_deleted(self):
+        review = Review.objects.get(place=self.place)
+        keys = self.purged(review.delete)
+        self.assertIn(surrogate.place_key(self.place.pk), keys)
+
+    def test_term_renamed(self):
+        self.category.name = 'Forts'
+        keys = self.purged(self.category.save)
+        self.assertEqual(keys, {surrogate.EXPLORE, surrogate.category_key(self.category.pk)})
+
+    def test_term_added_to_place(self):
+        tag = Tag.objects.create(name='Hills', slug='hills')
+        self.backend.clear()
+        keys = self.purged(lambda: self.place.tags.add(tag))
+        self.assertEqual(keys, {surrogate.EXPLORE, surrogate.place_key(self.place.pk)})
+
+    def test_term_deleted(self):
+        tag_key = surrogate.tag_key(self.tag.pk)
+        keys = self.purged(self.tag.delete)
+        self.assertLessEqual({surrogate.EXPLORE, tag_key}, keys)
+
+
+
+    def test_user_edited(self):
+        self.agent.first_name = 'Ann'
+        keys = self.purged(self.agent.save)
+        self.assertEqual(keys, {surrogate.WEBSITE_REVIEWS, surrogate.agent_key(self.agent.pk),
+                                *surrogate.place_keys(self.places)})
+
+    def test_backend_follows_settings(self):
+        with override_settings(SURROGATE_PURGE_BACKEND='wandercritic.surrogate.HTTPPurgeBackend'):
+            self.assertIsInstance(surrogate.get_backend(), surrogate.HTTPPurgeBackend)
+        self.assertIs(surrogate.get_backend(), self.backend)
+
+    def test_http_backend_sends_from_a_worker(self):
+        received = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_PURGE(self):
+                received.append(self.headers[surrogate.HEADER])
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        backend = surrogate.HTTPPurgeBackend(f'http://127.0.0.1:{server.server_port}/')
+        backend.purge(['place-1', 'explore'])
+        backend.join()
+        self.assertEqual(received, ['place-1 explore'])
+
+
+class SearchTests(FixtureMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.loch = make_place('Loch Ness', cls.agent)
+        cls.boat = make_place('Boat Trips', cls.agent, description='Cruises on the loch all day')
+
+    def search(self, query):
+        return list(search.search_places(Place.objects.all(), query).order_by('search_rank', 'id'))
+
+    def test_name_hits_rank_first(self):
+        self.assertEqual(self.search('loch'), [self.loch, self.boat])
+
+    def test_last_term_is_a_prefix(self):
+        self.assertEqual(self.search('cruis'), [self.boat])
+        self.assertEqual(self.search('loch cruises'), [self.boat])
+
+    def test_terms_are_indexed(self):
+        self.assertEqual(len(self.search('castles coast')), 3)
+
+    def test_query_is_matched_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.search('loch')
+        self.assertEqual(queries[0]['sql'].count('MATCH'), 1)
+
+    def test_explore_search(self):
+        response = self.client.get(reverse('wandercritic:explore') + '?search=ness')
+        self.assertContains(response, 'Loch Ness')
+        self.assertNotContains(response, 'Boat Trips')
+
+    def test_icontains_fallback(self):
+        with mock.patch.object(search, 'get_backend', return_value=None):
+            found = search.search_places(Place.objects.all(), 'LOCH')
+        self.assertEqual(set(found), {self.loch, self.boat})
+
+
+class FacetTests(FixtureMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.islands = PlaceCategory.objects.create(name='Islands', slug='islands')
+        cls.hills = Tag.objects.create(name='Hills', slug='hills')
+        cls.places[1].categories.add(cls.islands)
+        cls.places[2].tags.add(cls.hills)
+        cls.elsewhere = make_place('Elsewhere', cls.agent, budget=Decimal(15))
+        cls.elsewhere.categories.add(cls.islands)
+
+    def select(self, query):
+        return facets.FacetSelection.from_params(QueryDict(query))
+
+    def matching(self, query):
+        return set(facets.filter_places(Place.objects.all(), self.select(query)))
+
+    def test_any_and_all(self):
+        self.assertEqual(self.matching('category=Castles&category=Islands'), {*self.places, self.elsewhere})
+        self.assertEqual(self.matching('category=Castles&category=Islands&category_mode=all'), {self.places[1]})
+        self.assertEqual(self.matching('tag=Hills&budget_range=201%2B'), {self.places[2]})
+        self.assertEqual(self.matching('budget_range=0-10&budget_range=11-20'), {self.elsewhere})
+
+    def test_counts_in_three_queries(self):
+        with self.assertNumQueries(3):
+            counts = facets.facet_counts(Place.objects.all(), self.select('category=Islands&tag=Hills'))
+        # OR facets are counted without their own selection but with the others
+        self.assertEqual(counts['categories'], {self.category.pk: 1})
+        self.assertEqual(counts['tags'], {self.tag.pk: 1})
+        self.assertEqual(counts['budgets'], dict.fromkeys(facets.BUDGET_RANGES, 0))
+
+    def test_all_counts_narrow(self):
+        counts = facets.facet_counts(Place.objects.all(), self.select('category=Islands&category_mode=all'))
+        self.assertEqual(counts['categories'], {self.category.pk: 1, self.islands.pk: 2})
+        self.assertEqual(counts['tags'], {self.tag.pk: 1})
+        self.assertEqual(counts['budgets'], {**dict.fromkeys(facets.BUDGET_RANGES, 0), '11-20': 1, '101-200': 1})
+
+    def test_options_mark_the_selection(self):
+        selection = self.select('tag=Coast&tag_mode=nonsense&budget_range=nonsense')
+        self.assertEqual((selection.tag_mode, selection.budgets), ('any', ()))
+        options = facets.facet_options(facets.facet_counts(Place.objects.all(), selection), selection,
+                                       PlaceCategory.objects.all(), Tag.objects.order_by('name'))
+        self.assertEqual([(o.value, o.count, o.selected) for o in options['tags']],
+                         [('Coast', 3, True), ('Hills', 1, False)])
+
+
+class BitmapIndexTests(FixtureMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.islands = PlaceCategory.objects.create(name='Islands', slug='islands')
+        for i in range(4):
+            # Unrated, so ranked by creation time and id
+            place = make_place(f'Unrated {i}', cls.agent, budget=Decimal(15) if i % 2 else None)
+            place.categories.add(cls.islands if i % 2 else cls.category)
+
+    def setUp(self):
+        super().setUp()
+        self.index = bitmap_index.warm_up()
+
+    def test_facet_counts_match_sql(self):
+        for query in ['', 'category=Castles', 'category=Castles&category=Islands&category_mode=all',
+                      'tag=Coast&budget_range=11-20&budget_range=201%2B', 'category=Nowhere']:
+            with self.subTest(query=query):
+                selection = facets.FacetSelection.from_params(QueryDict(query))
+                counts = self.index.facet_counts(selection)
+                # The index also lists the options matching nothing
+                counts['categories'] = {pk: n for pk, n in counts['categories'].items() if n}
+                counts['tags'] = {pk: n for pk, n in counts['tags'].items() if n}
+                self.assertEqual(counts, facets.facet_counts(Place.objects.all(), selection))
+
+    def test_cursors_are_interchangeable_with_keyset(self):
+        selection = facets.FacetSelection()
+        paginator = KeysetPaginator(Place.objects.all(), EXPLORE_ORDERING, page_size=2)
+        cursor, seen = None, []
+        while True:
+            page = self.index.page(Place.objects.all(), selection, cursor, page_size=2)
+            self.assertEqual(page.object_list, paginator.page(cursor).object_list)
+            seen += page.object_list
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, list(Place.objects.order_by(*EXPLORE_ORDERING)))
+
+    def test_cursor_follows_the_index(self):
+        first = self.index.page(Place.objects.all(), facets.FacetSelection(), page_size=2)
+        # Changed behind the index's back: the page shows the new value, the
+        # cursor still points where the index ranks the row
+        Place.objects.filter(pk=first.object_list[-1].pk).update(average_rating=Decimal('1.00'))
+        again = self.index.page(Place.objects.all(), facets.FacetSelection(), page_size=2)
+        self.assertEqual(again.next_cursor, first.next_cursor)
+        following = self.index.page(Place.objects.all(), facets.FacetSelection(), again.next_cursor, page_size=2)
+        self.assertNotIn(first.object_list[-1], following.object_list)
+
+    def test_rebuilt_in_the_background(self):
+        self.assertIs(bitmap_index.get_index(), self.index)
+        self.rebuild_later.assert_not_called()
+        caching.bump(bitmap_index.NAMESPACE)
+        # Requests keep the current index while another is built
+        self.assertIs(bitmap_index.get_index(), self.index)
+        self.rebuild_later.assert_called_once()
+
+    def test_rebuilt_after_the_interval_without_a_shared_cache(self):
+        with override_settings(BITMAP_INDEX_REBUILD_INTERVAL=0):
+            self.assertFalse(caching.shared())
+            bitmap_index.get_index()
+        self.rebuild_later.assert_called_once()
+
+    def test_not_built_in_requests(self):
+        bitmap_index.reset()
+        response = assert_query_budget(self.client, reverse('wandercritic:explore') + '?category=Islands')
+        self.assertContains(response, 'Unrated 1')
+        self.assertIsNone(bitmap_index.get_index())
+        self.rebuild_later.assert_called()
+
+
+class AutocompleteTests(FixtureMixin, TestCase):
+    def labels(self, query):
+        return [(suggestion.kind, suggestion.label, typo) for suggestion, typo in autocomplete.suggest(query)]
+
+    def test_prefixes_of_any_word(self):
+        autocomplete.warm_up()
+        self.assertEqual(self.labels('cas'), [('category', 'Castles', False)])
+        # Exact matches come before those one typo away
+        self.assertEqual(self.labels('place 1')[0], ('place', 'Place 1', False))
+        self.assertTrue(all(typo for _, _, typo in self.labels('place 1')[1:]))
+        self.assertEqual(self.labels('scot'), [('location', 'Scotland', False)])
+        self.assertEqual(self.labels('c'), [])
+
+    def test_most_popular_first(self):
+        Review.objects.create(place=self.places[0], user=self.agent, rating=1, comment='Meh')
+        autocomplete.warm_up()
+        # Most ratings, then the best average
+        self.assertEqual([label for _, label, _ in self.labels('place')], ['Place 0', 'Place 2', 'Place 1'])
+
+    def test_typos(self):
+        autocomplete.warm_up()
+        self.assertEqual(self.labels('catsles'), [('category', 'Castles', True)])
+
+    def test_updated_in_place(self):
+        autocomplete.warm_up()
+        with self.captureOnCommitCallbacks(execute=True):
+            make_place('Glen Coe', self.agent)
+            Tag.objects.create(name='Glens', slug='glens')
+        self.assertCountEqual(self.labels('gle'), [('place', 'Glen Coe', False), ('tag', 'Glens', False)])
+        self.rebuild_later.assert_not_called()
+
+    def test_database_until_built(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.labels('PLACE 2'), [('place', 'Place 2', False)])
+        self.rebuild_later.assert_called_once()
+        response = self.client.get(reverse('wandercritic:search_suggestions'), {'q': 'place 2'})
+        self.assertEqual(response.json()['suggestions'], [{
+            'kind': 'place', 'label': 'Place 2', 'typo': False,
+            'url': reverse('wandercritic:place_detail', args=[self.places[2].slug]),
+        }])
+
+
+class AsyncViewTests(FixtureMixin, TestCase):
+    """The async pages, called directly: the URLconf picks them at import under ASGI."""
+
+    def request(self, user, data=None):
+        path = reverse('wandercritic:place_detail', args=[self.place.slug])
+        factory = AsyncRequestFactory()
+        request = factory.post(path, data) if data is not None else factory.get(path)
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+        request._messages = FallbackStorage(request)
+
+        async def auser():
+            return user
+
+        request.auser = auser
+        return request
+
+    async def test_place_detail(self):
+        response = await async_views.place_detail(self.request(AnonymousUser()), slug=self.place.slug)
+        self.assertContains(response, self.place.name)
+        self.assertContains(response, 'Lovely')
+
+    async def test_review_posted(self):
+        request = self.request(self.agent, {'rating': '5', 'comment': 'Superb'})
+        response = await async_views.place_detail(request, slug=self.place.slug)
+        self.assertEqual(response.status_code, 302)
+        review = await Review.objects.aget(place=self.place, user=self.agent)
+        self.assertEqual((review.rating, review.comment), (5, 'Superb'))
+        self.assertEqual([str(m) for m in request._messages], ['Your review has been posted!'])
+
+    async def test_rating_out_of_range(self):
+        request = self.request(self.agent, {'rating': '0', 'comment': 'Awful'})
+        response = await async_views.place_detail(request, slug=self.place.slug)
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(await Review.objects.filter(place=self.place, user=self.agent).aexists())
+        self.assertEqual([str(m) for m in request._messages], ['Please pick a rating from 1 to 5.'])
+
+
+class DatabaseProfileTests(SimpleTestCase):
+    """The production SQLite profile, on a connection to a scratch database file."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        default = connections['default']
+        self.connection = type(default)({
+            **default.settings_dict,
+            **settings.DATABASE_PROFILES['production'],
+            'NAME': os.path.join(directory, 'db.sqlite3'),
+        }, 'production')
+        connections['production'] = self.connection
+        self.addCleanup(self.remove_connection)
+
+    def remove_connection(self):
+        self.connection.close()
+        del connections['production']
+
+    def test_pragmas(self):
+        with self.connection.cursor() as cursor:
+            for pragma, value in [('journal_mode', 'wal'), ('synchronous', 1), ('busy_timeout', 10000),
+                                  ('cache_size', -32000), ('temp_store', 2)]:
+                cursor.execute(f'PRAGMA {pragma}')
+                self.assertEqual(cursor.fetchone()[0], value, pragma)
+
+    def test_transactions_take_the_write_lock_first(self):
+        with CaptureQueriesContext(self.connection) as queries, transaction.atomic(using='production'):
+            self.connection.cursor().execute('SELECT 1')
+        self.assertEqual(queries[0]['sql'], 'BEGIN IMMEDIATE')
+
+
+class ExportTests(FixtureMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Review.objects.create(place=cls.places[1], user=cls.agent, rating=5, comment='Tall, "grand"\nand cold')
+
+    def test_admin_csv(self):
+        self.client.force_login(self.admin)
+        reviews = Review.objects.filter(place=self.places[1]).order_by('pk')
+        response = self.client.post(reverse('admin:wandercritic_review_changelist'), {
+            'action': 'export_csv', '_selected_action': [review.pk for review in reviews],
+        })
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertRegex(response['Content-Disposition'], r'attachment; filename="reviews-\d{8}-\d{6}\.csv"')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ['id', 'place', 'user', 'rating', 'comment', 'created_at', 'updated_at'])
+        self.assertEqual([row[:5] for row in rows[1:]], [
+            [str(review.pk), self.places[1].slug, review.user.username, str(review.rating), review.comment]
+            for review in reviews
+        ])
+
+    def test_command_jsonl(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'reviews.jsonl')
+        out = io.StringIO()
+        call_command('export_rows', 'reviews', format='jsonl', filters=['rating=5'], output=path, stdout=out)
+        self.assertIn('Exported 2 reviews', out.getvalue())
+        with open(path, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual([(row['place'], row['user'], row['comment']) for row in rows], [
+            (self.places[2].slug, 'reviewer', 'Lovely'),
+            (self.places[1].slug, 'agent', 'Tall, "grand"\nand cold'),
+        ])
+
+    def test_command_rejects_other_filters(self):
+        with self.assertRaises(CommandError):
+            call_command('export_rows', 'reviews', filters=['comment=Lovely'], stdout=io.StringIO())
+
+    async def test_streamed_asynchronously_under_asgi(self):
+        request = AsyncRequestFactory().get('/')
+        response = exports.streaming_response(Place.objects.all(), 'csv', request)
+        self.assertTrue(response.is_async)
+        lines = [line async for line in response.streaming_content]
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[1].startswith(f'{self.places[0].pk},{self.places[0].slug},'.encode()))
+
+
+class LoadReviewsTests(FixtureMixin, TestCase):
+    def test_upserts_and_rejects(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'reviews.jsonl')
+        first, second = self.places[0].slug, self.places[1].slug
+        lines = [
+            {'place': second, 'user': 'agent', 'rating': 2, 'comment': 'Windy', 'created_at': '2024-05-01T10:00:00Z'},
+            {'place': first, 'user': 'reviewer', 'rating': '5', 'comment': 'Better now'},
+            'not json',
+            {'place': first, 'user': 'agent', 'rating': 6, 'comment': 'Too good'},
+            {'place': 'nowhere', 'user': 'agent', 'rating': 3, 'comment': 'Lost'},
+            {'place': first, 'user': 'nobody', 'rating': 3, 'comment': 'Who'},
+            {'place': second, 'user': 'agent', 'rating': 4, 'comment': 'Again'},
+        ]
+        with open(path, 'w', encoding='utf-8') as f:
+            for line in lines:
+                f.write((line if isinstance(line, str) else json.dumps(line)) + '\n\n')
+        backend = surrogate.get_backend()
+        backend.clear()
+        created_at = Review.objects.get(place=self.places[0]).created_at
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('load_reviews', path, batch_size=2, stdout=io.StringIO())
+
+        review = Review.objects.get(place=self.places[1], user=self.agent)
+        self.assertEqual((review.rating, review.comment), (2, 'Windy'))
+        self.assertEqual(review.created_at.isoformat(), '2024-05-01T10:00:00+00:00')
+        updated = Review.objects.get(place=self.places[0], user=self.reviewer)
+        self.assertEqual((updated.rating, updated.comment, updated.created_at), (5, 'Better now', created_at))
+        self.assertEqual(Review.objects.count(), 4)
+        self.assertEqual(ratings.find_drift(Place.objects.all()), [])
+        self.places[1].refresh_from_db()
+        self.assertEqual(self.places[1].average_rating, Decimal('3.00'))
+
+        with open(f'{path}.rejects.jsonl', encoding='utf-8') as f:
+            rejects = [json.loads(line) for line in f]
+        self.assertEqual([reject['line'] for reject in rejects], [5, 7, 9, 11, 13])
+        self.assertIn('invalid JSON', rejects[0]['error'])
+        self.assertIn('rating must be one of', rejects[1]['error'])
+        self.assertIn('duplicate review', rejects[4]['error'])
+        self.assertLessEqual({surrogate.PLACE_LIST, surrogate.EXPLORE, surrogate.HOMEPAGE_TOP,
+                              surrogate.place_key(self.places[0].pk), surrogate.place_key(self.places[1].pk)},
+                             backend.keys())
+
+
+class StaticAssetTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        settings_override = override_settings(STATIC_ROOT=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_minify_css(self):
+        css = '/* layout */\n.card  >  a ,\nh1 {\n  color: red;\n  content: "a  /* b */";\n}\n/*! licence */'
+        self.assertEqual(static_assets.minify_css(css), '.card>a,h1{color:red;content:"a  /* b */"}/*! licence */')
+
+    def test_build_writes_minified_file_and_smaller_siblings(self):
+        assets = static_assets.StaticAssetStorage(location=self.root)
+        css = '.card {\n    color: red;\n}\n' * 200
+        name = assets._save('main.css', ContentFile(css.encode()))
+        assets.build_variants(name)
+        with assets.open(name) as f:
+            self.assertEqual(f.read(), static_assets.minify_css(css).encode())
+        self.assertTrue(assets.exists(name + '.gz'))
+
+        tiny = assets._save('tiny.js', ContentFile(b'x'))
+        assets.build_variants(tiny)
+        self.assertFalse(assets.exists(tiny + '.gz'))
+
+    def write(self, name, data):
+        with open(os.path.join(self.root, name), 'wb') as f:
+            f.write(data)
+
+    def get(self, path, **headers):
+        middleware = static_assets.StaticFilesMiddleware(lambda request: HttpResponse(status=404))
+        middleware.immutable = {'main.3f9a1c2b7e4d.css'}
+        return middleware(RequestFactory().get(path, headers=headers))
+
+    def test_serves_the_sibling_the_client_accepts(self):
+        self.write('main.3f9a1c2b7e4d.css', b'plain')
+        self.write('main.3f9a1c2b7e4d.css.br', b'brotli')
+        self.write('main.3f9a1c2b7e4d.css.gz', b'gzip')
+
+        response = self.get('/static/main.3f9a1c2b7e4d.css', accept_encoding='gzip, br')
+        self.assertEqual((b''.join(response.streaming_content), response['Content-Encoding']), (b'brotli', 'br'))
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['Cache-Control'], static_assets.IMMUTABLE)
+
+        response = self.get('/static/main.3f9a1c2b7e4d.css', accept_encoding='gzip, br;q=0')
+        self.assertEqual((b''.join(response.streaming_content), response['Content-Encoding']), (b'gzip', 'gzip'))
+
+        response = self.get('/static/main.3f9a1c2b7e4d.css')
+        self.assertEqual(b''.join(response.streaming_content), b'plain')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_image_formats_and_plain_names(self):
+        self.write('photo.png', b'png')
+        self.write('photo.png.webp', b'webp')
+
+        response = self.get('/static/photo.png', accept='image/avif,image/webp,*/*')
+        self.assertEqual((b''.join(response.streaming_content), response['Content-Type']), (b'webp', 'image/webp'))
+        self.assertEqual(response['Vary'], 'Accept')
+        self.assertEqual(response['Cache-Control'], static_assets.REVALIDATE)
+        self.assertEqual(self.get('/static/../settings.py').status_code, 404)
+        self.assertEqual(self.get('/static/missing.css').status_code, 404)
+
+
+class ModerationQueueTests(FixtureMixin, TestCase):
+    def report(self, reporter, place=None, review=None, status='pending', **fields):
+        fields = {'report_type': 'spam', 'description': 'Spam', 'url': '', **fields}
+        return Report.objects.create(reporter=reporter, place=place, review=review, status=status, **fields)
+
+    def setUp(self):
+        super().setUp()
+        self.review = Review.objects.get(place=self.places[1])
+        for reporter in (self.agent, self.admin, self.agent):
+            self.report(reporter, self.places[1], self.review, report_type='inappropriate')
+        self.report(self.reviewer, url='https://example.com/broken', content_type='bug')
+        noisy = User.objects.create_user('noisy', password='pw')
+        for _ in range(3):
+            self.report(noisy, self.places[2], status='dismissed')
+        self.report(noisy, self.places[2])
+
+    def test_groups_ranked_by_trust_and_recency(self):
+        with self.assertNumQueries(2):
+            groups = list(moderation.queue())
+        self.assertEqual([group.target.token for group in groups], [
+            f'review:{self.review.pk}', 'bug:https://example.com/broken',
+            f'place:{self.places[0].pk}', f'place:{self.places[2].pk}',
+        ])
+        # Fresh reports double each reporter's weight; "noisy" had 3 reports dismissed
+        for group, priority in zip(groups, [2.0, 1.0, 1.0, 0.4]):
+            self.assertAlmostEqual(group.priority, priority, places=3)
+        review_group = groups[0]
+        self.assertEqual((review_group.count, review_group.reporter_count), (3, 2))
+        self.assertEqual(review_group.report_type_display, 'Inappropriate Content')
+        self.assertEqual(review_group.place, self.places[1])
+        self.assertEqual(len(review_group.reports), moderation.GROUP_SAMPLE_SIZE)
+        self.assertEqual(groups[1].place, None)
+
+        Report.objects.filter(url='https://example.com/broken').update(
+            created_at=timezone.now() - timedelta(hours=2 * settings.MODERATION_RECENCY_HALF_LIFE))
+        group = next(g for g in moderation.queue() if g.target.kind == 'bug')
+        self.assertAlmostEqual(group.priority, 0.5 * 1.25, places=3)
+
+    def test_keyset_pages(self):
+        expected = [group.target for group in moderation.queue()]
+        seen, cursor = [], None
+        while True:
+            page = moderation.queue(cursor, page_size=1)
+            seen += [group.target for group in page]
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+            # New reports on groups already shown do not move later pages
+            self.report(self.reviewer, self.places[1], self.review)
+        self.assertEqual(seen, expected)
+        with self.assertRaises(InvalidCursor):
+            moderation.queue(encode_cursor(['now', 1.0, 'place:1']))
+
+    def test_close_group(self):
+        target = moderation.Target('review', self.review.pk)
+        self.assertEqual(moderation.close_group(target, 'dismiss', self.admin), 3)
+        self.assertEqual(
+            set(Report.objects.filter(review=self.review).values_list('status', 'resolved_by')),
+            {('dismissed', self.admin.pk)},
+        )
+        self.assertEqual(moderation.close_group(target, 'resolve', self.admin), 0)
+        self.assertNotIn(target, [group.target for group in moderation.queue()])
+
+        self.client.force_login(self.admin)
+        url = reverse('wandercritic:admin_report_group_action', args=['resolve'])
+        self.client.post(url, {'target': 'bug:https://example.com/broken'})
+        self.assertEqual(Report.objects.get(content_type='bug').status, 'resolved')
+
+
+class KeysetPaginationTests(FixtureMixin, TestCase):
+    ordering = ('-average_rating', '-created_at', 'id')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Rating ties, so pages split inside a run of equal averages
+        for i in range(4):
+            place = make_place(f'Tied {i}', cls.agent)
+            Review.objects.create(place=place, user=cls.reviewer, rating=4, comment='Fine')
+
+    def walk(self, paginator, between_pages=None):
+        seen, cursor = [], None
+        while True:
+            page = paginator.page(cursor)
+            seen += page.object_list
+            if not page.has_next:
+                return seen
+            if between_pages:
+                between_pages()
+            cursor = page.next_cursor
+
+    def test_pages_cover_every_row_once(self):
+        queryset = Place.objects.all()
+        seen = self.walk(KeysetPaginator(queryset, self.ordering, page_size=2))
+        self.assertEqual(seen, list(queryset.order_by(*self.ordering)))
+
+    def test_inserts_do_not_shift_later_pages(self):
+        before = list(Place.objects.order_by(*self.ordering))
+        counter = iter(range(100))
+        seen = self.walk(
+            KeysetPaginator(Place.objects.all(), self.ordering, page_size=2),
+            # A new top-rated place lands on a page already shown
+            lambda: Review.objects.create(
+                place=make_place(f'New {next(counter)}', self.agent), user=self.reviewer, rating=5, comment='Top'),
+        )
+        self.assertEqual(seen, before)
+
+    def test_tampered_cursor(self):
+        paginator = KeysetPaginator(Place.objects.all(), self.ordering, page_size=2)
+        cursor = paginator.page().next_cursor
+        with self.assertRaises(InvalidCursor):
+            paginator.page(cursor[:-2] + 'xx')
+        response = self.client.get(reverse('wandercritic:place_list_more') + '?cursor=nonsense')
+        self.assertEqual(response.status_code, 400)
+
+
+class TempMediaMixin:
+    """Runs each test against an empty MEDIA_ROOT."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_RELEASE_GRACE=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        os.makedirs(os.path.join(self.media_root, 'places'))
+
+    def write_image(self, name, size=(400, 300), color='teal'):
+        PILImage.new('RGB', size, color).save(os.path.join(self.media_root, name))
+        return name
+
+
+class ImageRenditionTests(TempMediaMixin, FixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.name = self.write_image('places/small.png')
+
+    def render(self, place, rendition):
+        return Template('{% load wandercritic_images %}{% responsive_image place.image rendition %}').render(
+            Context({'place': place, 'rendition': rendition}))
+
+    def test_small_sources_are_not_upscaled(self):
+        state = images.generate_renditions(self.name)
+        self.assertEqual(state['widths'], {'card': [320]})
+        storage = images.rendition_storage()
+        self.assertTrue(storage.exists(images.rendition_name(self.name, 'card', 320, 'webp')))
+        self.assertFalse(storage.exists(images.rendition_name(self.name, 'card', 640, 'webp')))
+
+    def test_built_after_commit_and_recorded_on_the_rows(self):
+        with mock.patch.object(images, 'build_later') as build_later:
+            with self.captureOnCommitCallbacks(execute=True):
+                place = make_place('Pictured', self.agent, image=self.name)
+        build_later.assert_called_once_with(self.name)
+        # Until then the original is shown
+        self.assertIn(f'<img src="/media/{self.name}"', self.render(place, 'card'))
+
+        self.assertEqual(images.record_renditions(self.name, images.generate_renditions(self.name)), 1)
+        place.refresh_from_db()
+        self.assertTrue(images.has_renditions(place.image))
+        card = self.render(place, 'card')
+        self.assertIn('<picture>', card)
+        self.assertIn(' 320w', card)
+        self.assertNotIn(' 640w', card)
+        # No hero width fits the source
+        self.assertIn(f'<img src="/media/{self.name}"', self.render(place, 'hero'))
+
+        with mock.patch.object(images, 'build_later') as build_later:
+            with self.captureOnCommitCallbacks(execute=True):
+                place.save()
+        build_later.assert_not_called()
+
+
+class MediaStorageTests(TempMediaMixin, FixtureMixin, TestCase):
+    def upload(self, color='teal'):
+        content = io.BytesIO()
+        PILImage.new('RGB', (40, 30), color).save(content, 'PNG')
+        return default_storage.save('places/upload.png', ContentFile(content.getvalue()))
+
+    def test_identical_uploads_share_a_blob(self):
+        first, second = self.upload(), self.upload()
+        self.assertEqual(first, second)
+        self.assertRegex(first, r'^places/[0-9a-f]{64}\.png$')
+        self.assertNotEqual(self.upload('red'), first)
+
+    def test_blob_released_with_its_last_row(self):
+        name = self.upload()
+        first = make_place('First', self.agent, image=name)
+        second = make_place('Second', self.agent, image=name)
+        self.assertFalse(storage.release(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(default_storage.exists(name))
+
+    def test_dedupe_media(self):
+        old_name = self.write_image('places/legacy.png')
+        place = make_place('Legacy', self.agent, image=old_name)
+        namespace = caching.place_namespace(place.slug)
+        versions = caching.versions('places', namespace)
+        backend = surrogate.get_backend()
+        backend.clear()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedupe_media', stdout=io.StringIO())
+
+        place.refresh_from_db()
+        self.assertEqual(place.image.name, storage.content_name(old_name, storage.file_digest(place.image.path)))
+        self.assertFalse(default_storage.exists(old_name))
+        self.assertTrue(images.has_renditions(place.image))
+        self.assertNotEqual(caching.versions('places', namespace), versions)
+        self.assertIn(surrogate.place_key(place.pk), backend.keys())
+
+
+class MediaServeTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        with open(os.path.join(self.media_root, 'places', 'notes.txt'), 'wb') as f:
+            f.write(b'0123456789')
+        self.url = '/media/places/notes.txt'
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_whole_file_and_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual((response.status_code, self.content(response)), (200, b'0123456789'))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual((response.status_code, self.content(response)), (206, b'2345'))
+        self.assertEqual((response['Content-Range'], response['Content-Length']), ('bytes 2-5/10', '4'))
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual((response.status_code, self.content(response)), (206, b'789'))
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'))
+
+        # A stale If-Range sends the whole file
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, self.content(response)), (200, b'0123456789'))
+
+    def test_only_media_root_files(self):
+        with open(os.path.join(self.media_root, 'places', '.upload-partial'), 'wb') as f:
+            f.write(b'partial')
+        for url in ('/media/../IT_project/settings.py', '/media/%2e%2e/IT_project/settings.py',
+                    '/media/places/.upload-partial', '/media/places', '/media/places/missing.txt'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+
+class PopulatePlacesTests(TempMediaMixin, FixtureMixin, TestCase):
+    def place_data(self, name, **fields):
+        return {'name': name, 'description': f'About {name}', 'short_description': name,
+                'location': 'Highlands', **fields}
+
+    def test_import(self):
+        fixture_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, fixture_dir)
+        PILImage.new('RGB', (400, 300), 'green').save(os.path.join(fixture_dir, 'glen.png'))
+        path = os.path.join(fixture_dir, 'places.json')
+        with open(path, 'w') as f:
+            json.dump({'places': [
+                self.place_data(self.place.name),
+                self.place_data('Glen Coe', image_url='glen.png', category='Castles', tags=['Coast', 'Hills']),
+                self.place_data('Isle of Skye', category='Islands', budget=20),
+            ]}, f)
+
+        call_command('populate_places', file=path, workers=2, stdout=io.StringIO())
+
+        self.assertEqual(Place.objects.filter(name=self.place.name).count(), 1)
+        glen = Place.objects.get(slug='glen-coe')
+        self.assertEqual(glen.created_by, self.agent)
+        self.assertEqual([c.name for c in glen.categories.all()], ['Castles'])
+        self.assertEqual(sorted(t.slug for t in glen.tags.all()), ['coast', 'hills'])
+        self.assertTrue(default_storage.exists(glen.image.name))
+        self.assertTrue(images.has_renditions(glen.image))
+        self.assertEqual(glen.images.get().image.name, glen.image.name)
+        skye = Place.objects.get(slug='isle-of-skye')
+        self.assertFalse(skye.image)
+        self.assertEqual(skye.categories.get().slug, 'islands')
+        self.assertEqual(list(search.search_places(Place.objects.all(), 'glen')), [glen])
+
+
+class SeedSyntheticTests(TestCase):
+    def test_rows_keep_their_generated_dates(self):
+        started = timezone.now()
+        call_command('seed_synthetic', users=5, agents=2, places=4, reviews=3, reports=3, tags=5,
+                     days=30, stdout=io.StringIO())
+
+        places = Place.objects.filter(slug__startswith='synth-place-')
+        self.assertEqual(places.count(), 4)
+        for model, rows in ((Place, places), (Review, Review.objects.filter(place__in=places)),
+                            (Report, Report.objects.filter(place__in=places))):
+            with self.subTest(model=model.__name__):
+                dates = list(rows.values_list('created_at', flat=True))
+                self.assertTrue(dates)
+                self.assertTrue(all(started - timedelta(days=30) <= date < started for date in dates))
+        place = places.first()
+        self.assertEqual(place.total_ratings, place.review_set.count())
+
+        # Rows saved outside the command are still stamped when created
+        review = Review.objects.create(place=place, user=User.objects.create_user('late'), rating=4, comment='Late')
+        self.assertGreaterEqual(review.created_at, started)
+
+
+class ConditionalPageTests(FixtureMixin, TestCase):
+    def test_matching_etag_gets_304_without_rendering(self):
+        url = reverse('wandercritic:place_detail', args=[self.place.slug])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertIn('s-maxage=60', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(queries), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(place=self.place, user=self.agent, rating=5, comment='Superb')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_listing_and_logged_in_pages(self):
+        url = reverse('wandercritic:explore')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertNotEqual(self.client.get(url + '?sort=rating')['ETag'], etag)
+
+        self.client.force_login(self.reviewer)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertIn('private', response['Cache-Control'])
+
+
+class CacheInvalidationTests(FixtureMixin, TestCase):
+    def test_bumped_once_committed(self):
+        namespace = caching.place_namespace(self.place.slug)
+        versions = caching.versions('places', namespace)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Review.objects.create(place=self.place, user=self.agent, rating=5, comment='Superb')
+            self.assertEqual(caching.versions('places', namespace), versions)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(caching.versions('places', namespace), versions)
+
+    def test_cached_page_shows_new_review(self):
+        url = reverse('wandercritic:place_detail', args=[self.place.slug])
+        self.assertNotContains(self.client.get(url), 'Superb')
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(place=self.place, user=self.agent, rating=5, comment='Superb')
+        self.assertContains(self.client.get(url), 'Superb')
+
+    def test_one_select_before_a_place_update(self):
+        self.place.budget = Decimal(5)
+        with CaptureQueriesContext(connection) as queries:
+            self.place.save()
+        sql = [query['sql'] for query in queries]
+        update = next(i for i, statement in enumerate(sql) if statement.startswith('UPDATE "wandercritic_place"'))
+        self.assertEqual(len([s for s in sql[:update] if 'FROM "wandercritic_place"' in s]), 1)
+
+
+class FetchTests(SimpleTestCase):
+    key = 'wc:test'
+
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+    def compute(self, value='fresh'):
+        def compute():
+            self.calls.append(value)
+            return value
+        return compute
+
+    def test_miss_then_hit(self):
+        self.assertEqual(caching.fetch(self.key, self.compute(), timeout=60), 'fresh')
+        self.assertEqual(caching.fetch(self.key, self.compute('other'), timeout=60, beta=0), 'fresh')
+        self.assertEqual(self.calls, ['fresh'])
+        self.assertEqual(caching.stats(), {'hit': 1, 'miss': 1, 'stale': 0, 'coalesced': 0})
+
+    def test_stale_value_served_while_another_worker_refreshes(self):
+        caching._store(self.key, 'old', -1, 60, 0)
+        cache.add(caching.LOCK_PREFIX + self.key, 1)
+        self.assertEqual(caching.fetch(self.key, self.compute()), 'old')
+        self.assertEqual(self.calls, [])
+        self.assertEqual(caching.stats()['stale'], 1)
+
+    def test_expired_value_refreshed_by_one_worker(self):
+        caching._store(self.key, 'old', -1, 60, 0)
+        self.assertEqual(caching.fetch(self.key, self.compute()), 'fresh')
+        self.assertEqual(self.calls, ['fresh'])
+
+    def test_waits_for_the_worker_computing_it(self):
+        cache.add(caching.LOCK_PREFIX + self.key, 1)
+        # The other worker stores the value while this one waits
+        with mock.patch.object(caching.time, 'sleep', lambda seconds: caching._store(self.key, 'theirs', 60, 60, 0)):
+            self.assertEqual(caching.fetch(self.key, self.compute()), 'theirs')
+        self.assertEqual(self.calls, [])
+        self.assertEqual(caching.stats()['coalesced'], 1)
+
+    def test_none_is_not_cached(self):
+        caching.fetch(self.key, self.compute(None))
+        caching.fetch(self.key, self.compute(None))
+        self.assertEqual(self.calls, [None, None])
@@ -1,26 +1,32 @@
 from django.urls import path
-from wandercritic import views
+from wandercritic import async_views, views
 from django.conf import settings
-from django.conf.urls.static import static
 
 app_name = 'wandercritic' 
 
+# Read-heavy pages have async implementations, used under ASGI
+pages = async_views if settings.ASYNC_VIEWS else views
+
 urlpatterns = [
-    path('', views.index, name='index'),
-    path('explore/', views.explore, name='explore'),
+    path('', pages.index, name='index'),
+    path('explore/', pages.explore, name='explore'),
+    path('explore/more/', views.explore_more, name='explore_more'),
+    path('explore/suggest/', views.search_suggestions, name='search_suggestions'),
     path('about/', views.about, name='about'),
     path('contact/', views.contact, name='contact'),
     path('become-agent/', views.become_agent, name='become_agent'),
     path('policies/<str:policy_type>/', views.policy, name='policy'),
     
     # Place URLs
-    path('places/', views.place_list, name='place_list'),
+    path('places/', pages.place_list, name='place_list'),
+    path('places/more/', views.place_list_more, name='place_list_more'),
     path('places/create/', views.place_create, name='place_create'),
-    path('places/<slug:slug>/', views.place_detail, name='place_detail'),
+    path('places/<slug:slug>/', pages.place_detail, name='place_detail'),
+    path('places/<slug:slug>/reviews/', views.place_reviews_more, name='place_reviews_more'),
     path('places/<slug:slug>/edit/', views.place_edit, name='place_edit'),
     path('places/<slug:slug>/delete/', views.place_delete, name='place_delete'),
     path('places/<slug:slug>/report/', views.report_place, name='report_place'),
-    path('my-places/', views.my_places, name='my_places'),
+    path('my-places/', pages.my_places, name='my_places'),
     path('places/<slug:slug>/reviews/<int:review_id>/delete/', views.review_delete, name='review_delete'),
     path('reports/', views.manage_reports, name='manage_reports'),
     path('about/', views.about_us, name='about_us'),
@@ -33,6 +39,8 @@ urlpatterns = [
     path('manage/reports/', views.admin_reports, name='admin_reports'),
     path('manage/reports/<int:report_id>/<str:action>/', 
          views.admin_report_action, name='admin_report_action'),
+    path('manage/reports/queue/', views.admin_report_queue, name='admin_report_queue'),
+    path('manage/reports/queue/<str:action>/', views.admin_report_group_action, name='admin_report_group_action'),
     
     # Website Review URLs
     path('review/', views.add_website_review, name='add_website_review'),
@@ -44,5 +52,5 @@ urlpatterns = [
     # Profile URLs
     path('profile/edit/', views.edit_profile, name='edit_profile'),
     path('profile/change-password/', views.change_password, name='change_password'),
-] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+]
 
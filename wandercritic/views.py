@@ -1,95 +1,182 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.http import HttpResponseForbidden
+from django.http import HttpResponseForbidden, JsonResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.contrib.auth import get_user_model
-from django.db.models import Avg
-from .models import Place, PlaceImage, TravelAgentApplication, Report, Review, PlaceCategory, Tag, WebsiteReview
+from .models import EXPLORE_ORDERING, Place, PlaceImage, TravelAgentApplication, Report, Review, PlaceCategory, Tag, WebsiteReview
 from .forms import (PlaceForm, PlaceImageForm, TravelAgentApplicationForm, ReportForm, ReportReviewForm, BugReportForm,
     WebsiteReviewForm, UserProfileForm, TravelAgentProfileForm, PasswordChangeForm)
-from django.core.paginator import Paginator
+from django.conf import settings
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import require_POST
+from . import autocomplete, bitmap_index, caching, facets, moderation, ratings, search
+from .caching import cache_anonymous
+from . import surrogate
+from .conditional import catalogue_version, conditional_page, homepage_version, place_version
+from .instrumentation import query_budget
+from .pagination import InvalidCursor, KeysetPaginator
 from urllib.parse import urlparse
 
 def is_superuser(user):
     return user.is_superuser
 
+# Fields rendered by a place card
+PLACE_CARD_FIELDS = (
+    'name', 'slug', 'image', 'image_renditions', 'location', 'short_description', 'average_rating',
+    'total_ratings', 'created_at', 'created_by__username', 'created_by__first_name',
+    'created_by__last_name',
+)
+
+@query_budget(9)
+@conditional_page(homepage_version)
+@cache_anonymous('places', 'website_reviews')
 def index(request):
-    places = Place.objects.annotate(
-        avg_rating=Avg('review__rating')
-    ).order_by('-avg_rating', '-created_at')[:5]  # Get top 5 rated places
-    website_reviews = WebsiteReview.objects.filter(is_visible=True).order_by('-created_at')[:3]  # Get latest 3 reviews
-    return render(request, 'wandercritic/index.html', {
+    # Top 5 rated places, read in order from place_rating_created_idx
+    places = Place.objects.select_related('created_by').only(*PLACE_CARD_FIELDS).order_by(
+        *EXPLORE_ORDERING
+    )[:5]
+    website_reviews = WebsiteReview.objects.filter(is_visible=True).select_related('user').order_by('-created_at')[:3]  # Get latest 3 reviews
+    response = render(request, 'wandercritic/index.html', {
         'places': places,
         'website_reviews': website_reviews
     })
+    # The places may come from a cached fragment; their ids are one indexed query
+    return surrogate.tag(response, surrogate.HOMEPAGE_TOP, surrogate.WEBSITE_REVIEWS,
+                         *map(surrogate.place_key, places.values_list('pk', flat=True)))
+
+# Keyset orderings, each ending in a unique column (EXPLORE_ORDERING is in models)
+PLACE_LIST_ORDERING = ('-created_at', '-id')
+REVIEW_ORDERING = ('-created_at', '-id')
+
+
+def _searched_places(params):
+    places = Place.objects.select_related('created_by')
+    search_query = params.get('search', '')
+    if search_query:
+        places = search.search_places(places, search_query)
+    return places
+
+
+def _explore_places(params):
+    """Filtered explore queryset and its keyset ordering for the GET ``params``."""
+    places = facets.filter_places(_searched_places(params), facets.FacetSelection.from_params(params))
+
+    ordering = EXPLORE_ORDERING
+    if 'search_rank' in places.query.annotations:
+        # Best full-text matches first (bm25/ts_rank, lower is better)
+        ordering = ('search_rank',) + ordering
+    return places, ordering
+
+
+def _explore_page(params, cursor=None):
+    """
+    A page of explore results. Without a search query the filtering and
+    ordering are done by the in-memory bitmap index and only the page's rows
+    are loaded; raises ``InvalidCursor``.
+    """
+    index = None if params.get('search') else bitmap_index.get_index()
+    if index is not None:
+        return index.page(_searched_places(params), facets.FacetSelection.from_params(params), cursor)
+    places, ordering = _explore_places(params)
+    return KeysetPaginator(places, ordering).page(cursor)
+
+
+def _explore_facet_counts(params, selection):
+    search_query = params.get('search', '')
+    index = None if search_query else bitmap_index.get_index()
+    if index is not None:
+        return index.facet_counts(selection)
+    return caching.fetch(
+        caching.versioned_key(f'facets:{search_query}|{selection.key}', 'places', 'terms'),
+        lambda: facets.facet_counts(_searched_places(params), selection),
+    )
+
+
+def _keyset_page(request, queryset, ordering, page_size=None):
+    paginator = KeysetPaginator(queryset, ordering, page_size)
+    try:
+        return paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return paginator.page()
+
+
+def _page_urls(request, page, view_name, more_view_name, args=()):
+    """Links to the next page as HTML (no-JS fallback) and as JSON."""
+    if not page.has_next:
+        return {'next_page_url': None, 'more_url': None}
+    params = request.GET.copy()
+    params['cursor'] = page.next_cursor
+    query = params.urlencode()
+    return {
+        'next_page_url': f"{reverse(view_name, args=args)}?{query}",
+        'more_url': f"{reverse(more_view_name, args=args)}?{query}",
+    }
+
 
+def _more_response(request, html, page, view_name, more_view_name, args=()):
+    return JsonResponse({
+        'html': html,
+        'count': len(page),
+        'next_cursor': page.next_cursor,
+        **_page_urls(request, page, view_name, more_view_name, args),
+    })
+
+
+def _cards_response(request, page, view_name, more_view_name):
+    html = render_to_string('wandercritic/includes/place_cards.html', {'places': page}, request=request)
+    return _more_response(request, html, page, view_name, more_view_name)
+
+
+@query_budget(9)
+@conditional_page(catalogue_version)
+@cache_anonymous('places', 'terms')
 def explore(request):
-    places = Place.objects.all()
+    try:
+        page = _explore_page(request.GET, request.GET.get('cursor'))
+    except InvalidCursor:
+        page = _explore_page(request.GET)
+
+    # Match counts for every filter option under the current search and filters
+    selection = facets.FacetSelection.from_params(request.GET)
     search_query = request.GET.get('search', '')
-    category = request.GET.get('category', '')
-    tag = request.GET.get('tag', '')
-    budget_range = request.GET.get('budget_range', '')
-    
-    if search_query:
-        places = places.filter(name__icontains=search_query) | \
-                places.filter(description__icontains=search_query) | \
-                places.filter(location__icontains=search_query)
-    
-    if category:
-        places = places.filter(categories__name=category)
-    
-    if tag:
-        places = places.filter(tags__name=tag)
-    
-    if budget_range:
-        ranges = {
-            '0-10': (0, 10),
-            '11-20': (11, 20),
-            '21-50': (21, 50),
-            '51-100': (51, 100),
-            '101-200': (101, 200),
-            '201+': (201, 999999)
-        }
-        if budget_range in ranges:
-            min_val, max_val = ranges[budget_range]
-            if budget_range == '201+':
-                places = places.filter(budget__gte=min_val)
-            else:
-                places = places.filter(budget__range=(min_val, max_val))
-    
-    # Get all categories and tags for filters
-    categories = PlaceCategory.objects.all()
-    tags = Tag.objects.all()
-    
-    # Define budget ranges for the template
-    budget_ranges = [
-        ('0-10', '£0 - £10'),
-        ('11-20', '£11 - £20'),
-        ('21-50', '£21 - £50'),
-        ('51-100', '£51 - £100'),
-        ('101-200', '£101 - £200'),
-        ('201+', '£201+')
-    ]
-    
-    places = places.annotate(
-        avg_rating=Avg('review__rating')
-    ).order_by('-avg_rating', '-created_at').distinct()
-    
+    counts = _explore_facet_counts(request.GET, selection)
+
     context = {
-        'places': places,
-        'categories': categories,
-        'tags': tags,
+        'places': page,
+        'facets': facets.facet_options(counts, selection, PlaceCategory.objects.all(), Tag.objects.all()),
+        'selection': selection,
         'search_query': search_query,
-        'selected_category': category,
-        'selected_tag': tag,
-        'budget_ranges': budget_ranges,
-        'selected_budget_range': budget_range
+        **_page_urls(request, page, 'wandercritic:explore', 'wandercritic:explore_more'),
     }
-    return render(request, 'wandercritic/explore.html', context)
+    response = render(request, 'wandercritic/explore.html', context)
+    return surrogate.tag(response, surrogate.EXPLORE, *surrogate.place_keys(page))
+
+@query_budget(4)
+@cache_anonymous('places', 'terms')
+def explore_more(request):
+    try:
+        page = _explore_page(request.GET, request.GET.get('cursor'))
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    return _cards_response(request, page, 'wandercritic:explore', 'wandercritic:explore_more')
+
+@query_budget(4)
+@cache_control(max_age=60)
+def search_suggestions(request):
+    query = request.GET.get('q', '')
+    suggestions = autocomplete.suggest(query)
+    return JsonResponse({
+        'query': query,
+        'suggestions': [suggestion.as_json(typo) for suggestion, typo in suggestions],
+    })
 
+@cache_anonymous()
 def about(request):
     return render(request, 'wandercritic/about.html')
 
+@cache_anonymous()
 def contact(request):
     return render(request, 'wandercritic/contact.html')
 
@@ -125,17 +212,22 @@ def become_agent(request):
     
     return render(request, 'wandercritic/become_agent.html', {'form': form})
 
+@query_budget(6)
 @login_required
 def manage_reports(request):
     # Get all reports submitted by the user
-    reports = Report.objects.filter(reporter=request.user).order_by('-created_at')
+    reports = Report.objects.filter(reporter=request.user).select_related(
+        'place', 'review__place', 'resolved_by'
+    ).order_by('-created_at')
     return render(request, 'wandercritic/manage_reports.html', {
         'reports': reports
     })
 
+@cache_anonymous()
 def about_us(request):
     return render(request, 'wandercritic/about.html')
 
+@cache_anonymous()
 def contact_us(request):
     return render(request, 'wandercritic/contact.html')
 
@@ -147,15 +239,9 @@ def review_delete(request, slug, review_id):
     if not (request.user == review.user or request.user.is_superuser):
         return HttpResponseForbidden("You don't have permission to delete this review.")
     
-    # Store place reference before deleting review
-    place = review.place
-    
-    # Delete the review
+    # Delete the review (the place rating counters are adjusted on delete)
     review.delete()
     
-    # Update place rating
-    place.update_rating()
-    
     messages.success(request, 'Review deleted successfully.')
     return redirect('wandercritic:place_detail', slug=slug)
 
@@ -208,45 +294,130 @@ def report_review(request, slug, review_id):
     })
 
 
+@cache_anonymous()
 def policy(request, policy_type):
     template_name = f'wandercritic/policies/{policy_type}.html'
     return render(request, template_name)
 
+@query_budget(5)
+@conditional_page(catalogue_version)
+@cache_anonymous('places')
 def place_list(request):
-    places = Place.objects.all().order_by('-created_at')
-    return render(request, 'wandercritic/place_list.html', {'places': places})
+    places = Place.objects.select_related('created_by')
+    page = _keyset_page(request, places, PLACE_LIST_ORDERING)
+    response = render(request, 'wandercritic/place_list.html', {
+        'places': page,
+        **_page_urls(request, page, 'wandercritic:place_list', 'wandercritic:place_list_more'),
+    })
+    return surrogate.tag(response, surrogate.PLACE_LIST, *surrogate.place_keys(page))
+
+@query_budget(4)
+@cache_anonymous('places')
+def place_list_more(request):
+    places = Place.objects.select_related('created_by')
+    try:
+        page = KeysetPaginator(places, PLACE_LIST_ORDERING).page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    return _cards_response(request, page, 'wandercritic:place_list', 'wandercritic:place_list_more')
+
+def _place_reviews(user, place):
+    """Reviews of ``place`` by users other than ``user``, newest first (review_place_created_idx)."""
+    reviews = Review.objects.filter(place=place).select_related('user')
+    if user.is_authenticated:
+        # The user's own review is shown separately
+        reviews = reviews.exclude(user=user)
+    return KeysetPaginator(reviews, REVIEW_ORDERING, settings.REVIEWS_PAGE_SIZE)
+
+
+def _review_rating(value):
+    """The posted ``value`` as one of ``Review.RATING_CHOICES``, or None."""
+    try:
+        rating = int(value)
+    except (TypeError, ValueError):
+        return None
+    return rating if rating in dict(Review.RATING_CHOICES) else None
+
+
+def _post_review(request, place):
+    """
+    Save the review posted on the place detail page (shared with the async
+    view); the redirect to answer with, or None when no review was posted.
+    """
+    rating = request.POST.get('rating')
+    comment = request.POST.get('comment')
+    if not (rating and comment):
+        return None
+    if _review_rating(rating) is None:
+        messages.error(request, 'Please pick a rating from 1 to 5.')
+    else:
+        Review.objects.update_or_create(
+            place=place,
+            user=request.user,
+            defaults={
+                'rating': _review_rating(rating),
+                'comment': comment
+            }
+        )
+        messages.success(request, 'Your review has been posted!')
+    return redirect('wandercritic:place_detail', slug=place.slug)
+
+
+def _place_detail_keys(place):
+    return [
+        surrogate.place_key(place.pk),
+        *(surrogate.category_key(category.pk) for category in place.categories.all()),
+        *(surrogate.tag_key(tag.pk) for tag in place.tags.all()),
+    ]
 
+
+@query_budget(9)
+@conditional_page(place_version)
+@cache_anonymous('place:{slug}', 'terms')
 def place_detail(request, slug):
-    place = get_object_or_404(Place, slug=slug)
-    images = place.images.all()
+    # Everything the page shows about the place, in a fixed number of queries
+    # however many reviews it has
+    place = get_object_or_404(
+        Place.objects.select_related('created_by').prefetch_related('images', 'categories', 'tags'),
+        slug=slug,
+    )
     user_review = None
     if request.user.is_authenticated:
         user_review = Review.objects.filter(place=place, user=request.user).first()
 
     if request.method == 'POST' and request.user.is_authenticated:
-        rating = request.POST.get('rating')
-        comment = request.POST.get('comment')
-        
-        if rating and comment:
-            review, created = Review.objects.update_or_create(
-                place=place,
-                user=request.user,
-                defaults={
-                    'rating': rating,
-                    'comment': comment
-                }
-            )
-            messages.success(request, 'Your review has been posted!')
-            return redirect('wandercritic:place_detail', slug=slug)
-
-    reviews = Review.objects.filter(place=place).select_related('user')
-    return render(request, 'wandercritic/place_detail.html', {
+        response = _post_review(request, place)
+        if response is not None:
+            return response
+
+    paginator = _place_reviews(request.user, place)
+    try:
+        reviews = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        reviews = paginator.page()
+    response = render(request, 'wandercritic/place_detail.html', {
         'place': place,
-        'images': images,
+        'images': place.images.all(),
         'user_review': user_review,
         'reviews': reviews,
+        'rating_histogram': ratings.histogram(place),
         'rating_choices': Review.RATING_CHOICES,
+        **_page_urls(request, reviews, 'wandercritic:place_detail', 'wandercritic:place_reviews_more', [slug]),
     })
+    return surrogate.tag(response, *_place_detail_keys(place))
+
+@query_budget(4)
+@cache_anonymous('place:{slug}')
+def place_reviews_more(request, slug):
+    place = get_object_or_404(Place.objects.only('pk', 'slug'), slug=slug)
+    try:
+        reviews = _place_reviews(request.user, place).page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    html = render_to_string('wandercritic/includes/review_cards.html', {'reviews': reviews, 'place': place},
+                            request=request)
+    return _more_response(request, html, reviews, 'wandercritic:place_detail',
+                          'wandercritic:place_reviews_more', [slug])
 
 @login_required
 def place_create(request):
@@ -312,11 +483,14 @@ def my_places(request):
         }
     else:
         # Otherwise show the current user's places
+        agent = request.user
         places = Place.objects.filter(created_by=request.user).order_by('-created_at')
         context = {
             'places': places
         }
-    return render(request, 'wandercritic/my_places.html', context)
+    response = render(request, 'wandercritic/my_places.html', context)
+    # The template has loaded the places
+    return surrogate.tag(response, surrogate.agent_key(agent.pk), *surrogate.place_keys(places))
 
 @login_required
 def place_delete(request, slug):
@@ -336,9 +510,11 @@ def place_delete(request, slug):
     
     return render(request, 'wandercritic/place_delete.html', {'place': place})
 
+@query_budget(6)
 @user_passes_test(is_superuser)
 def admin_applications(request):
-    applications = TravelAgentApplication.objects.filter(status='pending')
+    # Oldest first, read from application_pending_idx
+    applications = TravelAgentApplication.objects.filter(status='pending').select_related('user').order_by('created_at')
     return render(request, 'wandercritic/admin/applications.html', {
         'applications': applications
     })
@@ -356,38 +532,80 @@ def admin_application_action(request, application_id, action):
     
     return redirect('wandercritic:admin_applications')
 
+def _next_page_url(request, page):
+    if not page.has_next:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = page.next_cursor
+    return f'?{params.urlencode()}'
+
+@query_budget(6)
 @user_passes_test(is_superuser)
 def admin_reports(request):
-    reports = Report.objects.all().order_by('-created_at')
-    paginator = Paginator(reports, 10)  # 10 cards
-    page_number = request.GET.get('page')
-    reports_page = paginator.get_page(page_number)
+    # Newest first, read from report_status_created_idx (report_created_idx for all)
+    status = request.GET.get('status')
+    reports = Report.objects.select_related('place', 'reporter', 'resolved_by')
+    if status in dict(Report.STATUS_CHOICES):
+        reports = reports.filter(status=status)
+    else:
+        status = None
+    page = _keyset_page(request, reports, moderation.REPORT_ORDERING, settings.MODERATION_REPORTS_PAGE_SIZE)
 
     return render(request, 'wandercritic/admin/reports.html', {
-        'reports': reports_page,
-        'page_obj': reports_page
+        'reports': page,
+        'status': status,
+        'statuses': Report.STATUS_CHOICES,
+        'next_page_url': _next_page_url(request, page),
+    })
+
+
+@query_budget(7)
+@user_passes_test(is_superuser)
+def admin_report_queue(request):
+    try:
+        page = moderation.queue(request.GET.get('cursor'))
+    except InvalidCursor:
+        page = moderation.queue()
+
+    return render(request, 'wandercritic/admin/report_queue.html', {
+        'groups': page,
+        'next_page_url': _next_page_url(request, page),
     })
 
 
 @user_passes_test(is_superuser)
 def admin_report_action(request, report_id, action):
-    report = get_object_or_404(Report, id=report_id)
-    
-    if report.place:
-        place_name = report.place.name
-    elif report.content_type == 'bug':
-        place_name = f"Bug on {report.url}"
+    if action not in moderation.ACTIONS:
+        return redirect('wandercritic:admin_reports')
+    content_type, place_name, url = get_object_or_404(
+        Report.objects.values_list('content_type', 'place__name', 'url'), id=report_id
+    )
+
+    if not place_name:
+        place_name = f"Bug on {url}" if content_type == 'bug' else "Unknown Report"
+    if moderation.close(Report.objects.filter(id=report_id), action, request.user):
+        messages.success(request, f"Report on {place_name} has been {moderation.ACTIONS[action]}.")
     else:
-        place_name = "Unknown Report"
-    if action == 'resolve':
-        report.resolve(request.user)
-        messages.success(request, f"Report on {place_name} has been resolved.")
-    elif action == 'dismiss':
-        report.dismiss(request.user)
-        messages.success(request, f"Report on {place_name} has been dismissed.")
-    
+        messages.info(request, f"Report on {place_name} had already been handled.")
+
     return redirect('wandercritic:admin_reports')
 
+
+@require_POST
+@user_passes_test(is_superuser)
+def admin_report_group_action(request, action):
+    try:
+        target = moderation.Target.parse(request.POST.get('target', ''))
+    except ValueError:
+        target = None
+    if target is None or action not in moderation.ACTIONS:
+        messages.error(request, "Unknown report group or action.")
+        return redirect('wandercritic:admin_report_queue')
+
+    closed = moderation.close_group(target, action, request.user)
+    messages.success(request, f"{closed} report{'s' if closed != 1 else ''} {moderation.ACTIONS[action]}.")
+    return redirect('wandercritic:admin_report_queue')
+
 @login_required
 def edit_profile(request):
     if request.user.is_travel_agent: